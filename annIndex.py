@@ -0,0 +1,225 @@
+# File: annIndex.py
+# Description: Approximate nearest-neighbour search over normalised embeddings
+# (voice embeddings, face feature vectors), in NumPy.
+#
+# An IVF index: k-means splits the gallery into nlist cells and a query only
+# scans the nprobe cells whose centroids are closest, so search time grows with
+# nprobe / nlist of the gallery instead of all of it. Raising nprobe trades
+# speed for recall (nprobe = nlist is exact). With product quantization
+# (pq_subvectors > 0) each vector is stored as one byte per subvector and scored
+# from lookup tables, which cuts memory and scan cost further at some recall.
+#
+# Similarity is the inner product, i.e. cosine similarity for normalised vectors.
+
+import numpy as np
+
+import embeddingStore
+
+
+def kmeans(vectors, clusters, iterations=20, seed=0):
+    """Lloyd's k-means (squared L2). Returns the (clusters, dimension) centroids."""
+    generator = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    clusters = min(clusters, len(vectors))
+    centroids = vectors[generator.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroids(vectors, centroids)
+        counts = np.bincount(assignment, minlength=clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # an empty cell restarts from a random point
+        centroids[empty] = vectors[generator.choice(len(vectors), int(empty.sum()))]
+    return centroids
+
+
+def nearest_centroids(vectors, centroids, count=1):
+    """Index of the closest centroid (or the `count` closest, nearest first) for every vector."""
+    distances = (np.einsum("ij,ij->i", centroids, centroids)[None, :] - 2.0 * (vectors @ centroids.T))
+    if count == 1:
+        return np.argmin(distances, axis=1)
+    count = min(count, centroids.shape[0])
+    closest = np.argpartition(distances, count - 1, axis=1)[:, :count]
+    order = np.take_along_axis(distances, closest, axis=1).argsort(axis=1)
+    return np.take_along_axis(closest, order, axis=1)
+
+
+class _InvertedList:
+    """Growable arrays of the ids and stored vectors (or PQ codes) of one cell."""
+    __slots__ = ("ids", "data", "size")
+
+    def __init__(self, width, dtype):
+        self.ids = np.empty(16, dtype=np.int64)
+        self.data = np.empty((16, width), dtype=dtype)
+        self.size = 0
+
+    def append(self, ids, data):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, 2 * len(self.ids))
+            self.ids = np.resize(self.ids, capacity)
+            grown = np.empty((capacity, self.data.shape[1]), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.ids[self.size:needed] = ids
+        self.data[self.size:needed] = data
+        first = self.size
+        self.size = needed
+        return first
+
+    def remove(self, position):
+        """Swaps the last entry into `position`; returns the id that moved (or None)."""
+        last = self.size - 1
+        moved = None
+        if position != last:
+            self.ids[position] = self.ids[last]
+            self.data[position] = self.data[last]
+            moved = int(self.ids[position])
+        self.size = last
+        return moved
+
+
+class IVFIndex:
+    """Inverted-file index with a k-means coarse quantizer and optional PQ codes."""
+
+    def __init__(self, dimension, nlist=64, nprobe=8, pq_subvectors=0, pq_bits=8, seed=0):
+        if pq_subvectors and dimension % pq_subvectors:
+            raise ValueError(f"dimension {dimension} is not divisible into {pq_subvectors} subvectors")
+        if not 1 <= pq_bits <= 8:
+            raise ValueError("pq_bits must be between 1 and 8")
+        self.dimension = dimension
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_subvectors = pq_subvectors
+        self.pq_bits = pq_bits
+        self.seed = seed
+        self.centroids = None
+        self.codebooks = None  # (subvectors, 2**bits, dimension / subvectors) for the residuals
+        self.lists = []
+        self.positions = {}  # id -> (cell, position in the cell)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def train(self, vectors, iterations=20):
+        """Learns the cells (and PQ codebooks) from a sample of the gallery."""
+        vectors = embeddingStore.normalize(vectors)
+        self.centroids = kmeans(vectors, self.nlist, iterations, self.seed)
+        self.nlist = len(self.centroids)
+        if self.pq_subvectors:
+            residuals = vectors - self.centroids[nearest_centroids(vectors, self.centroids)]
+            width = self.dimension // self.pq_subvectors
+            self.codebooks = np.stack([
+                kmeans(residuals[:, m * width:(m + 1) * width], 2 ** self.pq_bits, iterations, self.seed + m)
+                for m in range(self.pq_subvectors)])
+            if self.codebooks.shape[1] < 2 ** self.pq_bits:
+                raise ValueError(f"PQ needs at least {2 ** self.pq_bits} training vectors")
+            self.lists = [_InvertedList(self.pq_subvectors, np.uint8) for _ in range(self.nlist)]
+        else:
+            self.lists = [_InvertedList(self.dimension, np.float32) for _ in range(self.nlist)]
+        self.positions = {}
+        return self
+
+    def _encode(self, residuals):
+        width = self.dimension // self.pq_subvectors
+        codes = np.empty((len(residuals), self.pq_subvectors), dtype=np.uint8)
+        for m in range(self.pq_subvectors):
+            codes[:, m] = nearest_centroids(residuals[:, m * width:(m + 1) * width], self.codebooks[m])
+        return codes
+
+    def add(self, ids, vectors):
+        """Adds vectors under the given ids (an id that is already present, or given
+        again later in ids, is replaced)."""
+        if not self.trained:
+            raise RuntimeError("Train the index before adding vectors")
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        vectors = embeddingStore.normalize(vectors)
+        if len(np.unique(ids)) < len(ids):
+            # an id given more than once keeps its last vector, as if added one at a time;
+            # otherwise the earlier copies would stay in their cells without a position
+            _, last = np.unique(ids[::-1], return_index=True)
+            keep = np.sort(len(ids) - 1 - last)
+            ids, vectors = ids[keep], vectors[keep]
+        self.remove([user_id for user_id in ids.tolist() if user_id in self.positions])
+        cells = nearest_centroids(vectors, self.centroids)
+        data = self._encode(vectors - self.centroids[cells]) if self.pq_subvectors else vectors
+        for cell in np.unique(cells):
+            members = np.flatnonzero(cells == cell)
+            first = self.lists[cell].append(ids[members], data[members])
+            for offset, user_id in enumerate(ids[members].tolist()):
+                self.positions[user_id] = (int(cell), first + offset)
+
+    def remove(self, ids):
+        """Removes ids from the index; unknown ids are ignored. Returns how many were removed."""
+        removed = 0
+        for user_id in np.atleast_1d(np.asarray(ids, dtype=np.int64)).tolist():
+            location = self.positions.pop(user_id, None)
+            if location is None:
+                continue
+            cell, position = location
+            moved = self.lists[cell].remove(position)
+            if moved is not None:
+                self.positions[moved] = (cell, position)
+            removed += 1
+        return removed
+
+    def search(self, query, k=5, nprobe=None):
+        """Top-k (ids, similarities) for one query vector, scanning `nprobe` cells."""
+        ids, scores = self.search_batch(np.atleast_2d(query), k, nprobe)
+        return ids[0], scores[0]
+
+    def search_batch(self, queries, k=5, nprobe=None):
+        """Top-k for several queries: (queries, k) arrays of ids and similarities (-1 / -inf pad)."""
+        queries = embeddingStore.normalize(queries)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probes = nearest_centroids(queries, self.centroids, nprobe).reshape(len(queries), -1)
+        result_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for row, (query, cells) in enumerate(zip(queries, probes)):
+            candidates, scores = [], []
+            if self.pq_subvectors:
+                width = self.dimension // self.pq_subvectors
+                # inner products of each query subvector with every codeword
+                table = np.einsum("mkw,mw->mk", self.codebooks, query.reshape(self.pq_subvectors, width))
+            for cell in cells:
+                cell_list = self.lists[cell]
+                if cell_list.size == 0:
+                    continue
+                data = cell_list.data[:cell_list.size]
+                if self.pq_subvectors:
+                    cell_scores = query @ self.centroids[cell] + \
+                        table[np.arange(self.pq_subvectors), data.astype(np.intp)].sum(axis=1)
+                else:
+                    cell_scores = data @ query
+                candidates.append(cell_list.ids[:cell_list.size])
+                scores.append(cell_scores)
+            if not candidates:
+                continue
+            candidates, scores = np.concatenate(candidates), np.concatenate(scores)
+            top = min(k, len(scores))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            result_ids[row, :top] = candidates[best]
+            result_scores[row, :top] = scores[best]
+        return result_ids, result_scores
+
+    @classmethod
+    def from_store(cls, store, nlist=None, **options):
+        """Trains and fills an index with the live rows of an embeddingStore gallery.
+
+        nlist defaults to about 4 * sqrt(rows), the usual IVF sizing.
+        """
+        store.refresh()
+        live = store.live()
+        ids, vectors = np.asarray(store.ids[live]), np.asarray(store.matrix[live])
+        nlist = nlist or max(1, int(4 * np.sqrt(len(ids))))
+        index = cls(store.dimension, nlist=nlist, **options)
+        if len(ids):
+            index.train(vectors)
+            index.add(ids, vectors)
+        return index
@@ -0,0 +1,211 @@
+# File: audit.py
+# Description: Offline audit of the whole user base for biometric collisions:
+# pairs of users whose voices or faces are close enough that one could pass the
+# other's check. Same thresholds as the registration-time duplicateCheck.py.
+#
+# All N * (N - 1) / 2 pairs are scored with NumPy matrix products over blocks
+# of block_size users, so memory stays at a few block_size x block_size
+# matrices whatever N is. Blocks can be spread over worker processes, which map
+# the vectors from a temporary .npy file instead of receiving copies.
+# Offending pairs are written as JSON lines as soon as their block is done.
+# Face pairs are screened with the projection estimate of their MSE and then
+# re-scored exactly, as the duplicate check scores them, when both templates
+# are images; pairs with a projection template keep the estimate.
+# With a sharded user store (userStore.py) the users of every shard are audited
+# together, under their global ids.
+#
+#   python audit.py --db user_auth.db --kind face --workers 4 --output collisions.jsonl
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import duplicateCheck
+import embeddingStore
+import faceTemplate
+import userStore
+
+BLOCK_SIZE = 2048  # a 2048 x 2048 float32 score block is 16 MB
+PIXELS = faceTemplate.FEATURE_SHAPE[0] * faceTemplate.FEATURE_SHAPE[1]
+
+THRESHOLDS = {"voice": duplicateCheck.VOICE_DUPLICATE_SIMILARITY, "face": duplicateCheck.FACE_DUPLICATE_MSE}
+# the estimate came out at up to 1.4x the exact MSE on the bench fixtures, so face
+# pairs are screened up to this multiple of the threshold before rescore_faces
+FACE_SCREEN_MARGIN = 1.5
+RESCORE_BATCH = 1024  # screened pairs whose templates are fetched at once
+
+
+def _voice_gallery(partition):
+    path = embeddingStore.default_path(partition.path, "voice")
+    embeddingStore.sync(partition.path, "voice", path)
+    if not os.path.exists(path + ".emb"):
+        return None
+    store = embeddingStore.EmbeddingStore(path)
+    live = store.live()
+    ids, vectors = np.asarray(store.ids[live]), np.asarray(store.matrix[live])
+    # a user appended twice (a sync racing a registration) is audited once, newest row
+    _, last = np.unique(ids[::-1], return_index=True)
+    keep = np.sort(len(ids) - 1 - last)
+    return partition.global_id(ids[keep]), vectors[keep]
+
+
+def load_vectors(store, kind):
+    """(user ids, float32 vectors) of every user enrolled with this biometric.
+
+    Voices come from the (synced) embedding gallery of each database file, so
+    only new users are embedded. Faces are the unnormalised projections of the
+    stored templates, whose distances estimate the pixel MSE.
+    """
+    if kind == "voice":
+        galleries = [gallery for gallery in store.fan_out(_voice_gallery) if gallery is not None]
+        if not galleries:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+        return (np.concatenate([ids for ids, _ in galleries]).astype(np.int64),
+                np.concatenate([vectors for _, vectors in galleries]))
+
+    ids, vectors = [], []
+    for user in store.iterate_users(("id", "face")):
+        if user["face"] is not None:
+            ids.append(user["id"])
+            vectors.append(faceTemplate.feature_vector(user["face"]))
+    return np.array(ids, dtype=np.int64), np.array(vectors, dtype=np.float32).reshape(len(ids), -1)
+
+
+def score_block(vectors, norms, kind, threshold, rows, columns):
+    """Offending pairs between two blocks: (row indices, column indices, scores).
+
+    Voice scores are cosine similarities (flagged at >= threshold); face scores
+    are estimated MSEs, ||a||^2 + ||b||^2 - 2 a.b over the pixel count (flagged
+    at <= threshold). A diagonal block only reports each pair once.
+    """
+    (row_start, row_end), (column_start, column_end) = rows, columns
+    products = vectors[row_start:row_end] @ vectors[column_start:column_end].T
+    if kind == "voice":
+        scores = products
+        hits = scores >= threshold
+    else:
+        scores = (norms[row_start:row_end, None] + norms[None, column_start:column_end] - 2.0 * products) / PIXELS
+        hits = scores <= threshold
+    if rows == columns:
+        hits = np.triu(hits, 1)
+    i, j = np.nonzero(hits)
+    return i + row_start, j + column_start, scores[i, j]
+
+
+def rescore_faces(store, pairs, threshold=None):
+    """Yields the screened face pairs (id a, id b, estimate) still at or under
+    the threshold, scored with faceTemplate.distance when both are image templates."""
+    threshold = THRESHOLDS["face"] if threshold is None else threshold
+    pairs = iter(pairs)
+    while True:
+        chunk = list(itertools.islice(pairs, RESCORE_BATCH))
+        if not chunk:
+            return
+        faces = {user["id"]: user["face"]
+                 for user in store.get_users(sorted({user_id for a, b, _ in chunk for user_id in (a, b)}),
+                                             ("id", "face"))}
+        images = {user_id: None if faceTemplate.read_header(face)["kind"] == "projection" else faceTemplate.decode(face)
+                  for user_id, face in faces.items()}
+        for user_a, user_b, score in chunk:
+            if images.get(user_a) is not None and images.get(user_b) is not None:
+                score = faceTemplate.distance(faces[user_a], images[user_b])
+            if score <= threshold:
+                yield user_a, user_b, score
+
+
+def _blocks(count, block_size):
+    bounds = [(start, min(start + block_size, count)) for start in range(0, count, block_size)]
+    return [(rows, columns) for index, rows in enumerate(bounds) for columns in bounds[index:]]
+
+
+_worker_state = {}
+
+
+def _init_worker(vectors_path, norms_path, kind, threshold):
+    _worker_state.update(vectors=np.load(vectors_path, mmap_mode="r"), norms=np.load(norms_path, mmap_mode="r"),
+                         kind=kind, threshold=threshold)
+
+
+def _score_task(block):
+    state = _worker_state
+    return score_block(state["vectors"], state["norms"], state["kind"], state["threshold"], *block)
+
+
+def audit_vectors(ids, vectors, kind, threshold=None, block_size=BLOCK_SIZE, workers=1):
+    """Yields (user id a, user id b, score) for every offending pair, block by block."""
+    threshold = THRESHOLDS[kind] if threshold is None else threshold
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if kind == "voice":
+        vectors = embeddingStore.normalize(vectors) if len(vectors) else vectors
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    blocks = _blocks(len(ids), block_size)
+
+    if workers <= 1 or len(blocks) <= 1:
+        results = (score_block(vectors, norms, kind, threshold, *block) for block in blocks)
+        for rows, columns, scores in results:
+            yield from zip(ids[rows].tolist(), ids[columns].tolist(), scores.tolist())
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        vectors_path, norms_path = os.path.join(directory, "vectors.npy"), os.path.join(directory, "norms.npy")
+        np.save(vectors_path, vectors)
+        np.save(norms_path, norms)
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers, initializer=_init_worker,
+                          initargs=(vectors_path, norms_path, kind, threshold)) as pool:
+            for rows, columns, scores in pool.imap_unordered(_score_task, blocks):
+                yield from zip(ids[rows].tolist(), ids[columns].tolist(), scores.tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan all pairs of users for voice or face collisions.")
+    parser.add_argument("--db", default="user_auth.db")
+    parser.add_argument("--shards", type=int, default=userStore.SHARDS, help="user store shard count")
+    parser.add_argument("--kind", choices=embeddingStore.KINDS + ("all",), default="all")
+    parser.add_argument("--threshold", type=float,
+                        help="override: minimum voice similarity, or maximum face MSE, of a collision")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    parser.add_argument("--workers", type=int, default=1, help="processes scoring blocks (1 = in this process)")
+    parser.add_argument("--output", help="JSON lines file for the offending pairs (default stdout)")
+    args = parser.parse_args()
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    store = userStore.open_store(args.db, args.shards)
+    usernames = {user["id"]: user["username"] for user in store.iterate_users(("id", "username"))}
+    try:
+        for kind in embeddingStore.KINDS if args.kind == "all" else (args.kind,):
+            start = time.perf_counter()
+            ids, vectors = load_vectors(store, kind)
+            loaded = time.perf_counter()
+            collisions = 0
+            threshold = THRESHOLDS[kind] if args.threshold is None else args.threshold
+            if kind == "face":
+                pairs = rescore_faces(store, audit_vectors(ids, vectors, kind, threshold * FACE_SCREEN_MARGIN,
+                                                           args.block_size, args.workers), threshold)
+            else:
+                pairs = audit_vectors(ids, vectors, kind, threshold, args.block_size, args.workers)
+            for user_a, user_b, score in pairs:
+                output.write(json.dumps({"kind": kind, "users": [user_a, user_b],
+                                         "usernames": [usernames.get(user_a), usernames.get(user_b)],
+                                         "score": round(score, 4)}) + "\n")
+                collisions += 1
+            output.flush()
+            elapsed = time.perf_counter() - loaded
+            pairs = len(ids) * (len(ids) - 1) // 2
+            print(f"{kind}: {len(ids)} users, {pairs} pairs in {elapsed:.2f} s "
+                  f"({pairs / max(elapsed, 1e-9):,.0f} pairs/s; loading took {loaded - start:.2f} s), "
+                  f"{collisions} collisions", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
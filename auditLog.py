@@ -0,0 +1,309 @@
+# File: auditLog.py
+# Description: Append-only audit log of authentication attempts: one entry per
+# factor with its outcome, score (voice/face distance) and duration.
+#
+# record() only puts the entry on a bounded queue, so the login flows (and the
+# GUI thread) never wait on disk. A background writer thread takes entries off
+# the queue in batches and appends them with one transaction per batch, to
+#
+#   a SQLite file (default auth_audit.db, table audit_log), or
+#   a JSON lines file when the path ends in .jsonl, rotated at MAX_BYTES
+#   (auth_audit.jsonl -> auth_audit.jsonl.1 ... .BACKUPS)
+#
+# If the queue is full (the disk can't keep up) entries are dropped and
+# counted rather than blocking a login, and so are batches that fail to
+# write. If the log can't be opened at all (an unwritable path) it is turned
+# off with a message, the entry counts as dropped and the login goes on.
+# flush() waits until everything queued is written; shutdown() flushes and
+# stops the writer, and runs at exit.
+#
+# AUTH_AUDIT_LOG sets the path ("off" disables the log).
+#
+#   python auditLog.py tail --log auth_audit.db -n 20
+#   python auditLog.py stats --log auth_audit.jsonl
+
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+DEFAULT_PATH = "auth_audit.db"
+QUEUE_SIZE = int(os.getenv("AUTH_AUDIT_QUEUE", "10000"))
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 0.5  # seconds an entry may wait for a batch to fill
+MAX_BYTES = int(os.getenv("AUTH_AUDIT_MAX_BYTES", str(10 * 1024 * 1024)))
+BACKUPS = 5
+
+FIELDS = ("ts", "attempt", "username", "factor", "ok", "score", "ms", "detail")
+
+path = os.getenv("AUTH_AUDIT_LOG", DEFAULT_PATH)
+enabled = path.lower() not in ("", "0", "off", "false", "no")
+
+_queue = None
+_writer = None
+_lock = threading.Lock()
+_dropped = 0
+_written = 0
+
+
+class SQLiteSink:
+    """Batches appended to the audit_log table of a SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS audit_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL,
+                attempt TEXT,
+                username TEXT,
+                factor TEXT,
+                ok INTEGER,
+                score REAL,
+                ms REAL,
+                detail TEXT
+            )
+        ''')
+        self.conn.commit()
+
+    def write(self, entries):
+        self.conn.executemany(f"INSERT INTO audit_log ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                              [tuple(entry.get(field) for field in FIELDS) for entry in entries])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class JSONLSink:
+    """Batches appended to a JSON lines file, rotated when it passes max_bytes."""
+
+    def __init__(self, path, max_bytes=MAX_BYTES, backups=BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(path, "a")
+
+    def write(self, entries):
+        self.file.write("".join(json.dumps({field: entry.get(field) for field in FIELDS}) + "\n"
+                                for entry in entries))
+        self.file.flush()
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "a")
+
+    def close(self):
+        self.file.close()
+
+
+def open_sink(log_path):
+    return JSONLSink(log_path) if log_path.endswith(".jsonl") else SQLiteSink(log_path)
+
+
+def _run(entries, sink):
+    global _written, _dropped
+    try:
+        stopping = False
+        while not stopping:
+            batch, waiters = [], []
+            try:
+                item = entries.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while True:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stopping or waiters or len(batch) >= BATCH_SIZE:
+                    break
+                try:
+                    item = entries.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    sink.write(batch)
+                    with _lock:
+                        _written += len(batch)
+                except Exception as e:
+                    # the log must never take the login down with it
+                    print(f"Audit log: could not write {len(batch)} entries: {e}")
+                    with _lock:
+                        _dropped += len(batch)
+            for waiter in waiters:
+                waiter.set()
+        # nothing should follow the stop marker; count (or release) anything that raced it anyway
+        while True:
+            try:
+                item = entries.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is not None:
+                with _lock:
+                    _dropped += 1
+    finally:
+        sink.close()
+
+
+def _current_queue():
+    # the queue of a running writer, started if need be, or None when the log can't be
+    # opened (it is disabled then). Called with _lock held.
+    global _queue, _writer, enabled
+    if _writer is None or not _writer.is_alive():
+        try:
+            sink = open_sink(path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Audit log: could not open {path}, logging disabled: {e}")
+            enabled = False
+            return None
+        _queue = queue.Queue(maxsize=QUEUE_SIZE)
+        _writer = threading.Thread(target=_run, args=(_queue, sink), name="auditLog", daemon=True)
+        _writer.start()
+    return _queue
+
+
+def attempt():
+    """A new id grouping the factor entries of one login attempt."""
+    return uuid.uuid4().hex[:16]
+
+
+def record(factor, username=None, ok=None, score=None, ms=None, attempt=None, detail=None):
+    """Queues one entry without waiting; returns False if it was dropped (log full or off)."""
+    global _dropped
+    if not enabled:
+        return False
+    entry = {"ts": time.time(), "attempt": attempt, "username": username, "factor": factor,
+             "ok": None if ok is None else bool(ok), "score": None if score is None else float(score),
+             "ms": None if ms is None else round(float(ms), 3), "detail": detail}
+    # under the lock, so shutdown() can't put its stop marker between picking the queue and the put
+    with _lock:
+        entries = _current_queue()
+        if entries is not None:
+            try:
+                entries.put_nowait(entry)
+                return True
+            except queue.Full:
+                pass
+        _dropped += 1
+    return False
+
+
+def flush(timeout=5.0):
+    """Waits until every entry queued so far is written; False on timeout."""
+    with _lock:
+        if _writer is None or not _writer.is_alive():
+            return True
+        entries = _queue
+    done = threading.Event()
+    try:
+        entries.put(done, timeout=timeout)
+    except queue.Full:
+        return False
+    return done.wait(timeout)
+
+
+def shutdown(timeout=5.0):
+    """Flushes and stops the writer (it starts again on the next record)."""
+    global _writer
+    flushed = flush(timeout)
+    with _lock:
+        # detached first: from here on record() starts a new writer instead of using this queue
+        writer, entries, _writer = _writer, _queue, None
+    if writer is None or not writer.is_alive():
+        return True
+    try:
+        entries.put(None, timeout=timeout)
+    except queue.Full:
+        return False  # the old writer keeps draining its queue, it just isn't told to stop
+    writer.join(timeout)
+    return flushed
+
+
+def configure(log_path=None, enable=True):
+    """Points the log somewhere else at runtime (e.g. from a benchmark); the
+    current writer is flushed and stopped first."""
+    global path, enabled, _written, _dropped
+    shutdown()
+    if log_path:
+        path = log_path
+    enabled = enable
+    with _lock:
+        _written = _dropped = 0
+
+
+def stats():
+    with _lock:
+        return {"written": _written, "dropped": _dropped, "queued": _queue.qsize() if _queue is not None else 0}
+
+
+atexit.register(shutdown)
+
+
+def read(log_path):
+    """Yields the entries of a log (SQLite, or a JSON lines file and its rotations, oldest first)."""
+    if log_path.endswith(".jsonl"):
+        rotated = [f"{log_path}.{index}" for index in range(BACKUPS, 0, -1)]
+        for file_path in rotated + [log_path]:
+            if os.path.exists(file_path):
+                with open(file_path) as file:
+                    for line in file:
+                        yield json.loads(line)
+        return
+    conn = sqlite3.connect(log_path)
+    try:
+        for row in conn.execute(f"SELECT {', '.join(FIELDS)} FROM audit_log ORDER BY id"):
+            entry = dict(zip(FIELDS, row))
+            entry["ok"] = None if entry["ok"] is None else bool(entry["ok"])
+            yield entry
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read the authentication audit log.")
+    parser.add_argument("command", choices=["tail", "stats"])
+    parser.add_argument("--log", default=path)
+    parser.add_argument("-n", type=int, default=20, help="tail: entries to show")
+    args = parser.parse_args()
+
+    if args.command == "tail":
+        for entry in deque(read(args.log), maxlen=args.n):
+            print(json.dumps(entry))
+        return
+
+    factors = {}
+    for entry in read(args.log):
+        factors.setdefault(entry["factor"], []).append(entry)
+    print(f"{'factor':12} {'entries':>8} {'passed':>8} {'p50 ms':>10}")
+    for factor, entries in sorted(factors.items()):
+        passed = sum(1 for entry in entries if entry["ok"])
+        durations = sorted(entry["ms"] for entry in entries if entry["ms"] is not None)
+        p50 = f"{durations[len(durations) // 2]:10.1f}" if durations else f"{'-':>10}"
+        print(f"{factor:12} {len(entries):8d} {passed:8d} {p50}")
+
+
+if __name__ == "__main__":
+    main()
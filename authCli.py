@@ -0,0 +1,326 @@
+# File: authCli.py
+# Description: Non-interactive subcommands of authentication.py, for scripted
+# and bulk operations. Each user is a directory:
+#
+#   <username>/user.json  {"password": "...", "phone": "9057214116", "otp_provider": "totp"}
+#   <username>/voice.wav  16-bit wav recording (or a voiceCodec .vcod file); further
+#                         recordings (voice2.wav ...) go into the voice template
+#   <username>/face.png   photo with one face in it (.jpg/.jpeg/.bmp work too)
+#
+# A directory without user.json is expanded into its subdirectories, so a whole
+# tree of users can be given at once. A pool of worker threads loads, hashes and
+# embeds the users (bcrypt, OpenCV and torch release the GIL); the writes go to
+# the user store from one thread. Every user yields one JSON line on stdout and
+# a summary goes to stderr. The exit status is 1 if any user failed.
+#
+#   python authentication.py register users/ --workers 4
+#   python authentication.py verify users/alice users/bob
+#   python authentication.py export backup/ && python authentication.py --db copy.db import backup/users.jsonl
+#   python authentication.py bench users/ --workers 1,2,4
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import bcrypt
+
+import auditLog
+import authentication
+import bulkTransfer
+import duplicateCheck
+import faceTemplate
+import twoFactor
+import userStore
+import voiceCodec
+import voiceDetection
+
+PROFILE_FILE = "user.json"
+AUDIO_EXTENSIONS = (".wav", ".vcod")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+UserSpec = namedtuple("UserSpec", "username directory")
+
+def _is_user_directory(directory):
+    return os.path.isfile(os.path.join(directory, PROFILE_FILE)) or _find_file(directory, AUDIO_EXTENSIONS)
+
+
+def _find_file(directory, extensions):
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(extensions):
+            return os.path.join(directory, name)
+    return None
+
+
+def find_users(paths):
+    """UserSpecs for the given user directories, expanding directories of users."""
+    for path in paths:
+        path = os.path.normpath(path)
+        if not os.path.isdir(path) or _is_user_directory(path):
+            yield UserSpec(os.path.basename(path), path)
+            continue
+        for name in sorted(os.listdir(path)):
+            if os.path.isdir(os.path.join(path, name)):
+                yield from find_users([os.path.join(path, name)])
+
+
+def load_profile(spec):
+    path = os.path.join(spec.directory, PROFILE_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def load_voice(spec):
+    """The user's recording, encoded for storage."""
+    path = _find_file(spec.directory, AUDIO_EXTENSIONS)
+    if path is None:
+        raise ValueError(f"No recording ({', '.join(AUDIO_EXTENSIONS)}) in {spec.directory}")
+    with open(path, "rb") as file:
+        return voiceCodec.encode(file.read())
+
+
+def load_voices(spec):
+    """All of the user's recordings (enrollment samples), encoded for storage."""
+    paths = [os.path.join(spec.directory, name) for name in sorted(os.listdir(spec.directory))
+             if name.lower().endswith(AUDIO_EXTENSIONS)]
+    if not paths:
+        raise ValueError(f"No recording ({', '.join(AUDIO_EXTENSIONS)}) in {spec.directory}")
+    voices = []
+    for path in paths:
+        with open(path, "rb") as file:
+            voices.append(voiceCodec.encode(file.read()))
+    return voices
+
+
+def load_face(spec, detect=True):
+    """FACE_SIZE crop of the face in the user's image."""
+    path = _find_file(spec.directory, IMAGE_EXTENSIONS)
+    if path is None:
+        raise ValueError(f"No face image ({', '.join(IMAGE_EXTENSIONS)}) in {spec.directory}")
+    return authentication.face_from_image(path, bulkTransfer.face_cascade() if detect else None, detect=detect)
+
+
+def _phone(profile):
+    phone = str(profile.get("phone", "")).strip()
+    if not phone:
+        return None
+    return phone if phone.startswith("+") else "+1" + phone
+
+
+def prepare_user(spec, detect=True):
+    """Everything registration stores for one user, computed off the database thread."""
+    if not os.path.isdir(spec.directory):
+        raise ValueError(f"{spec.directory} is not a directory")
+    profile = load_profile(spec)
+    username = profile.get("username", spec.username)
+    if profile.get("password_hash"):
+        password = profile["password_hash"].encode("utf-8")
+    elif profile.get("password"):
+        password = bcrypt.hashpw(profile["password"].encode("utf-8"), bcrypt.gensalt())
+    else:
+        raise ValueError(f"{PROFILE_FILE} has no password")
+
+    otp_provider = profile.get("otp_provider", twoFactor.DEFAULT_PROVIDER)
+    totp_secret = profile.get("totp_secret")
+    new_secret = not totp_secret
+    if new_secret:
+        totp_secret = twoFactor.get_provider(otp_provider).enroll(username)
+    voices = load_voices(spec)
+    face = faceTemplate.store(load_face(spec, detect))
+    # the duplicate check and every login compare against the template, nothing is embedded again
+    voice_template, voice_stats, typical = voiceDetection.build_template(voices)
+    voice = voices[typical]
+    return {"username": username, "password": password, "voice": voice, "face": face,
+            "phone": _phone(profile), "otp_provider": otp_provider, "totp_secret": totp_secret,
+            "voice_template": voice_template, "voice_stats": voice_stats, "new_secret": new_secret}
+
+
+def register(store, specs, workers=1, detect=True, duplicates=None):
+    """Registers users; yields one result dict per user.
+
+    duplicates is duplicateCheck.DUPLICATE_CHECK by default: with "block" a
+    near-duplicate (also of a user earlier in the same run) is not inserted.
+    """
+    duplicates = duplicates or duplicateCheck.DUPLICATE_CHECK
+    for spec, user, error in bulkTransfer.parallel(lambda spec: _timed(prepare_user, spec, detect), specs, workers):
+        if error is not None:
+            yield {"username": spec.username, "ok": False, "error": str(error)}
+            continue
+        user, elapsed = user
+        start = time.perf_counter()
+        result = {"username": user["username"]}
+        vectors = {}
+        if duplicates != "off":
+            centroid = voiceDetection.template_vector(user["voice_template"], user["voice_stats"])
+            found, _, vectors = duplicateCheck.find_duplicates(store, user["voice"], user["face"],
+                                                               voice_embedding=centroid)
+            if found:
+                result["duplicates"] = duplicateCheck.describe(found)
+                if duplicates == "block":
+                    yield dict(result, ok=False, error="duplicate enrollment",
+                               ms=round((elapsed + time.perf_counter() - start) * 1000, 1))
+                    continue
+        try:
+            user_id = store.create_user({field: user[field] for field in userStore.FIELDS})
+        except userStore.UserExistsError:
+            yield dict(result, ok=False, error="username already exists")
+            continue
+        duplicateCheck.record_enrollment(store, user_id, vectors)
+        result.update(ok=True, user_id=user_id, ms=round((elapsed + time.perf_counter() - start) * 1000, 1))
+        if user["totp_secret"] and user["new_secret"]:
+            result["totp_uri"] = twoFactor.provisioning_uri(user["totp_secret"], user["username"])
+        yield result
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    return func(*args), time.perf_counter() - start
+
+
+def verify_user(store, spec, detect=True):
+    """Checks a user's recording, face and (if given) password and 2FA code against the store."""
+    profile = load_profile(spec)
+    username = profile.get("username", spec.username)
+    user = store.get_user(username, ("password", "voice", "face", "phone", "otp_provider", "totp_secret",
+                                     "voice_template", "voice_stats"))
+    if user is None:
+        raise ValueError("user not found")
+    (stored_password, stored_voice, stored_face, phone, otp_provider, totp_secret, voice_template,
+     voice_stats) = user.values()
+
+    result = {"username": username}
+    if profile.get("password"):
+        result["password"] = bcrypt.checkpw(profile["password"].encode("utf-8"), stored_password)
+    distance = voiceDetection.voice_distance(load_voice(spec), stored_voice, voice_template, voice_stats)
+    result["voice"] = bool(distance <= voiceDetection.VOICE_THRESHOLD)
+    result["voice_distance"] = round(float(distance), 4)
+    face_distance = authentication.face_distance(stored_face, load_face(spec, detect))
+    result["face"] = bool(face_distance < authentication.FACE_THRESHOLD)
+    result["face_distance"] = round(float(face_distance), 1)
+    if profile.get("code"):
+        user = {"username": username, "phone": phone, "totp_secret": totp_secret}
+        result["two_factor"] = bool(twoFactor.get_provider(otp_provider).verify_code(user, str(profile["code"])))
+    checks = [result[name] for name in ("password", "voice", "face", "two_factor") if name in result]
+    result["ok"] = all(checks)
+    attempt = auditLog.attempt()
+    for name, factor in (("password", "password"), ("voice", "voice"), ("face", "face"), ("two_factor", "2fa")):
+        if name in result:
+            auditLog.record(factor, username, ok=result[name], score=result.get(f"{name}_distance"), attempt=attempt,
+                            detail="cli verify")
+    auditLog.record("login", username, ok=result["ok"], attempt=attempt, detail="cli verify")
+    return result
+
+
+def verify(store, specs, workers=1, detect=True):
+    for spec, result, error in bulkTransfer.parallel(lambda spec: _timed(verify_user, store, spec, detect), specs, workers):
+        if error is not None:
+            yield {"username": spec.username, "ok": False, "error": str(error)}
+        else:
+            result, elapsed = result
+            yield dict(result, ms=round(elapsed * 1000, 1))
+
+
+def bench(specs, workers_list, detect=True, shards=None):
+    """Registers then verifies the users into a temporary store at each worker count."""
+    specs = list(specs)
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in workers_list:
+            store = userStore.open_store(os.path.join(directory, f"bench_{workers}.db"), shards)
+            store.initialize()
+            for command in ("register", "verify"):
+                start = time.perf_counter()
+                if command == "register":
+                    results = list(register(store, specs, workers, detect))
+                else:
+                    results = list(verify(store, specs, workers, detect))
+                elapsed = time.perf_counter() - start
+                latencies = sorted(result["ms"] for result in results if "ms" in result)
+                succeeded = sum(result["ok"] for result in results)
+                yield {"command": command, "workers": workers, "users": len(specs), "ok": succeeded == len(specs),
+                       "succeeded": succeeded, "seconds": round(elapsed, 3),
+                       "users_per_s": round(len(specs) / elapsed, 2),
+                       "p50_ms": latencies[len(latencies) // 2] if latencies else None,
+                       "p95_ms": latencies[int(len(latencies) * 0.95)] if latencies else None}
+
+
+def import_paths(store, args, paths):
+    # manifests go through the batched bulk importer, user directories through register
+    for path in paths:
+        if os.path.isfile(path):
+            yield from bulkTransfer.import_manifest(store, path, args.workers, args.batch_size,
+                                                    args.transaction_size, args.detect)
+        else:
+            yield from register(store, find_users([path]), args.workers, args.detect, duplicates="off")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="authentication.py",
+                                     description="Non-interactive registration, verification, import and export. "
+                                                 "Run without arguments for the interactive menu.")
+    parser.add_argument("--db", default=authentication.DB_PATH)
+    parser.add_argument("--shards", type=int, default=userStore.SHARDS,
+                        help="user store shard count (0/1 = single file; see userStore.py)")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    commands = {}
+    for name, text in (("register", "enroll new users from their directories"),
+                       ("verify", "check users' recordings and faces against the database"),
+                       ("import", "bulk insert users from CSV/JSONL manifests or user directories "
+                                  "(no duplicate check)"),
+                       ("bench", "time register + verify of the users in a temporary database")):
+        commands[name] = subcommands.add_parser(name, help=text)
+        commands[name].add_argument("paths", nargs="+", help="user directories, or directories of them")
+        if name != "import":
+            commands[name].add_argument("--no-detect", action="store_true",
+                                        help="images are already face crops; skip face detection")
+    for name in ("register", "verify", "import"):
+        commands[name].add_argument("--workers", type=int, default=1 if name != "import" else 4,
+                                    help="worker threads")
+    commands["import"].add_argument("--detect", action="store_true", help="run face detection on the photos")
+    commands["import"].add_argument("--batch-size", type=int, default=bulkTransfer.BATCH_SIZE,
+                                    help="rows per executemany")
+    commands["import"].add_argument("--transaction-size", type=int, default=bulkTransfer.TRANSACTION_SIZE,
+                                    help="rows per transaction")
+    commands["bench"].add_argument("--workers", default="1,2,4", help="comma separated worker thread counts")
+    commands["register"].add_argument("--duplicates", choices=["warn", "block", "off"],
+                                      default=duplicateCheck.DUPLICATE_CHECK)
+    export = subcommands.add_parser("export", help="stream all users to a users.jsonl manifest plus media files")
+    export.add_argument("directory")
+    export.add_argument("--include-secrets", action="store_true",
+                        help="also write password hashes and TOTP secrets (needed to import the users again)")
+    args = parser.parse_args(argv)
+
+    store = userStore.open_store(args.db, args.shards)
+    store.initialize()
+    twoFactor.set_step_store(store)
+    start = time.perf_counter()
+    if args.command == "register":
+        results = register(store, find_users(args.paths), args.workers, not args.no_detect, args.duplicates)
+    elif args.command == "import":
+        results = import_paths(store, args, args.paths)
+    elif args.command == "verify":
+        results = verify(store, find_users(args.paths), args.workers, not args.no_detect)
+    elif args.command == "export":
+        results = bulkTransfer.export_manifest(store, args.directory, args.include_secrets)
+    else:
+        results = bench(find_users(args.paths), [int(value) for value in args.workers.split(",")],
+                        not args.no_detect, args.shards)
+
+    total = failed = 0
+    for result in results:
+        print(json.dumps(result), flush=True)
+        total += 1
+        failed += not result["ok"]
+    elapsed = time.perf_counter() - start
+    print(f"{args.command}: {total} results, {failed} failed, {elapsed:.2f} s "
+          f"({total / max(elapsed, 1e-9):.1f} users/s)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,15 @@
-import cv2
-import numpy as np
-import sqlite3
 import os
 import sys
+import time
 import ctypes
+import auditLog
+import rateLimiter
 import voiceDetection
-from dotenv import load_dotenv
-from twilio.rest import Client
+import faceTemplate
+import duplicateCheck
+import twoFactor
+import userStore
+import metrics
 import bcrypt
 
 def suppress_opencv_warnings():
@@ -21,49 +24,39 @@ def restore_stderr(original_stderr, null_device):
     sys.stderr = original_stderr
     null_device.close()
 
-load_dotenv("IDs.env")  # Load environment variables from .env file
+# Haar Cascade for face detection (shipped with OpenCV, see load_face_cascade)
+CASCADE_FILE = "haarcascade_frontalface_default.xml"
 
-# Load Twilio credentials from environment variables
-account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-verify_sid = os.getenv("TWILIO_VERIFY_SID")
+# Face comparison settings
+FACE_SIZE = (100, 100)
+FACE_THRESHOLD = faceTemplate.MATCH_THRESHOLD  # mean squared pixel difference, see faceTemplate
 
-# Ensure TWILIO_VERIFY_SID is set before proceeding
-if not verify_sid:
-    raise ValueError("ERROR: TWILIO_VERIFY_SID is not set. Please check your environment variables.")
+# Database setup
+DB_PATH = "user_auth.db"
 
-# Initialize Twilio Client
-client = Client(account_sid, auth_token)
 
-# Path to Haar Cascade for face detection
-CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+_stores = {}
 
-# Database setup
-DB_PATH = "user_auth.db"
 
+def get_store():
+    """The user store for DB_PATH (sharded when USER_STORE_SHARDS > 1, in memory
+    with USER_STORE=memory)."""
+    key = (DB_PATH, userStore.SHARDS, userStore.USER_STORE)
+    if key not in _stores:
+        _stores[key] = userStore.open_store(DB_PATH)
+        twoFactor.set_step_store(_stores[key])  # used TOTP codes are refused in every process
+    return _stores[key]
 
-def initialize_database():
-    """Creates the SQLite database and user table if not exists."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            password TEXT,
-            voice BLOB,
-            face BLOB,
-            phone TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
 
+def initialize_database():
+    """Creates the user table (in every shard) if it doesn't exist."""
+    get_store().initialize()
 
-initialize_database()
 
-# Load the Haar Cascade classifier
-face_cascade = cv2.CascadeClassifier(CASCADE_PATH)
+def load_face_cascade():
+    """Load the Haar Cascade classifier (imports OpenCV on first use)."""
+    import cv2
+    return cv2.CascadeClassifier(cv2.data.haarcascades + CASCADE_FILE)
 
 
 def bring_capture_window_to_front():
@@ -80,10 +73,14 @@ def bring_capture_window_to_front():
 
 def capture_face_image():
     """Capture an image from the webcam and detect the face."""
+    import cv2
+    face_cascade = load_face_cascade()
+
     # Suppress warnings before camera initialization
     original_stderr, null_device = suppress_opencv_warnings()
 
-    cap = cv2.VideoCapture(0)
+    with metrics.span("face.camera_open"):
+        cap = cv2.VideoCapture(0)
     if not cap.isOpened():
         # Restore stderr before printing error
         restore_stderr(original_stderr, null_device)
@@ -105,7 +102,7 @@ def capture_face_image():
             continue
 
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(50, 50))
+        faces = detect_faces(gray, face_cascade)
 
         for (x, y, w, h) in faces:
             cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
@@ -126,7 +123,7 @@ def capture_face_image():
                 cv2.destroyAllWindows()
                 # Restore stderr
                 restore_stderr(original_stderr, null_device)
-                return cv2.resize(face_img, (100, 100))  # Ensure uniform size
+                return cv2.resize(face_img, FACE_SIZE)  # Ensure uniform size
             else:
                 # Restore stderr before printing
                 restore_stderr(original_stderr, null_device)
@@ -138,27 +135,63 @@ def capture_face_image():
     restore_stderr(original_stderr, null_device)
     return None
 
+def detect_faces(gray, face_cascade):
+    """Bounding boxes (x, y, w, h) of the faces in a grayscale image."""
+    with metrics.span("face.detection"):
+        return face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(50, 50))
+
+
+def face_from_image(image, face_cascade=None, detect=True):
+    """FACE_SIZE grayscale crop of the single face in an image (array or file path).
+
+    With detect=False the whole image is taken as the face crop. Raises
+    ValueError if the image can't be read or doesn't hold exactly one face.
+    """
+    import cv2
+    if isinstance(image, str):
+        path, image = image, cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise ValueError(f"Could not read image {path}")
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    if detect:
+        faces = detect_faces(gray, face_cascade if face_cascade is not None else load_face_cascade())
+        if len(faces) != 1:
+            raise ValueError("No face detected" if len(faces) == 0 else "Multiple faces detected")
+        (x, y, w, h) = faces[0]
+        gray = gray[y:y + h, x:x + w]
+    return cv2.resize(gray, FACE_SIZE)
+
+
+def face_distance(stored_face, face_img):
+    """Mean squared pixel difference between a stored face BLOB and a captured face.
+
+    The BLOB is a faceTemplate (any crop size) or a legacy 100x100 crop; raises
+    ValueError if it is neither. For projection templates the difference is
+    estimated from the feature vectors.
+    """
+    with metrics.span("face.match"):
+        return faceTemplate.distance(stored_face, face_img, FACE_SIZE)
+
+
 def send_2fa_code(phone_number):
     """Send a verification code via Twilio SMS."""
-    verification = client.verify.v2.services(verify_sid).verifications.create(to=phone_number, channel="sms")
-    return verification.sid
+    return twoFactor.send_2fa_code(phone_number)
 
 
 def verify_2fa_code(phone_number, code):
     """Verify the user's entered 2FA code."""
-    verification_check = client.verify.v2.services(verify_sid).verification_checks.create(to=phone_number, code=code)
-    return verification_check.status == "approved"
+    return twoFactor.verify_2fa_code(phone_number, code)
 
 
 def register_user():
     """Register a new user with facial data."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    store = get_store()
 
     while True:
         username = input("Enter username to register: ").strip()
-        cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-        if cursor.fetchone() is not None:
+        with metrics.span("db.user_lookup"):
+            existing = store.exists(username)
+        if existing:
             print(f"Username '{username}' already exists. Please enter a different username.")
         else:
             break  # Username is unique, proceed with registration
@@ -171,28 +204,52 @@ def register_user():
         print("Passwords do not match. Please try again.")
         return
 
-    salt = bcrypt.gensalt()
-    hashPass = bcrypt.hashpw(password.encode('utf-8'), salt)
+    with metrics.span("password.bcrypt_hash"):
+        salt = bcrypt.gensalt()
+        hashPass = bcrypt.hashpw(password.encode('utf-8'), salt)
 
     phone_number = input("Enter your phone number (e.g., 9057214116): ").strip()
     phone_number = "+1" + phone_number
 
-    # Registering the voice of the specified user
+    # Choosing the second factor, SMS through Twilio or an offline authenticator app
+    otp_choice = input("2FA method - 1. SMS code, 2. Authenticator app (default 1): ").strip()
+    otp_provider = twoFactor.PROVIDER_TOTP if otp_choice == '2' else twoFactor.PROVIDER_TWILIO
+    totp_secret = twoFactor.get_provider(otp_provider).enroll(username)
+
+    # Registering the voice of the specified user: VOICE_ENROLL_SAMPLES recordings, averaged into a template
     print("Registering voice...")
-    voiceAudioBLOB = voiceDetection.registerVoice()
+    recordings = voiceDetection.registerVoiceSamples()
+    voice_template, voice_stats, typical = voiceDetection.build_template(recordings)
+    # the most typical recording is kept, for the duplicate galleries and a change of model
+    voiceAudioBLOB = recordings[typical]
 
     face_img = capture_face_image()
     if face_img is not None:
-        face_data = np.array(face_img).tobytes()
+        face_data = faceTemplate.store(face_img)
+        vectors = {}
+        if duplicateCheck.DUPLICATE_CHECK != "off":
+            duplicates, timings, vectors = duplicateCheck.find_duplicates(
+                store, voiceAudioBLOB, face_data, voice_embedding=voiceDetection.template_vector(voice_template,
+                                                                                                 voice_stats))
+            print(f"Duplicate enrollment check took {sum(timings.values()):.0f} ms.")
+            for line in duplicateCheck.describe(duplicates):
+                print(f"Possible duplicate enrollment: {line}")
+            if duplicates and duplicateCheck.DUPLICATE_CHECK == "block":
+                print("Registration failed: this voice or face is already enrolled.")
+                return
         try:
-            cursor.execute("INSERT INTO users (username, password, voice, face, phone) VALUES (?, ?, ?, ?, ?)",
-                           (username, hashPass, voiceAudioBLOB, face_data, phone_number))
-            conn.commit()
+            with metrics.span("db.insert"):
+                user_id = store.create_user({"username": username, "password": hashPass, "voice": voiceAudioBLOB,
+                                             "face": face_data, "phone": phone_number, "otp_provider": otp_provider,
+                                             "totp_secret": totp_secret, "voice_template": voice_template,
+                                             "voice_stats": voice_stats})
+            duplicateCheck.record_enrollment(store, user_id, vectors)
             print(f"User '{username}' registered successfully.")
-        except sqlite3.IntegrityError:
+            if totp_secret:
+                print(f"Add this secret to your authenticator app: {totp_secret}")
+                print(twoFactor.provisioning_uri(totp_secret, username))
+        except userStore.UserExistsError:
             print(f"Unexpected error: Username '{username}' should have been checked before insertion.")
-        finally:
-            conn.close()
     else:
         print("Registration failed: No face captured.")
 
@@ -205,19 +262,29 @@ def authenticate_user():
     authenticatedVoice = False
     authenticated2FA = False
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
     username = input("Enter username for authentication: ").strip()
-    cursor.execute("SELECT password, voice, face, phone FROM users WHERE username = ?", (username,))
-    user_data = cursor.fetchone()
+
+    # every factor's outcome goes to the audit log (queued, written in the background)
+    attempt = auditLog.attempt()
+
+    # refuse repeated attempts before paying for bcrypt, the model, the camera or an SMS
+    allowed, retry_after = rateLimiter.check(username)
+    if not allowed:
+        auditLog.record("login", username, ok=False, attempt=attempt, detail="rate limited")
+        print(rateLimiter.describe(retry_after))
+        return
+
+    with metrics.span("db.user_lookup"):
+        user_data = get_store().get_user(username, ("password", "voice", "face", "phone", "otp_provider",
+                                                    "totp_secret", "voice_template", "voice_stats"))
 
     if user_data is None:
+        auditLog.record("login", username, ok=False, attempt=attempt, detail="unknown user")
         print("Authentication failed: User not found.")
-        conn.close()
         return
 
-    stored_password, stored_voice, stored_face, phone_number = user_data
+    (stored_password, stored_voice, stored_face, phone_number, otp_provider, totp_secret, voice_template,
+     voice_stats) = user_data.values()
 
     print("Step 1: Password authentication")
     inputPass = input("Enter your password: ")
@@ -227,51 +294,73 @@ def authenticate_user():
     checkPass = inputPass.encode('utf-8')
 
     # checks if password hashes matches
-    if bcrypt.checkpw(checkPass, user_data[0]):
+    start = time.perf_counter()
+    with metrics.span("password.bcrypt_check"):
+        password_matched = bcrypt.checkpw(checkPass, stored_password)
+    auditLog.record("password", username, ok=password_matched, ms=(time.perf_counter() - start) * 1000,
+                    attempt=attempt)
+    if password_matched:
         print("Authentication successful.")
     else:
         print("Authentication failed: Incorrect password.")
 
     print("Step 2: Voice authentication")
-    authenticatedVoice = voiceDetection.authenticateVoice(stored_voice)
+    start = time.perf_counter()
+    authenticatedVoice, voice_distance = voiceDetection.authenticateVoice(stored_voice, return_distance=True,
+                                                                          template=voice_template, stats=voice_stats)
+    auditLog.record("voice", username, ok=authenticatedVoice, score=voice_distance,
+                    ms=(time.perf_counter() - start) * 1000, attempt=attempt)
 
     print("Step 3: Face authentication")
     face_img = capture_face_image()
     if face_img is None:
+        auditLog.record("face", username, ok=False, attempt=attempt, detail="no face captured")
+        auditLog.record("login", username, ok=False, attempt=attempt)
         print("Face authentication failed.")
-        conn.close()
         return
 
-    min_distance = float('inf')
-
-    face_img_resized = cv2.resize(face_img, (100, 100))
-    stored_face_array = np.frombuffer(stored_face, dtype=np.uint8)
-
+    start = time.perf_counter()
     try:
-        stored_face_resized = cv2.resize(stored_face_array.reshape(100, 100), (100, 100))
-        distance = np.mean((stored_face_resized - face_img_resized) ** 2)
-        if distance < 1000:  # Threshold
+        distance = face_distance(stored_face, face_img)
+        if distance < FACE_THRESHOLD:  # Threshold
             authenticatedFace = True
+        auditLog.record("face", username, ok=authenticatedFace, score=distance,
+                        ms=(time.perf_counter() - start) * 1000, attempt=attempt)
     except ValueError:
+        auditLog.record("face", username, ok=False, attempt=attempt, detail="face data size mismatch")
         print("Face data size mismatch.")
 
-    conn.close()
-
     print("Step 4: 2FA Verification")
-    send_2fa_code(phone_number)
-    code = input("Enter the 2FA verification code sent to your phone: ")
-    if verify_2fa_code(phone_number, code):
+    provider = twoFactor.get_provider(otp_provider)
+    otp_user = {"username": username, "phone": phone_number, "totp_secret": totp_secret}
+    provider.send_code(otp_user)
+    code = input(provider.prompt)
+    start = time.perf_counter()
+    if provider.verify_code(otp_user, code):
         authenticated2FA = True;
     else:
         print("2FA Verification failed, incorrect input.")
-
-    if (authenticatedFace and authenticatedVoice and authenticated2FA):
+    auditLog.record("2fa", username, ok=authenticated2FA, ms=(time.perf_counter() - start) * 1000,
+                    attempt=attempt, detail=provider.name)
+
+    authenticated = password_matched and authenticatedFace and authenticatedVoice and authenticated2FA
+    auditLog.record("login", username, ok=authenticated, attempt=attempt)
+    if authenticated:
+        # only a complete login refills the bucket, or the other factors would buy unlimited password guesses
+        rateLimiter.succeeded(username)
         print(f"User '{username}' authenticated successfully.")
     else:
         print("Authentication failed.")
 
 
 if __name__ == "__main__":
+    # with arguments: the non-interactive subcommands (python authentication.py --help)
+    if len(sys.argv) > 1:
+        import authCli
+        sys.exit(authCli.main())
+
+    initialize_database()
+
     while True:
         print("\nOptions:")
         print("1. Register User")
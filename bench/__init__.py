@@ -0,0 +1,2 @@
+# Offline benchmarks and load tests. Run the scripts from the repository root,
+# e.g. `python -m bench.run_bench`, so the project modules can be imported.
@@ -0,0 +1,113 @@
+# File: bench/bench_ann.py
+# Description: Recall and latency of the IVF index (annIndex.py) against exact
+# search, for a range of nprobe values, with and without product quantization.
+#
+# The gallery is synthetic by default: clustered unit vectors where each query
+# is a noisy copy of one gallery vector (another recording of an enrolled
+# user). --store searches a real embeddingStore gallery instead.
+#
+#   python -m bench.bench_ann --gallery 20000 --nprobe 1,2,4,8,16,32
+#   python -m bench.bench_ann --store user_auth.voice
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+import annIndex
+import embeddingStore
+from bench import common
+
+
+def synthetic_gallery(size, dimension, queries, noise, seed):
+    generator = np.random.default_rng(seed)
+    # speakers are spread over groups of similar voices, like a real population
+    groups = embeddingStore.normalize(generator.standard_normal((max(1, size // 200), dimension)))
+    gallery = embeddingStore.normalize(groups[generator.integers(len(groups), size=size)]
+                                       + 0.6 * generator.standard_normal((size, dimension)) / np.sqrt(dimension))
+    targets = generator.integers(size, size=queries)
+    probes = embeddingStore.normalize(gallery[targets]
+                                      + noise * generator.standard_normal((queries, dimension)) / np.sqrt(dimension))
+    return np.arange(size), gallery, probes
+
+
+def exact_top_k(gallery, queries, k):
+    scores = queries @ gallery.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return top
+
+
+def recall(found, truth):
+    return float(np.mean([len(set(row_found.tolist()) & set(row_truth.tolist())) / len(row_truth)
+                          for row_found, row_truth in zip(found, truth)]))
+
+
+def timed_queries(search, queries):
+    durations = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query)[0])
+        durations.append(time.perf_counter() - start)
+    return np.array(results), durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ANN recall vs latency benchmark against exact search.")
+    parser.add_argument("--gallery", type=int, default=20000, help="synthetic gallery size")
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.5, help="query noise relative to the vector norm")
+    parser.add_argument("--store", help="embeddingStore path (without .emb) to use instead of synthetic data")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0, help="cells (0 = 4 * sqrt(gallery))")
+    parser.add_argument("--nprobe", default="1,2,4,8,16,32")
+    parser.add_argument("--pq", default="0,32", help="comma separated PQ subvector counts (0 = no PQ)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_ann.json")
+    args = parser.parse_args()
+
+    if args.store:
+        store = embeddingStore.EmbeddingStore(args.store)
+        live = store.live()
+        ids, gallery = np.asarray(store.ids[live]), np.asarray(store.matrix[live])
+        generator = np.random.default_rng(args.seed)
+        queries = embeddingStore.normalize(
+            gallery[generator.integers(len(gallery), size=args.queries)]
+            + args.noise * generator.standard_normal((args.queries, gallery.shape[1])) / np.sqrt(gallery.shape[1]))
+    else:
+        ids, gallery, queries = synthetic_gallery(args.gallery, args.dimension, args.queries, args.noise, args.seed)
+    k = min(args.k, len(ids))
+    nlist = args.nlist or max(1, int(4 * np.sqrt(len(ids))))
+
+    truth = ids[exact_top_k(gallery, queries, k)]
+    _, exact_latency = timed_queries(lambda query: (np.argpartition(-(gallery @ query), k - 1)[:k],), queries)
+    results = {"meta": common.run_metadata(args), "gallery": len(ids), "nlist": nlist,
+               "exact": common.summarize(exact_latency), "configurations": []}
+    print(f"gallery {len(ids)}, nlist {nlist}, exact p50 {results['exact']['p50_ms']:.3f} ms")
+    print(f"{'pq':>4} {'nprobe':>7} {'recall@' + str(k):>10} {'p50 ms':>9} {'p95 ms':>9} {'speedup':>8}")
+
+    for subvectors in [int(value) for value in args.pq.split(",")]:
+        index = annIndex.IVFIndex(gallery.shape[1], nlist=nlist, pq_subvectors=subvectors, seed=args.seed)
+        start = time.perf_counter()
+        index.train(gallery)
+        index.add(ids, gallery)
+        build = time.perf_counter() - start
+        for nprobe in [int(value) for value in args.nprobe.split(",")]:
+            found, latency = timed_queries(lambda query: index.search(query, k, nprobe), queries)
+            summary = common.summarize(latency)
+            result = {"pq_subvectors": subvectors, "nprobe": nprobe, "build_s": round(build, 3),
+                      "recall": round(recall(found, truth), 4), "latency": summary,
+                      "speedup_vs_exact": round(results["exact"]["p50_ms"] / summary["p50_ms"], 2)}
+            results["configurations"].append(result)
+            print(f"{subvectors:4d} {nprobe:7d} {result['recall']:10.3f} {summary['p50_ms']:9.3f} "
+                  f"{summary['p95_ms']:9.3f} {result['speedup_vs_exact']:7.2f}x")
+
+    output = os.path.abspath(args.output)
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# File: bench/bench_audit_log.py
+# Description: What the audit log (auditLog.py) costs the login flow. A
+# synchronous INSERT + commit per factor, on the caller's thread, against
+# auditLog.record(), which only queues the entry for the background writer.
+# Also reports how fast the writer drains to each sink (SQLite, JSON lines).
+#
+#   python -m bench.bench_audit_log --entries 8000
+
+import argparse
+import os
+import tempfile
+import time
+
+import auditLog
+from bench import common
+
+
+def entry(index):
+    return {"factor": ("password", "voice", "face", "2fa")[index % 4], "username": f"user_{index % 500}",
+            "ok": index % 7 != 0, "score": 0.25, "ms": 12.5, "attempt": f"{index // 4:016x}"}
+
+
+def synchronous(path, entries):
+    # the naive way: one INSERT and commit per factor, on the login thread
+    sink = auditLog.SQLiteSink(path)
+    durations = []
+    for index in range(entries):
+        start = time.perf_counter()
+        sink.write([dict(entry(index), ts=time.time())])
+        durations.append(time.perf_counter() - start)
+    sink.close()
+    return durations
+
+
+def asynchronous(path, entries):
+    auditLog.configure(path)
+    durations = []
+    start_all = time.perf_counter()
+    for index in range(entries):
+        start = time.perf_counter()
+        auditLog.record(**entry(index))
+        durations.append(time.perf_counter() - start)
+    queued = time.perf_counter() - start_all
+    auditLog.flush(timeout=60)
+    drained = time.perf_counter() - start_all
+    return durations, queued, drained
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit log cost on the caller: synchronous vs queued.")
+    parser.add_argument("--entries", type=int, default=8000,
+                        help="entries queued in one burst (beyond auditLog.QUEUE_SIZE they are dropped)")
+    parser.add_argument("--sync-entries", type=int, default=2000, help="entries written synchronously")
+    parser.add_argument("--output", default="bench_audit_log.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    results = {"meta": common.run_metadata(args), "sinks": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        summary = common.summarize(synchronous(os.path.join(directory, "sync.db"), args.sync_entries))
+        results["synchronous_sqlite"] = summary
+        print(f"synchronous SQLite:  p50 {summary['p50_ms']:8.4f} ms  p95 {summary['p95_ms']:8.4f} ms per entry")
+
+        for name in ("audit.db", "audit.jsonl"):
+            durations, queued, drained = asynchronous(os.path.join(directory, name), args.entries)
+            stats = auditLog.stats()
+            summary = common.summarize(durations)
+            results["sinks"][name] = {"record": summary, "written": stats["written"], "dropped": stats["dropped"],
+                                      "written_per_s": round(stats["written"] / drained)}
+            print(f"record() -> {name:12s} p50 {summary['p50_ms']:8.4f} ms  p95 {summary['p95_ms']:8.4f} ms; "
+                  f"{args.entries} queued in {queued:.2f} s, written {stats['written'] / drained:,.0f}/s, "
+                  f"{stats['dropped']} dropped")
+            written = sum(1 for _ in auditLog.read(os.path.join(directory, name)))
+            results["sinks"][name]["read_back"] = written
+        auditLog.shutdown()
+
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# File: bench/bench_backends.py
+# Description: Latency and accuracy of the speaker inference backends
+# (speakerBackend.py) on the synthetic voice fixtures. Accuracy is measured
+# against the fp32 eager model: how far each embedding moves, how much the
+# same-speaker / different-speaker distances change, and whether any accept /
+# reject decision at VOICE_THRESHOLD flips.
+#
+#   python -m bench.bench_backends --backends eager,bf16,quantized,torchscript --threads 1
+
+import argparse
+import os
+
+import numpy as np
+
+import speakerBackend
+import voiceDetection
+from bench import common, fixtures
+
+
+def pair_distances(embeddings, users):
+    # (enrolled, attempt) pairs: each user against themselves and against the next user
+    distances = []
+    for user in range(users):
+        distances.append(voiceDetection.cosine_distance(embeddings[(user, 0)], embeddings[(user, 1)]))
+        distances.append(voiceDetection.cosine_distance(embeddings[(user, 0)], embeddings[((user + 1) % users, 1)]))
+    return np.array(distances)
+
+
+def run_backend(backend, args, recordings):
+    voiceDetection.set_backend(backend)
+    voiceDetection.get_model()  # build (and for torchscript, trace) outside the timing
+    timed = recordings[(0, 0)]
+    latency = common.summarize(common.measure(lambda: voiceDetection.embed(timed), args.iterations, warmup=2))
+    embeddings = {key: voiceDetection.embed(audio) for key, audio in recordings.items()}
+    return latency, embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speaker inference backend comparison.")
+    parser.add_argument("--backends", default=",".join(speakerBackend.BACKENDS), help="comma separated backends")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = torch default)")
+    parser.add_argument("--iterations", type=int, default=10, help="timed embeddings per backend")
+    parser.add_argument("--users", type=int, default=8, help="speakers in the accuracy comparison")
+    parser.add_argument("--seconds", type=float, default=3.0, help="length of the synthetic recordings")
+    parser.add_argument("--model", choices=["untrained", "pretrained"], default="untrained")
+    parser.add_argument("--output", default="bench_backends.json")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        voiceDetection.VOICE_THREADS = args.threads
+    common.prepare_speaker_model(args.model)
+    recordings = {(user, utterance): fixtures.synth_voice_wav(user, utterance, args.seconds)
+                  for user in range(args.users) for utterance in range(2)}
+
+    eager_latency, reference = run_backend("eager", args, recordings)
+    reference_distances = pair_distances(reference, args.users)
+    reference_accepts = reference_distances <= voiceDetection.VOICE_THRESHOLD
+
+    results = {"meta": common.run_metadata(args), "backends": []}
+    print(f"{'backend':>12} {'p50 ms':>9} {'speedup':>8} {'max drift':>10} {'max dist delta':>15} {'flips':>6}")
+    for backend in args.backends.split(","):
+        latency, embeddings = run_backend(backend, args, recordings)
+        distances = pair_distances(embeddings, args.users)
+        drift = [voiceDetection.cosine_distance(reference[key], embeddings[key]) for key in recordings]
+        result = {
+            "backend": backend,
+            "latency": latency,
+            "speedup_vs_eager": round(eager_latency["p50_ms"] / latency["p50_ms"], 2),
+            "mean_cosine_drift": float(np.mean(drift)),
+            "max_cosine_drift": float(np.max(drift)),
+            "max_distance_delta": float(np.abs(distances - reference_distances).max()),
+            "decision_flips": int(np.sum((distances <= voiceDetection.VOICE_THRESHOLD) != reference_accepts)),
+            "pairs": int(distances.size),
+        }
+        results["backends"].append(result)
+        print(f"{backend:>12} {latency['p50_ms']:9.1f} {result['speedup_vs_eager']:7.2f}x "
+              f"{result['max_cosine_drift']:10.2e} {result['max_distance_delta']:15.2e} {result['decision_flips']:6d}")
+    voiceDetection.set_backend(voiceDetection.VOICE_BACKEND)
+
+    output = os.path.abspath(args.output)
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# File: bench/bench_batch.py
+# Description: Throughput of voiceDetection.embed_many against the batch size,
+# on recordings of mixed length (as found in a real users table). Also reports
+# how far batched embeddings drift from embedding every recording on its own.
+#
+#   python -m bench.bench_batch --batch-sizes 1,4,8,16,32 --utterances 128
+
+import argparse
+import os
+import random
+import time
+
+import voiceDetection
+from bench import common, fixtures
+
+
+def make_recordings(args):
+    lengths = random.Random(args.seed)
+    return [fixtures.synth_voice_wav(user, 0, lengths.uniform(args.min_seconds, args.max_seconds))
+            for user in range(args.utterances)]
+
+
+def run_batch_size(batch_size, args, recordings, reference):
+    embeddings = {}
+    start = time.perf_counter()
+    # an iterator, like rows streamed from the database: embed_many decodes them as it goes
+    for index, embedding in voiceDetection.embed_many(iter(recordings), batch_size=batch_size,
+                                                      lookahead=args.lookahead, max_padding=args.max_padding):
+        embeddings[index] = embedding
+    wall = time.perf_counter() - start
+
+    drift = max(voiceDetection.cosine_distance(reference[index], embedding)
+                for index, embedding in embeddings.items()) if reference else 0.0
+    return {
+        "batch_size": batch_size,
+        "utterances": len(embeddings),
+        "wall_s": round(wall, 3),
+        "utterances_per_s": round(len(embeddings) / wall, 2),
+        "max_cosine_drift": float(drift),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch embedding throughput benchmark.")
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16,32", help="comma separated batch sizes")
+    parser.add_argument("--utterances", type=int, default=128)
+    parser.add_argument("--min-seconds", type=float, default=2.0)
+    parser.add_argument("--max-seconds", type=float, default=5.0)
+    parser.add_argument("--lookahead", type=int, default=4, help="batches decoded ahead for length bucketing")
+    parser.add_argument("--max-padding", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", choices=["untrained", "pretrained"], default="untrained")
+    parser.add_argument("--output", default="bench_batch.json")
+    args = parser.parse_args()
+
+    common.prepare_speaker_model(args.model)
+    # one-at-a-time embeddings, the baseline for both speed and accuracy
+    recordings = make_recordings(args)
+    reference = {index: voiceDetection.embed(audio) for index, audio in enumerate(recordings)}
+
+    results = {"meta": common.run_metadata(args), "batch_sizes": []}
+    print(f"{'batch':>6} {'utt/s':>8} {'wall s':>8} {'max drift':>10}")
+    for batch_size in [int(value) for value in args.batch_sizes.split(",")]:
+        result = run_batch_size(batch_size, args, recordings, reference)
+        results["batch_sizes"].append(result)
+        print(f"{batch_size:6d} {result['utterances_per_s']:8.2f} {result['wall_s']:8.3f} "
+              f"{result['max_cosine_drift']:10.2e}")
+
+    output = os.path.abspath(args.output)
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
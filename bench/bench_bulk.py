@@ -0,0 +1,109 @@
+# File: bench/bench_bulk.py
+# Description: Users/sec of the streaming bulk importer and exporter
+# (bulkTransfer.py) against inserting and committing one user at a time.
+# The manifest uses precomputed bcrypt hashes by default so the database path
+# is what's measured; --passwords hashes plain-text passwords during the
+# import, which is what a real onboarding pays per user. --shards imports into
+# a sharded user store (userStore.py) instead of a single file; --store memory
+# into an in-memory one, leaving only the preparation work.
+#
+#   python -m bench.bench_bulk --users 5000 --batch-sizes 1,100,500,2000 --shards 4
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import bcrypt
+import cv2
+
+import bulkTransfer
+import userStore
+from bench import common, fixtures
+
+
+def write_manifest(directory, users, passwords):
+    media = os.path.join(directory, "media")
+    os.makedirs(media)
+    # a few recordings and faces shared by everyone; the per-user cost doesn't depend on content
+    for index in range(8):
+        with open(os.path.join(media, f"voice{index}.wav"), "wb") as file:
+            file.write(fixtures.synth_voice_wav(index))
+        cv2.imwrite(os.path.join(media, f"face{index}.png"), fixtures.synth_face(index))
+    password_hash = bcrypt.hashpw(b"bulk-password", bcrypt.gensalt()).decode("utf-8")
+    path = os.path.join(directory, "users.jsonl")
+    with open(path, "w") as manifest:
+        for user in range(users):
+            record = {"username": f"bulk_{user}", "phone": "9055550000",
+                      "voice": f"media/voice{user % 8}.wav", "face": f"media/face{user % 8}.png"}
+            if passwords:
+                record["password"] = f"password-{user}"
+            else:
+                record["password_hash"] = password_hash
+            manifest.write(json.dumps(record) + "\n")
+    return path
+
+
+def fresh_store(directory, name, shards, backend):
+    store = userStore.open_store(os.path.join(directory, name), shards, backend)
+    store.initialize()
+    return store
+
+
+def row_by_row(store, manifest):
+    # the previous way: prepare, insert and commit each user in turn
+    for _, record in bulkTransfer.read_manifest(manifest):
+        store.create_user(bulkTransfer.prepare_row(record))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export throughput.")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--batch-sizes", default="100,500,2000", help="comma separated executemany batch sizes")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--passwords", action="store_true", help="hash plain-text passwords during the import")
+    parser.add_argument("--shards", type=int, default=0, help="user store shard count (0/1 = single file)")
+    parser.add_argument("--output", default="bench_bulk.json")
+    common.add_store_argument(parser)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    results = {"meta": common.run_metadata(args), "users": args.users, "shards": args.shards, "store": args.store, "import": [],
+               "export": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = write_manifest(directory, args.users, args.passwords)
+
+        start = time.perf_counter()
+        row_by_row(fresh_store(directory, "row_by_row.db", args.shards, args.store), manifest)
+        rate = args.users / (time.perf_counter() - start)
+        results["row_by_row_users_per_s"] = round(rate, 1)
+        print(f"row by row:            {rate:9.1f} users/s")
+
+        for batch_size in [int(value) for value in args.batch_sizes.split(",")]:
+            store = fresh_store(directory, f"bulk_{batch_size}.db", args.shards, args.store)
+            start = time.perf_counter()
+            imported = sum(result["ok"] for result in
+                           bulkTransfer.import_manifest(store, manifest, args.workers, batch_size))
+            rate = args.users / (time.perf_counter() - start)
+            results["import"].append({"batch_size": batch_size, "workers": args.workers, "imported": imported,
+                                      "users_per_s": round(rate, 1)})
+            print(f"bulk, batch {batch_size:6d}:    {rate:9.1f} users/s ({imported} imported)")
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        exported = sum(1 for _ in bulkTransfer.export_manifest(store, os.path.join(directory, "export"), True))
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results["export"] = {"exported": exported, "users_per_s": round(exported / elapsed, 1),
+                             "peak_python_kb": round(peak / 1024)}
+        print(f"export:                {exported / elapsed:9.1f} users/s, peak Python memory {peak / 1024:.0f} KB")
+
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
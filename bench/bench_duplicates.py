@@ -0,0 +1,60 @@
+# File: bench/bench_duplicates.py
+# Description: Latency of the registration-time duplicate check
+# (duplicateCheck.py) as the users table grows. The face check is timed against
+# galleries of increasing size; past duplicateCheck.ANN_MIN_GALLERY rows it
+# switches from exact search to the IVF index. --store memory keeps users and
+# galleries in memory, so only the search itself is timed.
+#
+#   python -m bench.bench_duplicates --sizes 1000,10000,40000 --store memory
+
+import argparse
+import os
+import tempfile
+
+import authentication
+import duplicateCheck
+import embeddingStore
+import faceTemplate
+from bench import common, fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Duplicate-enrollment check latency vs table size.")
+    parser.add_argument("--sizes", default="1000,10000,40000", help="comma separated user counts")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", default="bench_duplicates.json")
+    common.add_store_argument(parser)
+    args = parser.parse_args()
+    common.select_store(args.store)
+
+    output = os.path.abspath(args.output)
+    # projection templates keep the fixture database small; the search cost is the same
+    faces = [faceTemplate.store(fixtures.synth_face(user), "projection") for user in range(64)]
+    query = faceTemplate.store(fixtures.synth_face(1000, 1), "projection")
+    results = {"meta": common.run_metadata(args), "ann_min_gallery": duplicateCheck.ANN_MIN_GALLERY, "sizes": []}
+
+    with tempfile.TemporaryDirectory() as directory, common.temporary_database(directory):
+        store = authentication.get_store()
+        users = 0
+        for size in sorted(int(value) for value in args.sizes.split(",")):
+            with store.writer() as writer:
+                writer.insert_many([{"username": f"dup_{i}", "password": b"x", "face": faces[i % len(faces)],
+                                     "phone": "+15550000000"} for i in range(users, size)])
+            users = size
+            for partition in store.partitions():
+                if partition.path is not None:
+                    embeddingStore.sync(partition.path, "face")
+            # the first check after a sync also builds (or extends) the IVF index
+            duplicateCheck.find_duplicates(store, face=query)
+            summary = common.summarize(common.measure(lambda: duplicateCheck.find_duplicates(store, face=query),
+                                                      args.iterations))
+            search = "ivf" if size >= duplicateCheck.ANN_MIN_GALLERY else "exact"
+            results["sizes"].append({"users": size, "search": search, "latency": summary})
+            print(f"{size:8d} users  {search:5s}  p50 {summary['p50_ms']:7.2f} ms  p95 {summary['p95_ms']:7.2f} ms")
+
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
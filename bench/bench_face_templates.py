@@ -0,0 +1,73 @@
+# File: bench/bench_face_templates.py
+# Description: Stored size, decode time and match time of each face template
+# format (faceTemplate.py) against the legacy headerless crop.
+#
+#   python -m bench.bench_face_templates --faces 200
+
+import argparse
+import os
+
+import numpy as np
+
+import authentication
+import faceTemplate
+from bench import common, fixtures
+
+
+def encoders():
+    yield "legacy", lambda face: face.tobytes()
+    for mode in faceTemplate.MODES:
+        yield mode, lambda face, mode=mode: faceTemplate.store(face, mode)
+
+
+def shares_blob(array, blob):
+    # a zero-copy view has the BLOB itself at the end of its chain of bases
+    while array is not None and not isinstance(array, bytes):
+        array = array.base
+    return array is blob
+
+
+def run_format(name, encode, faces, captures, args):
+    blobs = [encode(face) for face in faces]
+    position = {"index": 0}
+
+    def next_blob():
+        position["index"] = (position["index"] + 1) % len(blobs)
+        return position["index"]
+
+    decode = common.measure(lambda: faceTemplate.decode(blobs[next_blob()]), args.iterations)
+    match = common.measure(lambda: authentication.face_distance(blobs[next_blob()], captures[position["index"]]),
+                           args.iterations)
+    return {
+        "format": name,
+        "mean_bytes": round(float(np.mean([len(blob) for blob in blobs])), 1),
+        "zero_copy": shares_blob(faceTemplate.decode(blobs[0]), blobs[0]),
+        "decode": common.summarize(decode),
+        "match": common.summarize(match),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face template size and decode time benchmark.")
+    parser.add_argument("--faces", type=int, default=200, help="enrolled faces (one template each)")
+    parser.add_argument("--iterations", type=int, default=2000, help="timed decodes/matches per format")
+    parser.add_argument("--output", default="bench_face_templates.json")
+    args = parser.parse_args()
+
+    faces = [fixtures.synth_face(user) for user in range(args.faces)]
+    captures = [fixtures.synth_face(user, 1) for user in range(args.faces)]
+    results = {"meta": common.run_metadata(args), "formats": []}
+    print(f"{'format':>11} {'bytes':>8} {'zero copy':>10} {'decode us':>10} {'match us':>10}")
+    for name, encode in encoders():
+        result = run_format(name, encode, faces, captures, args)
+        results["formats"].append(result)
+        print(f"{name:>11} {result['mean_bytes']:8.0f} {str(result['zero_copy']):>10} "
+              f"{result['decode']['p50_ms'] * 1000:10.1f} {result['match']['p50_ms'] * 1000:10.1f}")
+
+    output = os.path.abspath(args.output)
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# File: bench/bench_gallery.py
+# Description: Cost of getting a face gallery ready for a 1:N search: decoding
+# every users.face BLOB from SQLite versus mapping the embeddingStore files.
+#
+#   python -m bench.bench_gallery --users 5000
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+import authentication
+import embeddingStore
+import faceTemplate
+from bench import common, fixtures
+
+
+def load_from_database(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT id, face FROM users").fetchall()
+    conn.close()
+    return embeddingStore.normalize(np.array([faceTemplate.feature_vector(face) for _, face in rows]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gallery load time: SQLite BLOBs vs memory-mapped store.")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", default="bench_gallery.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    with tempfile.TemporaryDirectory() as directory, common.temporary_database(directory):
+        # a few distinct faces repeated; decode cost doesn't depend on the content
+        faces = [faceTemplate.store(fixtures.synth_face(user)) for user in range(64)]
+        conn = sqlite3.connect(authentication.DB_PATH)
+        conn.executemany("INSERT INTO users (username, password, voice, face, phone) VALUES (?, ?, NULL, ?, ?)",
+                         ((f"gallery_{i}", b"x", faces[i % len(faces)], "+15550000000") for i in range(args.users)))
+        conn.commit()
+        conn.close()
+
+        start = time.perf_counter()
+        embeddingStore.sync(authentication.DB_PATH, "face")
+        build = time.perf_counter() - start
+        path = embeddingStore.default_path(authentication.DB_PATH, "face")
+        query = faceTemplate.feature_vector(faces[0])
+
+        def open_and_search():
+            embeddingStore.EmbeddingStore(path).search(query, 5)
+
+        stages = {
+            "gallery.sqlite_decode": common.summarize(
+                common.measure(lambda: load_from_database(authentication.DB_PATH), args.iterations)),
+            "gallery.mmap_open": common.summarize(
+                common.measure(lambda: embeddingStore.EmbeddingStore(path), args.iterations * 20)),
+            "gallery.mmap_open_search": common.summarize(common.measure(open_and_search, args.iterations * 20)),
+        }
+        stats = embeddingStore.EmbeddingStore(path).stats()
+
+    results = {"meta": common.run_metadata(args), "users": args.users, "initial_sync_s": round(build, 3),
+               "store": stats, "stages": stages}
+    common.print_stages(stages)
+    print(f"\nInitial sync of {args.users} users: {build:.2f} s, store {stats['bytes'] / 1024:.0f} KB")
+    common.write_results(output, results)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
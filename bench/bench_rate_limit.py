@@ -0,0 +1,70 @@
+# File: bench/bench_rate_limit.py
+# Description: Cost of the login rate limiter (rateLimiter.py) next to the
+# first factor it protects (bcrypt), and how much of a brute-force run it
+# stops: one attacker trying one username, and one spraying many usernames,
+# from a single terminal, over simulated time.
+#
+#   python -m bench.bench_rate_limit --attempts 10000 --minutes 60
+
+import argparse
+import os
+
+import bcrypt
+
+import rateLimiter
+from bench import common
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def brute_force(attempts, minutes, usernames):
+    """Attempts spread evenly over `minutes` of simulated time; returns how many were let through."""
+    clock = Clock()
+    limiter = rateLimiter.TokenBucketLimiter(rateLimiter.default_limits(), clock=clock)
+    allowed = 0
+    for attempt in range(attempts):
+        clock.now = attempt * minutes * 60.0 / attempts
+        allowed += limiter.acquire([("user", f"victim_{attempt % usernames}"), ("terminal", "attacker")])[0]
+    return allowed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate limiter check cost and brute-force rejection.")
+    parser.add_argument("--attempts", type=int, default=10000, help="attempts per brute-force run")
+    parser.add_argument("--minutes", type=float, default=60.0, help="simulated duration of a run")
+    parser.add_argument("--iterations", type=int, default=20000, help="timed limiter checks")
+    parser.add_argument("--output", default="bench_rate_limit.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    limiter = rateLimiter.TokenBucketLimiter(rateLimiter.default_limits())
+    names = iter(range(10 ** 9))
+    check = common.summarize(common.measure(
+        lambda: limiter.acquire([("user", f"user_{next(names)}"), ("terminal", f"terminal_{next(names)}")]),
+        args.iterations))
+    hashed = bcrypt.hashpw(b"password", bcrypt.gensalt())
+    checkpw = common.summarize(common.measure(lambda: bcrypt.checkpw(b"wrong", hashed), 5))
+    print(f"limiter check:   p50 {check['p50_ms']:9.4f} ms  p95 {check['p95_ms']:9.4f} ms")
+    print(f"bcrypt checkpw:  p50 {checkpw['p50_ms']:9.4f} ms  ({checkpw['p50_ms'] / check['p50_ms']:,.0f}x)")
+
+    results = {"meta": common.run_metadata(args), "check": check, "bcrypt_checkpw": checkpw, "brute_force": {}}
+    for name, usernames in (("one_username", 1), ("spray_1000_usernames", 1000)):
+        allowed = brute_force(args.attempts, args.minutes, usernames)
+        saved_s = (args.attempts - allowed) * checkpw["p50_ms"] / 1000
+        results["brute_force"][name] = {"attempts": args.attempts, "allowed": allowed,
+                                        "rejected": args.attempts - allowed, "bcrypt_seconds_saved": round(saved_s, 1)}
+        print(f"{name:22s} {allowed:6d} of {args.attempts} attempts reached bcrypt in {args.minutes:g} min "
+              f"(~{saved_s:,.0f} s of bcrypt avoided, before the model, camera and SMS)")
+
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
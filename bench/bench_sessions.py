@@ -0,0 +1,110 @@
+# File: bench/bench_sessions.py
+# Description: Cost of the login session store (sessionStore.py): memory per
+# session against the dict the GUI used to keep, lookups with many sessions
+# open, and the expiry sweep (heap) against scanning every session. Also checks
+# that the MAX_SESSIONS ceiling holds when more logins start than it allows.
+#
+#   python -m bench.bench_sessions --sessions 100000
+
+import argparse
+import os
+import tracemalloc
+
+import sessionStore
+from bench import common
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fields(index):
+    return {"attempt": f"{index:016x}", "username": f"user_{index}", "phone": f"+1555{index:07d}",
+            "otp_provider": "twilio", "totp_secret": None}
+
+
+def bytes_per(make, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [make(index) for index in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / count
+
+
+def as_dict(index):
+    # the shape of the GUI's former auth_state dict
+    return dict(fields(index), password=False, voice=False, face=False, **{"2fa": False})
+
+
+def as_session(index):
+    return sessionStore.Session(f"{index:022d}", 0.0, 300.0, **fields(index))
+
+
+def filled(count, clock, ttl):
+    store = sessionStore.SessionStore(ttl=ttl, max_sessions=count, clock=clock)
+    ids = []
+    for index in range(count):
+        clock.now = index * ttl / count  # created evenly over one TTL
+        ids.append(store.create(**fields(index)).id)
+    return store, ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session store memory, lookup and sweep cost.")
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--iterations", type=int, default=20000, help="timed lookups")
+    parser.add_argument("--output", default="bench_sessions.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    results = {"meta": common.run_metadata(args)}
+
+    # the strings are the same in both, so the difference is the container
+    dict_bytes, slots_bytes = bytes_per(as_dict, args.sessions), bytes_per(as_session, args.sessions)
+    results["bytes_per_session"] = {"dict": round(dict_bytes), "session": round(slots_bytes)}
+    print(f"memory per session:  dict {dict_bytes:6.0f} B   Session {slots_bytes:6.0f} B  (strings included)")
+
+    clock, ttl = Clock(), 300.0
+    store, ids = filled(args.sessions, clock, ttl)
+    keys = iter(ids * (args.iterations // len(ids) + 2))
+    lookup = common.summarize(common.measure(lambda: store.get(next(keys)), args.iterations))
+    results["get"] = lookup
+    print(f"get() with {args.sessions} open:  p50 {lookup['p50_ms']:.4f} ms  p95 {lookup['p95_ms']:.4f} ms")
+
+    # half of the sessions expire; sweep them from the heap or by looking at every one
+    clock.now = ttl * 1.5
+    sweep = common.summarize(common.measure(store.sweep, 1, warmup=0))
+    removed = store.stats()["expired"]
+    store, ids = filled(args.sessions, clock, ttl)
+    clock.now = ttl * 1.5
+
+    def scan():
+        with store.lock:
+            for session_id in [key for key, session in store.sessions.items() if session.expires <= clock.now]:
+                del store.sessions[session_id]
+    full_scan = common.summarize(common.measure(scan, 1, warmup=0))
+    results["sweep_half_expired"] = {"heap": sweep, "scan": full_scan, "removed": removed}
+    print(f"sweep {removed} of {args.sessions}:  heap {sweep['p50_ms']:.1f} ms   scan {full_scan['p50_ms']:.1f} ms")
+    print(f"sweep with nothing expired:  heap {common.summarize(common.measure(store.sweep, 5))['p50_ms']:.4f} ms  "
+          f"(a scan still visits every session)")
+
+    ceiling = sessionStore.SessionStore(max_sessions=args.sessions // 10)
+    for index in range(args.sessions):
+        ceiling.create(**fields(index))
+    stats = ceiling.stats()
+    results["ceiling"] = dict(stats, max_sessions=ceiling.max_sessions)
+    print(f"{args.sessions} logins started with MAX_SESSIONS={ceiling.max_sessions}: "
+          f"{stats['active']} kept, {stats['evicted']} evicted")
+
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
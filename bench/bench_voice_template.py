@@ -0,0 +1,74 @@
+# File: bench/bench_voice_template.py
+# Description: Cost of voice templates (voiceDetection.build_template). At
+# enrollment, several recordings are embedded in one batch, compared with one
+# at a time. At login, the comparison is against the stored centroid rather
+# than the stored recording, which has to be embedded again whenever the
+# embedding cache misses (a restart, another process, eviction) and hashed
+# whenever it hits.
+#
+#   python -m bench.bench_voice_template --samples 1,3,5 --iterations 10
+
+import argparse
+import os
+
+import embeddingCache
+import voiceCodec
+import voiceDetection
+from bench import common, fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice template enrollment and verification cost.")
+    parser.add_argument("--samples", default="1,3,5", help="comma separated enrollment sample counts")
+    parser.add_argument("--seconds", type=float, default=3.0, help="length of each recording")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--model", choices=["untrained", "pretrained"], default="untrained")
+    parser.add_argument("--output", default="bench_voice_template.json")
+    args = parser.parse_args()
+
+    common.prepare_speaker_model(args.model)
+    output = os.path.abspath(args.output)
+    results = {"meta": common.run_metadata(args), "enroll": [], "verify": {}}
+
+    print(f"{'samples':>7} {'one by one ms':>14} {'batched ms':>11}")
+    for samples in [int(value) for value in args.samples.split(",")]:
+        recordings = [voiceCodec.encode(fixtures.synth_voice_wav(0, utterance, args.seconds))
+                      for utterance in range(samples)]
+        sequential = common.summarize(common.measure(
+            lambda: [voiceDetection.embed(audio) for audio in recordings], args.iterations))
+        batched = common.summarize(common.measure(lambda: voiceDetection.build_template(recordings), args.iterations))
+        results["enroll"].append({"samples": samples, "one_by_one": sequential, "build_template": batched})
+        print(f"{samples:7d} {sequential['p50_ms']:14.1f} {batched['p50_ms']:11.1f}")
+
+    # the enrolled side of one login comparison; the live recording is embedded in every case
+    stored = voiceCodec.encode(fixtures.synth_voice_wav(0, 0, args.seconds))
+    live = voiceDetection.embed(fixtures.synth_voice_wav(0, 9, args.seconds))
+    template, stats, _ = voiceDetection.build_template([stored])
+    cache = embeddingCache.get_cache()
+    voiceDetection.embed_cached(stored)
+
+    def cold():
+        cache.clear()
+        return voiceDetection.cosine_distance(live, voiceDetection.embed_cached(stored))
+
+    cases = {
+        "recording_cache_miss": cold,
+        "recording_cache_hit": lambda: voiceDetection.cosine_distance(live, voiceDetection.embed_cached(stored)),
+        "template": lambda: voiceDetection.template_distance(live, voiceDetection.template_vector(template, stats)),
+    }
+    print(f"\n{'enrolled side of a login':26s} {'p50 ms':>10} {'p95 ms':>10}")
+    for name, case in cases.items():
+        summary = common.summarize(common.measure(case, args.iterations if name.endswith("miss") else 1000))
+        results["verify"][name] = summary
+        print(f"{name:26s} {summary['p50_ms']:10.4f} {summary['p95_ms']:10.4f}")
+    drift = abs(cases["recording_cache_hit"]() - cases["template"]())
+    results["verify"]["single_sample_distance_difference"] = float(drift)
+    print(f"\none-sample template vs recording: distances differ by {drift:.1e}")
+    results["template_bytes"] = len(template)
+
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# File: bench/bench_workers.py
+# Description: Throughput of the embedding worker pool against the number of
+# worker processes and torch intra-op threads per worker.
+#
+#   python -m bench.bench_workers --workers 1,2,4 --threads 1,2 --requests 64 --clients 8
+
+import argparse
+import os
+import threading
+import time
+
+import embeddingWorkers
+from bench import common, fixtures
+
+
+def run_configuration(workers, threads, args, recordings):
+    server = embeddingWorkers.EmbeddingServer(workers=workers, intra_threads=threads, max_batch=args.max_batch,
+                                              batch_window_ms=args.batch_window_ms, model=args.model).start()
+    clients = [embeddingWorkers.EmbeddingClient(server.address, server.authkey) for _ in range(args.clients)]
+    latencies = []
+    latency_lock = threading.Lock()
+
+    def client_loop(client, indices):
+        for index in indices:
+            start = time.perf_counter()
+            client.embed(recordings[index % len(recordings)])
+            with latency_lock:
+                latencies.append(time.perf_counter() - start)
+
+    # warm-up so process start-up and first-call costs aren't measured
+    clients[0].embed(recordings[0])
+
+    start = time.perf_counter()
+    threads_list = [threading.Thread(target=client_loop, args=(client, range(i, args.requests, args.clients)))
+                    for i, client in enumerate(clients)]
+    for thread in threads_list:
+        thread.start()
+    for thread in threads_list:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    stats = clients[0].stats()
+    for client in clients:
+        client.close()
+    server.stop()
+    return {
+        "workers": workers,
+        "intra_threads": threads,
+        "requests": args.requests,
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(args.requests / wall, 2),
+        "mean_batch_size": round(stats["requests"] / stats["batches"], 2) if stats["batches"] else None,
+        "latency": common.summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding worker pool throughput benchmark.")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--threads", default="1", help="comma separated torch threads per worker")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client connections")
+    parser.add_argument("--seconds", type=float, default=3.0, help="length of the synthetic recordings")
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--batch-window-ms", type=float, default=5.0)
+    parser.add_argument("--model", choices=["untrained", "pretrained"], default="untrained")
+    parser.add_argument("--output", default="bench_workers.json")
+    args = parser.parse_args()
+
+    recordings = [fixtures.synth_voice_wav(user, 0, args.seconds) for user in range(16)]
+    results = {"meta": common.run_metadata(args), "configurations": []}
+    print(f"{'workers':>8} {'threads':>8} {'req/s':>8} {'batch':>6} {'p50 ms':>9} {'p95 ms':>9}")
+    for workers in [int(value) for value in args.workers.split(",")]:
+        for threads in [int(value) for value in args.threads.split(",")]:
+            result = run_configuration(workers, threads, args, recordings)
+            results["configurations"].append(result)
+            print(f"{workers:8d} {threads:8d} {result['throughput_per_s']:8.2f} {result['mean_batch_size']:6} "
+                  f"{result['latency']['p50_ms']:9.1f} {result['latency']['p95_ms']:9.1f}")
+
+    output = os.path.abspath(args.output)
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
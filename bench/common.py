@@ -0,0 +1,203 @@
+# File: bench/common.py
+# Description: Shared helpers for the benchmarks: hardware/2FA stubs, timing
+# statistics and the JSON result format.
+
+import builtins
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import authentication
+import twoFactor
+import userStore
+import voiceDetection
+
+
+def summarize(samples):
+    """Latency statistics (milliseconds) of a list of durations in seconds."""
+    if not samples:
+        return {"n": 0}
+    values = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        "n": int(values.size),
+        "mean_ms": round(float(values.mean()), 4),
+        "p50_ms": round(float(np.percentile(values, 50)), 4),
+        "p95_ms": round(float(np.percentile(values, 95)), 4),
+        "p99_ms": round(float(np.percentile(values, 99)), 4),
+        "min_ms": round(float(values.min()), 4),
+        "max_ms": round(float(values.max()), 4),
+    }
+
+
+def measure(func, iterations, warmup=1):
+    """Calls func() warmup + iterations times and returns the timed durations in seconds."""
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def install_untrained_speaker_model(seed=0):
+    """Uses a randomly initialised WeSpeaker ResNet34 so benchmarks run without
+    the gated Hugging Face weights. Timings match the real model, scores do not."""
+    voiceDetection.install_untrained_model(seed)
+
+
+def prepare_speaker_model(mode):
+    """mode is "untrained", "pretrained" or "skip". Returns the mode actually in use."""
+    if mode == "skip":
+        return mode
+    if mode == "pretrained":
+        voiceDetection.get_model()
+    else:
+        install_untrained_speaker_model()
+    return mode
+
+
+@contextlib.contextmanager
+def stubbed_hardware(voice_source, face_source):
+    """Replaces the microphone and camera with fixtures.
+
+    voice_source() returns the wav bytes of the next recording and
+    face_source() the next 100x100 face crop.
+    """
+    original_record = voiceDetection.recordAudio
+    original_capture = authentication.capture_face_image
+
+    def record(filename):
+        with open(filename, "wb") as file:
+            file.write(voice_source())
+
+    voiceDetection.recordAudio = record
+    authentication.capture_face_image = face_source
+    try:
+        yield
+    finally:
+        voiceDetection.recordAudio = original_record
+        authentication.capture_face_image = original_capture
+
+
+@contextlib.contextmanager
+def scripted_input(answers):
+    """Answers input() prompts from a list; callables are called for a value at prompt time."""
+    pending = list(answers)
+    original_input = builtins.input
+
+    def answer(prompt=""):
+        value = pending.pop(0)
+        return value() if callable(value) else value
+
+    builtins.input = answer
+    try:
+        yield
+    finally:
+        builtins.input = original_input
+
+
+@contextlib.contextmanager
+def quiet():
+    """Hides the prints of the interactive flows while they are being timed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def twilio_stub(latency_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+    """Runs twilioStub.py in-process and points the Twilio client at it."""
+    import twilioStub
+    server = twilioStub.start_stub_server(latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate,
+                                          seed=0)
+    previous = (twoFactor.verify_base_url, twoFactor._client)
+    twoFactor.verify_base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    twoFactor._client = None
+    try:
+        yield server
+    finally:
+        twoFactor.verify_base_url, twoFactor._client = previous
+        server.shutdown()
+
+
+def add_store_argument(parser):
+    parser.add_argument("--store", choices=userStore.UserStore.BACKENDS, default=userStore.USER_STORE,
+                        help="user store backend; memory leaves disk I/O out of the numbers")
+
+
+def select_store(backend):
+    """Makes authentication.get_store() (and open_store without a backend) use `backend`."""
+    userStore.USER_STORE = backend
+
+
+@contextlib.contextmanager
+def temporary_database(directory):
+    """Points authentication at a fresh database file (or empty memory store) inside `directory`."""
+    previous = authentication.DB_PATH
+    path = os.path.join(directory, "bench_auth.db")
+    if os.path.exists(path):
+        os.remove(path)
+    authentication.DB_PATH = path
+    authentication._stores.pop((path, userStore.SHARDS, userStore.USER_STORE), None)
+    authentication.initialize_database()
+    try:
+        yield path
+    finally:
+        authentication.DB_PATH = previous
+
+
+def run_metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def write_results(path, results):
+    # sorted keys and fixed indentation keep runs diffable with plain `diff`
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+def compare_results(previous_path, results, key="p50_ms"):
+    """Prints the change of every stage against an earlier result file."""
+    with open(previous_path) as file:
+        previous = json.load(file)
+    print(f"\n{'stage':40} {'before':>12} {'after':>12} {'change':>9}")
+    for stage, stats in sorted(results["stages"].items()):
+        old = previous.get("stages", {}).get(stage, {}).get(key)
+        new = stats.get(key)
+        if old is None or new is None:
+            print(f"{stage:40} {'-' if old is None else f'{old:.3f}':>12} "
+                  f"{'-' if new is None else f'{new:.3f}':>12} {'':>9}")
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{stage:40} {old:12.3f} {new:12.3f} {change:+8.1f}%")
+
+
+def print_stages(stages):
+    print(f"{'stage':40} {'n':>5} {'p50 ms':>10} {'p95 ms':>10} {'mean ms':>10}")
+    for stage, stats in sorted(stages.items()):
+        if stats.get("n"):
+            print(f"{stage:40} {stats['n']:5d} {stats['p50_ms']:10.3f} {stats['p95_ms']:10.3f} "
+                  f"{stats['mean_ms']:10.3f}")
+        else:
+            print(f"{stage:40} {'skipped':>5}")
@@ -0,0 +1,89 @@
+# File: bench/fixtures.py
+# Description: Deterministic synthetic voice and face fixtures for benchmarks.
+# Every fixture is generated from (user id, sample number), so two runs of a
+# benchmark process exactly the same data.
+
+import io
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FACE_SIZE = (100, 100)
+
+
+def _rng(*key):
+    return np.random.default_rng([7919, *key])
+
+
+def synth_voice(user_id, utterance=0, seconds=3.0):
+    """int16 16 kHz "speech": a voiced source whose pitch and formants depend on the user.
+
+    Different utterances of one user share pitch and formants but differ in
+    prosody and noise, which is enough to exercise the model realistically.
+    """
+    speaker = _rng(user_id)
+    f0 = speaker.uniform(90, 220)
+    formants = np.sort(speaker.uniform([400, 1000, 2200], [900, 1800, 3200]))
+
+    take = _rng(user_id, utterance, 1)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = f0 * (1 + 0.05 * np.sin(2 * np.pi * take.uniform(0.5, 2.0) * t))
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+
+    signal = np.zeros_like(t)
+    for harmonic in range(1, 30):
+        frequency = harmonic * f0
+        # harmonics close to a formant are louder
+        gain = sum(np.exp(-((frequency - formant) / 150.0) ** 2) for formant in formants) + 0.05
+        signal += gain / harmonic * np.sin(harmonic * phase)
+
+    # syllable-like amplitude envelope and a little background noise
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * take.uniform(3, 5) * t + take.uniform(0, np.pi))) ** 2
+    signal = signal * envelope + 0.02 * take.standard_normal(t.size)
+    signal = signal / (np.abs(signal).max() + 1e-9) * 0.6
+    return (signal * 32767).astype(np.int16)
+
+
+def wav_bytes(samples, rate=SAMPLE_RATE):
+    """A complete 16-bit mono wav file, as stored in users.voice."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as waveFile:
+        waveFile.setnchannels(1)
+        waveFile.setsampwidth(2)
+        waveFile.setframerate(rate)
+        waveFile.writeframes(np.asarray(samples, dtype=np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def synth_voice_wav(user_id, utterance=0, seconds=3.0):
+    return wav_bytes(synth_voice(user_id, utterance, seconds))
+
+
+def synth_face(user_id, capture=0):
+    """100x100 uint8 grayscale face crop; captures of one user differ by lighting, shift and noise."""
+    shape = _rng(user_id, 2)
+    height, width = FACE_SIZE
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+
+    face = np.full(FACE_SIZE, shape.uniform(30, 70), dtype=np.float32)
+    centre_x, centre_y = 50 + shape.uniform(-4, 4), 50 + shape.uniform(-4, 4)
+    radius_x, radius_y = shape.uniform(30, 40), shape.uniform(38, 46)
+    skin = ((x - centre_x) / radius_x) ** 2 + ((y - centre_y) / radius_y) ** 2 <= 1
+    face[skin] = shape.uniform(140, 210)
+
+    eye_y = centre_y - shape.uniform(8, 14)
+    eye_gap = shape.uniform(10, 16)
+    for eye_x in (centre_x - eye_gap, centre_x + eye_gap):
+        face[(x - eye_x) ** 2 + (y - eye_y) ** 2 <= shape.uniform(9, 25)] = shape.uniform(20, 60)
+
+    mouth_y = centre_y + shape.uniform(14, 22)
+    mouth = (np.abs(y - mouth_y) <= 2) & (np.abs(x - centre_x) <= shape.uniform(8, 14))
+    face[mouth] = shape.uniform(60, 110)
+
+    take = _rng(user_id, capture, 3)
+    if capture:
+        face = np.roll(face, take.integers(-2, 3, size=2), axis=(0, 1))
+        face = face * take.uniform(0.9, 1.1)
+    face += take.normal(0, 6, FACE_SIZE)
+    return np.clip(face, 0, 255).astype(np.uint8)
@@ -0,0 +1,402 @@
+# File: bench/load_test.py
+# Description: Concurrent register + login load test against an auth database.
+# N simulated users run the same stages as the real flows (bcrypt, SQLite,
+# speaker embedding, face match, 2FA through TOTP or the local Verify stub)
+# at increasing concurrency, and each level reports throughput, per-factor
+# latency percentiles, SQLite lock contention and CPU/memory use. The users go
+# through the user store (userStore.py); --store memory takes SQLite and the
+# disk out of the numbers.
+#
+#   python -m bench.load_test --users 64 --concurrency 1,2,4,8
+#   python -m bench.load_test --db user_auth.db --two-factor twilio-stub --wal
+#   python -m bench.load_test --store memory --concurrency 1,4
+
+import argparse
+import contextlib
+import glob
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+
+import authentication
+import embeddingCache
+import faceTemplate
+import twoFactor
+import userStore
+import voiceCodec
+import voiceDetection
+from bench import common, fixtures
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+USERNAME_PREFIX = "loadtest_"
+
+# SQLite busy handling is done here rather than by sqlite3's timeout, so every
+# "database is locked" is counted and the time spent waiting is measured
+LOCK_RETRY_DELAY = 0.002
+LOCK_RETRY_LIMIT = 2000
+
+
+class Recorder:
+    """Thread-safe collection of per-stage durations and lock statistics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.lock_retries = 0
+        self.lock_wait = 0.0
+        self.failures = defaultdict(int)
+        self.errors = []  # "user N: message" for users that raised
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.durations[stage].append(seconds)
+
+    def add_lock_wait(self, retries, seconds):
+        with self.lock:
+            self.lock_retries += retries
+            self.lock_wait += seconds
+
+    def fail(self, stage):
+        with self.lock:
+            self.failures[stage] += 1
+
+    def error(self, user, exception):
+        with self.lock:
+            self.errors.append(f"user {user}: {type(exception).__name__}: {exception}")
+
+    def merge(self, other):
+        with self.lock:
+            for stage, values in other["durations"].items():
+                self.durations[stage].extend(values)
+            for stage, count in other["failures"].items():
+                self.failures[stage] += count
+            self.errors.extend(other["errors"])
+            self.lock_retries += other["lock_retries"]
+            self.lock_wait += other["lock_wait"]
+
+    def to_dict(self):
+        return {"durations": dict(self.durations), "failures": dict(self.failures), "errors": list(self.errors),
+                "lock_retries": self.lock_retries, "lock_wait": self.lock_wait}
+
+
+def run_locked(recorder, func):
+    """Runs func() retrying while the database is locked by another writer."""
+    retries, waited = 0, 0.0
+    while True:
+        try:
+            result = func()
+            break
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            retries += 1
+            if retries > LOCK_RETRY_LIMIT:
+                raise
+            time.sleep(LOCK_RETRY_DELAY)
+            waited += LOCK_RETRY_DELAY
+    if retries:
+        recorder.add_lock_wait(retries, waited)
+    return result
+
+
+class Fixtures:
+    """Voice recordings and face crops for a simulated user.
+
+    Recorded wav files from --voice-dir are used round-robin when given,
+    otherwise synthetic fixtures are generated.
+    """
+
+    def __init__(self, voice_dir=None, seconds=3.0):
+        self.seconds = seconds
+        self.recordings = []
+        if voice_dir:
+            for path in sorted(glob.glob(os.path.join(voice_dir, "*.wav"))):
+                with open(path, "rb") as file:
+                    self.recordings.append(file.read())
+
+    def voice(self, user, take):
+        if self.recordings:
+            return self.recordings[(user * 2 + take) % len(self.recordings)]
+        return fixtures.synth_voice_wav(user, take, self.seconds)
+
+    def face(self, user, take):
+        return fixtures.synth_face(user, take)
+
+
+_stores = {}  # (backend, db) -> this process's store; a memory store is shared by the threads
+
+
+def open_store(config):
+    key = (config["store"], config["db"])
+    if key not in _stores:
+        # timeout 0: run_locked does the waiting, and counts it
+        _stores[key] = userStore.open_store(config["db"], backend=config["store"], timeout=0)
+    return _stores[key]
+
+
+def timed(recorder, stage, func):
+    start = time.perf_counter()
+    try:
+        return func()
+    finally:
+        recorder.add(stage, time.perf_counter() - start)
+
+
+def simulate_user(user, config, recorder):
+    """Registers one user and logs them in, recording every stage."""
+    username = f"{USERNAME_PREFIX}{config['run_id']}_{user}"
+    password = f"password-{user}".encode("utf-8")
+    data = Fixtures(config["voice_dir"], config["seconds"])
+    provider = twoFactor.get_provider(twoFactor.PROVIDER_TOTP if config["two_factor"] == "totp"
+                                      else twoFactor.PROVIDER_TWILIO)
+    store = open_store(config)
+
+    try:
+        # Registration
+        register_start = time.perf_counter()
+        exists = timed(recorder, "db.user_lookup", lambda: run_locked(recorder, lambda: store.exists(username)))
+        if exists:
+            recorder.fail("register.duplicate")
+            return
+        hashed = timed(recorder, "password.bcrypt_hash",
+                       lambda: bcrypt.hashpw(password, bcrypt.gensalt(config["bcrypt_rounds"])))
+        secret = provider.enroll(username)
+        voice = voiceCodec.encode(data.voice(user, 0))  # as voiceDetection.registerVoice stores it
+        face = faceTemplate.store(data.face(user, 0))
+        template = stats = None
+        if config["model"] != "skip":
+            template, stats, _ = timed(recorder, "register.voice_template",
+                                       lambda: voiceDetection.build_template([voice]))
+
+        # a number of their own: the Twilio stub keeps one pending code per phone
+        record = {"username": username, "password": hashed, "voice": voice, "face": face, "phone": f"+1555{user:07d}",
+                  "otp_provider": provider.name, "totp_secret": secret, "voice_template": template,
+                  "voice_stats": stats}
+        timed(recorder, "db.insert", lambda: run_locked(recorder, lambda: store.create_user(record)))
+        recorder.add("register.total", time.perf_counter() - register_start)
+
+        # Login (the "live" recordings are prepared up front so fixture generation isn't timed)
+        live_voice = data.voice(user, 1)
+        live_face = data.face(user, 1)
+        login_start = time.perf_counter()
+        row = timed(recorder, "db.user_lookup", lambda: run_locked(recorder, lambda: store.get_user(
+            username, ("password", "voice", "face", "phone", "otp_provider", "totp_secret", "voice_template",
+                       "voice_stats"))))
+        stored_password, stored_voice, stored_face, phone, _, totp_secret, voice_template, voice_stats = row.values()
+
+        if not timed(recorder, "login.password", lambda: bcrypt.checkpw(password, stored_password)):
+            recorder.fail("login.password")
+
+        if config["model"] != "skip":
+            def voice_factor():
+                distance = voiceDetection.voice_distance(live_voice, stored_voice, voice_template, voice_stats)
+                return distance <= voiceDetection.VOICE_THRESHOLD
+
+            if not timed(recorder, "login.voice", voice_factor):
+                recorder.fail("login.voice")
+
+        def face_factor():
+            return authentication.face_distance(stored_face, live_face) < authentication.FACE_THRESHOLD
+
+        if not timed(recorder, "login.face", face_factor):
+            recorder.fail("login.face")
+
+        otp_user = {"username": username, "phone": phone, "totp_secret": totp_secret}
+
+        def two_factor():
+            provider.send_code(otp_user)
+            code = twoFactor.totp(totp_secret) if provider.name == twoFactor.PROVIDER_TOTP else config["stub_code"]
+            return provider.verify_code(otp_user, code)
+
+        if not timed(recorder, "login.2fa", two_factor):
+            recorder.fail("login.2fa")
+
+        recorder.add("login.total", time.perf_counter() - login_start)
+    except Exception:
+        recorder.fail("error")
+        raise
+
+
+# Process-pool workers each load their own copy of the model
+_worker_config = None
+
+
+def _init_process_worker(config):
+    global _worker_config
+    _worker_config = config
+    if config["model"] != "skip":
+        common.prepare_speaker_model(config["model"])
+    if config["stub_url"]:
+        twoFactor.verify_base_url = config["stub_url"]
+        twoFactor._client = None
+
+
+def _process_batch(users):
+    recorder = Recorder()
+    for user in users:
+        try:
+            simulate_user(user, _worker_config, recorder)
+        except Exception as e:
+            recorder.error(user, e)
+    return recorder.to_dict()
+
+
+def cpu_seconds():
+    if resource is None:
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if os.uname().sysname == "Darwin" else 1024
+    return round(max(own, children) / scale, 1)
+
+
+def run_level(concurrency, config, first_user):
+    recorder = Recorder()
+    users = list(range(first_user, first_user + config["users"]))
+    cpu_before = cpu_seconds()
+    start = time.perf_counter()
+
+    if config["processes"]:
+        batches = [users[i::concurrency] for i in range(concurrency)]
+        with ProcessPoolExecutor(concurrency, initializer=_init_process_worker, initargs=(config,)) as pool:
+            for result in pool.map(_process_batch, batches):
+                recorder.merge(result)
+    else:
+        with ThreadPoolExecutor(concurrency) as pool:
+            futures = [pool.submit(simulate_user, user, config, recorder) for user in users]
+            for user, future in zip(users, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    recorder.error(user, e)
+
+    wall = time.perf_counter() - start
+    cpu_after = cpu_seconds()
+    completed = len(recorder.durations.get("login.total", []))
+    return {
+        "concurrency": concurrency,
+        "users": config["users"],
+        "completed": completed,
+        "wall_s": round(wall, 3),
+        "throughput_users_per_s": round(completed / wall, 3) if wall else None,
+        "stages": {stage: common.summarize(values) for stage, values in sorted(recorder.durations.items())},
+        "failures": dict(recorder.failures),
+        "errors": recorder.errors,
+        "sqlite_lock_retries": recorder.lock_retries,
+        "sqlite_lock_wait_ms": round(recorder.lock_wait * 1000, 1),
+        "cpu_cores_busy": round((cpu_after - cpu_before) / wall, 2) if cpu_before is not None and wall else None,
+        "peak_rss_mb": peak_memory_mb(),
+        # thread mode only, worker processes have their own caches
+        "embedding_cache": None if config["processes"] else embeddingCache.get_cache().stats(),
+    }
+
+
+def print_level(level):
+    print(f"\n== concurrency {level['concurrency']}: {level['completed']}/{level['users']} users in "
+          f"{level['wall_s']} s, {level['throughput_users_per_s']} users/s, "
+          f"cpu {level['cpu_cores_busy']} cores, peak rss {level['peak_rss_mb']} MB")
+    print(f"   sqlite lock retries {level['sqlite_lock_retries']}, waited {level['sqlite_lock_wait_ms']} ms, "
+          f"failures {level['failures'] or 'none'}")
+    for error in level["errors"][:5]:
+        print(f"   {error}")
+    if len(level["errors"]) > 5:
+        print(f"   ... {len(level['errors']) - 5} more errors in the results file")
+    print(f"   {'stage':24} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for stage, stats in level["stages"].items():
+        print(f"   {stage:24} {stats['p50_ms']:10.2f} {stats['p95_ms']:10.2f} {stats['p99_ms']:10.2f}")
+
+
+def cleanup(store, run_id):
+    prefix = f"{USERNAME_PREFIX}{run_id}_"
+    usernames = [user["username"] for user in store.iterate_users(("username",))
+                 if user["username"].startswith(prefix)]
+    for username in usernames:
+        store.delete_user(username)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent register + login load test.")
+    parser.add_argument("--users", type=int, default=32, help="simulated users per concurrency level")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="comma separated worker counts")
+    parser.add_argument("--processes", action="store_true", help="use worker processes instead of threads")
+    parser.add_argument("--db", help="database to load (default: a temporary copy of the schema); "
+                                     "rows are prefixed with 'loadtest_' and removed afterwards")
+    parser.add_argument("--keep", action="store_true", help="keep the simulated users in --db")
+    parser.add_argument("--wal", action="store_true", help="switch the database to WAL journaling first")
+    parser.add_argument("--two-factor", choices=["totp", "twilio-stub"], default="totp")
+    parser.add_argument("--twilio-latency-ms", type=float, default=0.0)
+    parser.add_argument("--model", choices=["untrained", "pretrained", "skip"], default="untrained")
+    parser.add_argument("--voice-dir", help="directory of recorded 16 kHz wav files to use instead of synthetic ones")
+    parser.add_argument("--seconds", type=float, default=3.0, help="length of synthetic recordings")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--output", default="load_results.json")
+    common.add_store_argument(parser)
+    args = parser.parse_args()
+    if args.store == "memory" and (args.processes or args.db or args.wal):
+        parser.error("--store memory lives in one process and has no database file "
+                     "(no --processes, --db or --wal)")
+
+    output = os.path.abspath(args.output)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    run_id = str(int(time.time()))
+
+    with tempfile.TemporaryDirectory() as directory, contextlib.ExitStack() as stack:
+        db_path = os.path.abspath(args.db) if args.db else os.path.join(directory, "loadtest_auth.db")
+        store = open_store({"store": args.store, "db": db_path})
+        store.initialize()
+        if args.wal:
+            for partition in store.partitions():
+                conn = partition.connect()
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.close()
+
+        server = None
+        if args.two_factor == "twilio-stub":
+            server = stack.enter_context(common.twilio_stub(latency_ms=args.twilio_latency_ms))
+        config = {
+            "run_id": run_id, "db": db_path, "store": args.store, "users": args.users, "processes": args.processes,
+            "two_factor": args.two_factor, "model": args.model, "voice_dir": args.voice_dir,
+            "seconds": args.seconds, "bcrypt_rounds": args.bcrypt_rounds,
+            "stub_url": twoFactor.verify_base_url if server else None,
+            "stub_code": server.state.code if server else None,
+        }
+
+        results = {"meta": common.run_metadata(args), "levels": []}
+        try:
+            if not args.processes:
+                common.prepare_speaker_model(args.model)
+            next_user = 0
+            for concurrency in levels:
+                level = run_level(concurrency, config, next_user)
+                next_user += args.users
+                print_level(level)
+                results["levels"].append(level)
+        finally:
+            if args.db and not args.keep:
+                cleanup(store, run_id)
+
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
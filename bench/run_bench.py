@@ -0,0 +1,218 @@
+# File: bench/run_bench.py
+# Description: Offline benchmark of every registration and login stage.
+# Camera, microphone and Twilio are replaced by synthetic fixtures and the
+# local Verify stub, and results are written to a JSON file that can be
+# diffed or compared (--compare) between runs.
+#
+#   python -m bench.run_bench --output bench_results.json
+#   python -m bench.run_bench --compare bench_results.json --output new.json
+
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+
+import bcrypt
+
+import auditLog
+import authentication
+import embeddingCache
+import faceTemplate
+import metrics
+import rateLimiter
+import twoFactor
+import voiceCodec
+import voiceDetection
+from bench import common, fixtures
+
+
+def bench_password(args, stages):
+    password = b"correct horse battery staple"
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt())
+    stages["password.bcrypt_hash"] = common.summarize(
+        common.measure(lambda: bcrypt.hashpw(password, bcrypt.gensalt()), args.iterations))
+    stages["password.bcrypt_check"] = common.summarize(
+        common.measure(lambda: bcrypt.checkpw(password, hashed), args.iterations))
+
+
+def bench_database(args, stages):
+    # a real sized table: every row carries the voice and face BLOBs
+    voice = voiceCodec.encode(fixtures.synth_voice_wav(0))
+    face = faceTemplate.store(fixtures.synth_face(0))
+    hashed = bcrypt.hashpw(b"password", bcrypt.gensalt(4))
+    store = authentication.get_store()
+
+    inserts = []
+    for i in range(args.users):
+        start = time.perf_counter()
+        store.create_user({"username": f"bench_user_{i}", "password": hashed, "voice": voice, "face": face,
+                           "phone": "+15550000000", "otp_provider": twoFactor.PROVIDER_TOTP,
+                           "totp_secret": twoFactor.generate_totp_secret()})
+        inserts.append(time.perf_counter() - start)
+    stages["db.insert"] = common.summarize(inserts)
+
+    picker = random.Random(0)
+
+    def lookup():
+        store.get_user(f"bench_user_{picker.randrange(args.users)}",
+                       ("password", "voice", "face", "phone", "otp_provider", "totp_secret"))
+
+    stages["db.user_lookup"] = common.summarize(common.measure(lookup, args.iterations * 20))
+
+
+def bench_voice(args, stages):
+    enrolled = fixtures.synth_voice_wav(1, 0, args.seconds)
+    attempt = fixtures.synth_voice_wav(1, 1, args.seconds)
+    stages["voice.load_waveform"] = common.summarize(
+        common.measure(lambda: voiceDetection.load_waveform(enrolled), args.iterations * 10))
+    stages["voice.codec_encode"] = common.summarize(
+        common.measure(lambda: voiceCodec.encode(enrolled), args.iterations * 10))
+    encoded = voiceCodec.encode(enrolled)
+    stages["voice.codec_decode"] = common.summarize(
+        common.measure(lambda: voiceCodec.decode(encoded), args.iterations * 10))
+
+    if args.model == "skip":
+        stages["voice.embedding"] = common.summarize([])
+        return
+    stages["voice.embedding"] = common.summarize(
+        common.measure(lambda: voiceDetection.embed(attempt), args.iterations))
+
+    # enrollment recordings are embedded once per login; repeats are served by the cache
+    voiceDetection.embed_cached(enrolled)
+    stages["voice.embedding_cached"] = common.summarize(
+        common.measure(lambda: voiceDetection.embed_cached(enrolled), args.iterations * 100))
+    stages["voice.content_key"] = common.summarize(
+        common.measure(lambda: embeddingCache.content_key(enrolled, voiceDetection.model_version()),
+                       args.iterations * 100))
+
+    embedding1 = voiceDetection.embed(enrolled)
+    embedding2 = voiceDetection.embed(attempt)
+    stages["voice.distance"] = common.summarize(
+        common.measure(lambda: voiceDetection.cosine_distance(embedding1, embedding2), args.iterations * 100))
+
+    # against a voice template the enrolled side is one stored centroid and a dot product
+    template, template_stats, _ = voiceDetection.build_template([enrolled])
+    stages["voice.template_distance"] = common.summarize(common.measure(
+        lambda: voiceDetection.template_distance(embedding2, voiceDetection.template_vector(template, template_stats)),
+        args.iterations * 100))
+
+
+def bench_face(args, stages):
+    stored = faceTemplate.store(fixtures.synth_face(2))
+    capture = fixtures.synth_face(2, 1)
+    stages["face.match"] = common.summarize(
+        common.measure(lambda: authentication.face_distance(stored, capture), args.iterations * 100))
+
+
+def bench_two_factor(args, stages):
+    secret = twoFactor.generate_totp_secret()
+    provider = twoFactor.get_provider(twoFactor.PROVIDER_TOTP)
+    user = {"username": "bench", "phone": "+15550000000", "totp_secret": secret}
+    logins = itertools.count()  # a code is accepted once per user, so every check is another user's
+    stages["twofactor.totp_check"] = common.summarize(common.measure(
+        lambda: provider.verify_code(dict(user, username=f"bench_{next(logins)}"), twoFactor.totp(secret)),
+        args.iterations * 100))
+
+    with common.twilio_stub(latency_ms=args.twilio_latency_ms):
+        def round_trip():
+            twoFactor.send_2fa_code(user["phone"])
+            twoFactor.verify_2fa_code(user["phone"], "123456")
+
+        stages["twofactor.twilio_stub_round_trip"] = common.summarize(common.measure(round_trip, args.iterations))
+
+
+def bench_end_to_end(args, stages, breakdown):
+    """Drives the real CLI register/login flows with scripted answers."""
+    if args.model == "skip":
+        stages["e2e.register"] = stages["e2e.login"] = common.summarize([])
+        return
+
+    state = {"user": 0, "recording": 0}
+
+    def next_voice():
+        state["recording"] += 1
+        return fixtures.synth_voice_wav(state["user"], state["recording"], args.seconds)
+
+    def next_face():
+        return fixtures.synth_face(state["user"], state["recording"])
+
+    def secret_of(username):
+        return authentication.get_store().get_user(username, ("totp_secret",))["totp_secret"]
+
+    registrations, logins = [], []
+    metrics.reset()
+    metrics.enable()
+    with common.stubbed_hardware(next_voice, next_face), common.quiet():
+        for i in range(args.iterations):
+            state["user"] = 10_000 + i
+            username = f"e2e_user_{i}"
+            answers = [username, "password", "password", "5550000000", "2"]
+            with common.scripted_input(answers):
+                start = time.perf_counter()
+                authentication.register_user()
+                registrations.append(time.perf_counter() - start)
+
+            secret = secret_of(username)
+            with common.scripted_input([username, "password", lambda: twoFactor.totp(secret)]):
+                start = time.perf_counter()
+                authentication.authenticate_user()
+                logins.append(time.perf_counter() - start)
+    metrics.disable()
+
+    stages["e2e.register"] = common.summarize(registrations)
+    stages["e2e.login"] = common.summarize(logins)
+    # where the end-to-end time went, from the instrumentation inside the flows
+    for stage, data in metrics.snapshot().items():
+        breakdown[stage] = {"n": data["count"], "mean_ms": round(data["mean"] * 1000, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of registration and login stages.")
+    parser.add_argument("--iterations", type=int, default=5, help="timed repetitions of the slow stages")
+    parser.add_argument("--users", type=int, default=200, help="rows inserted for the database stages")
+    parser.add_argument("--seconds", type=float, default=3.0, help="length of the synthetic recordings")
+    parser.add_argument("--model", choices=["untrained", "pretrained", "skip"], default="untrained",
+                        help="speaker model: random weights (offline), the real Hugging Face model, or none")
+    parser.add_argument("--twilio-latency-ms", type=float, default=0.0, help="latency injected by the Verify stub")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    common.add_store_argument(parser)
+    args = parser.parse_args()
+    common.select_store(args.store)
+
+    output = os.path.abspath(args.output)
+    compare = os.path.abspath(args.compare) if args.compare else None
+    stages, breakdown = {}, {}
+
+    with tempfile.TemporaryDirectory() as directory, common.temporary_database(directory):
+        # the CLI flows write their temporary recordings to the working directory
+        previous_cwd = os.getcwd()
+        os.chdir(directory)
+        auditLog.configure(os.path.join(directory, "bench_audit.db"))
+        # every e2e login comes from this terminal; the limiter would refuse them past its burst
+        rateLimiter.enabled = False
+        try:
+            common.prepare_speaker_model(args.model)
+            bench_password(args, stages)
+            bench_database(args, stages)
+            bench_voice(args, stages)
+            bench_face(args, stages)
+            bench_two_factor(args, stages)
+            bench_end_to_end(args, stages, breakdown)
+        finally:
+            auditLog.shutdown()
+            os.chdir(previous_cwd)
+
+    results = {"meta": common.run_metadata(args), "stages": stages, "e2e_breakdown": breakdown,
+               "embedding_cache": embeddingCache.get_cache().stats(), "audit_log": auditLog.stats()}
+    common.print_stages(stages)
+    common.write_results(output, results)
+    print(f"\nResults written to {output}")
+    if compare:
+        common.compare_results(compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# File: bulkTransfer.py
+# Description: Streaming bulk import and export of users, for onboarding
+# thousands of users at once and for moving them between databases.
+#
+# A manifest is CSV (with a header row) or JSON lines, one user per record:
+#
+#   username, phone, voice, face           required; voice and face are file
+#                                          paths, relative to the manifest
+#   password | password_hash               plain text (hashed here) or bcrypt
+#   otp_provider, totp_secret              optional
+#   voice_template, voice_stats            optional, together: a .vtpl file
+#                                          (path as above) and its stats object
+#
+# Voices are wav recordings or voiceCodec .vcod files. Faces are photos
+# (cropped by face detection with detect=True), face crops, or .ftpl files
+# holding a stored faceTemplate as is. A .vtpl file is a stored voice template
+# (voiceDetection.build_template) as is; without one the user logs in against
+# the voice recording until they enroll again.
+#
+# The importer reads the manifest lazily and validates, hashes and encodes
+# records in a pool of worker threads with a bounded number in flight. Rows go
+# to the user store (userStore.py) with executemany in batches, inside
+# transactions of transaction_size rows (one per shard when sharded). A
+# record's result is only yielded once the transaction holding it has
+# committed. The exporter streams the store with iterate_users and writes each
+# user's media plus a manifest line as it goes, so memory stays flat however
+# many users there are. Its manifest imports again unchanged.
+
+import csv
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+import faceTemplate
+import twoFactor
+import userStore
+import voiceCodec
+
+BATCH_SIZE = 500
+TRANSACTION_SIZE = 5000
+EXPORT_FETCH = 64  # rows held at once; voice BLOBs are ~70 KB each
+
+FIELDS = ("username", "phone", "voice", "face", "password", "password_hash", "otp_provider", "totp_secret",
+          "voice_template", "voice_stats")
+MEDIA_FIELDS = ("voice", "face", "voice_template")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+_local = threading.local()
+
+
+def face_cascade():
+    """This thread's face detector (one per worker thread)."""
+    if not hasattr(_local, "face_cascade"):
+        import authentication
+        _local.face_cascade = authentication.load_face_cascade()
+    return _local.face_cascade
+
+
+def parallel(func, items, workers):
+    """Yields (item, result, error) in order as func(item) finishes, with at most 2 * workers in flight."""
+    if workers <= 1:
+        for item in items:
+            try:
+                yield item, func(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        items = iter(items)
+
+        def submit():
+            for item in items:
+                pending.append((item, pool.submit(func, item)))
+                return True
+            return False
+
+        for _ in range(2 * workers):
+            submit()
+        while pending:
+            item, future = pending.popleft()
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, e
+            submit()
+
+
+def read_manifest(path):
+    """Yields (line number, record dict) from a CSV or JSON lines manifest, lazily.
+
+    File paths in the records are resolved against the manifest's directory.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as file:
+        if path.lower().endswith(".csv"):
+            # DictReader's line_num counts physical lines; the header is line 1
+            reader = csv.DictReader(file)
+            records = ((reader.line_num, record) for record in reader)
+        else:
+            records = ((number, _json_record(line)) for number, line in enumerate(file, 1) if line.strip())
+        for number, record in records:
+            record = {key: (value.strip() if isinstance(value, str) else value)
+                      for key, value in record.items() if key in FIELDS + ("error",) and value not in (None, "")}
+            for key in MEDIA_FIELDS:
+                if key in record:
+                    record[key] = os.path.join(base, record[key])
+            yield number, record
+
+
+def _json_record(line):
+    # a malformed line fails that record, not the whole import
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return {"error": f"invalid JSON: {e}"}
+    return record if isinstance(record, dict) else {"error": "record is not a JSON object"}
+
+
+def _phone(phone):
+    phone = str(phone).strip()
+    digits = phone[1:] if phone.startswith("+") else phone
+    if not digits.isdigit():
+        raise ValueError(f"invalid phone number {phone!r}")
+    return phone if phone.startswith("+") else "+1" + phone
+
+
+def _read(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def load_face(path, detect=False):
+    """Face template bytes from a .ftpl file (validated) or an image."""
+    if path.lower().endswith(".ftpl"):
+        blob = _read(path)
+        faceTemplate.decode(blob)  # raises on a malformed template
+        return blob
+    if not path.lower().endswith(IMAGE_EXTENSIONS):
+        raise ValueError(f"unsupported face file {os.path.basename(path)}")
+    import authentication
+    return faceTemplate.store(authentication.face_from_image(path, face_cascade() if detect else None, detect))
+
+
+def load_voice_template(path, stats):
+    """(template BLOB, stats JSON) from a .vtpl file and its stats (an object or JSON text)."""
+    if not path.lower().endswith(".vtpl"):
+        raise ValueError(f"unsupported voice template file {os.path.basename(path)}")
+    blob = _read(path)
+    if not blob or len(blob) % 4:
+        raise ValueError("voice_template is not a float32 vector")  # voiceDetection.TEMPLATE_DTYPE
+    if isinstance(stats, str):
+        try:
+            stats = json.loads(stats)
+        except ValueError as e:
+            raise ValueError(f"invalid voice_stats: {e}") from None
+    if not isinstance(stats, dict) or not stats.get("model"):
+        raise ValueError("voice_stats is not a stats object with a model")
+    return blob, json.dumps(stats)
+
+
+def prepare_row(record, detect=False):
+    """Validates one manifest record and builds its user dict (bcrypt and encoding happen here)."""
+    if "error" in record:
+        raise ValueError(record["error"])
+    for key in ("username", "phone", "voice", "face"):
+        if not record.get(key):
+            raise ValueError(f"missing {key}")
+    if record.get("password_hash"):
+        password = record["password_hash"].encode("utf-8")
+        if not password.startswith(b"$2"):
+            raise ValueError("password_hash is not a bcrypt hash")
+    elif record.get("password"):
+        password = bcrypt.hashpw(record["password"].encode("utf-8"), bcrypt.gensalt())
+    else:
+        raise ValueError("missing password or password_hash")
+    otp_provider = record.get("otp_provider", twoFactor.DEFAULT_PROVIDER)
+    totp_secret = record.get("totp_secret") or twoFactor.get_provider(otp_provider).enroll(record["username"])
+    voice = voiceCodec.encode(_read(record["voice"]))
+    face = load_face(record["face"], detect)
+    voice_template = voice_stats = None
+    if ("voice_template" in record) != ("voice_stats" in record):
+        raise ValueError("voice_template and voice_stats go together")
+    if "voice_template" in record:
+        voice_template, voice_stats = load_voice_template(record["voice_template"], record["voice_stats"])
+    return {"username": record["username"], "password": password, "voice": voice, "face": face,
+            "phone": _phone(record["phone"]), "otp_provider": otp_provider, "totp_secret": totp_secret,
+            "voice_template": voice_template, "voice_stats": voice_stats}
+
+
+def _insert_batch(writer, batch):
+    """Inserts prepared (line, user) pairs; returns a result per pair. Usernames
+    already taken, in the store or earlier in the batch, are reported, not inserted."""
+    inserted = writer.insert_many([user for _, user in batch])
+    results = []
+    for (line, user), result in zip(batch, inserted):
+        if result["id"] is None:
+            results.append({"line": line, "username": user["username"], "ok": False,
+                            "error": "username already exists"})
+        else:
+            results.append({"line": line, "username": user["username"], "ok": True, "user_id": result["id"]})
+    return results
+
+
+def import_manifest(store, manifest, workers=4, batch_size=BATCH_SIZE, transaction_size=TRANSACTION_SIZE,
+                    detect=False):
+    """Imports a manifest into a user store; yields a result dict per record once
+    it is committed (or has failed)."""
+    batch, committed, pending = [], [], 0
+    with store.writer() as writer:
+
+        def flush():
+            nonlocal batch
+            if batch:
+                committed.extend(_insert_batch(writer, batch))
+                batch = []
+
+        for (line, record), user, error in parallel(lambda item: prepare_row(item[1], detect),
+                                                    read_manifest(manifest), workers):
+            if error is not None:
+                yield {"line": line, "username": record.get("username"), "ok": False, "error": str(error)}
+                continue
+            batch.append((line, user))
+            pending += 1
+            if len(batch) >= batch_size:
+                flush()
+            if pending >= transaction_size:
+                flush()
+                writer.commit()
+                yield from committed
+                committed, pending = [], 0
+        flush()
+        writer.commit()
+    yield from committed
+
+
+def export_manifest(store, directory, include_secrets=False, fetch_size=EXPORT_FETCH):
+    """Writes every user's voice and face under directory/media and a users.jsonl
+    manifest next to them, streaming; yields a result dict per user.
+
+    Voices, faces and voice templates are written as stored (.vcod or legacy
+    .wav, .ftpl, .vtpl with its stats in the manifest), so the export is lossless. A sharded store is read from every shard at once, so
+    users come out in no particular order. Password hashes and TOTP secrets are only written with
+    include_secrets; without them the manifest can't be imported.
+    """
+    media = os.path.join(directory, "media")
+    os.makedirs(media, exist_ok=True)
+    with open(os.path.join(directory, "users.jsonl"), "w") as manifest:
+        for user in store.iterate_users(userStore.COLUMNS, fetch_size):
+            user_id, password, voice, face = user["id"], user["password"], user["voice"], user["face"]
+            record = {"username": user["username"], "phone": user["phone"], "otp_provider": user["otp_provider"]}
+            if voice is not None:
+                name = f"{user_id}.vcod" if voiceCodec.is_encoded(voice) else f"{user_id}.wav"
+                with open(os.path.join(media, name), "wb") as file:
+                    file.write(voice)
+                record["voice"] = f"media/{name}"
+            if face is not None:
+                with open(os.path.join(media, f"{user_id}.ftpl"), "wb") as file:
+                    file.write(face)
+                record["face"] = f"media/{user_id}.ftpl"
+            if user["voice_template"] is not None and user["voice_stats"]:
+                with open(os.path.join(media, f"{user_id}.vtpl"), "wb") as file:
+                    file.write(user["voice_template"])
+                record["voice_template"] = f"media/{user_id}.vtpl"
+                record["voice_stats"] = json.loads(user["voice_stats"])
+            if include_secrets:
+                record["password_hash"] = password.decode("utf-8") if isinstance(password, bytes) else password
+                if user["totp_secret"]:
+                    record["totp_secret"] = user["totp_secret"]
+            manifest.write(json.dumps(record) + "\n")
+            yield {"username": user["username"], "user_id": user_id, "ok": True}
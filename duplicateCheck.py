@@ -0,0 +1,194 @@
+# File: duplicateCheck.py
+# Description: Duplicate-enrollment detection at registration time. Before a
+# new user is inserted, their voice embedding and face feature vector are
+# searched (top-k) in the embeddingStore galleries (one per database file of
+# the user store, or kept in memory for a store without files), and enrolled
+# users who are too close are reported.
+#
+# A search costs one matrix-vector product over the gallery, or an IVF probe
+# (annIndex.py) once the gallery has ANN_MIN_GALLERY rows, plus a lookup of at
+# most TOP_K users; either way it stays bounded as the users table grows.
+
+import os
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+import numpy as np
+
+import annIndex
+import embeddingStore
+import faceTemplate
+import metrics
+import voiceDetection
+
+# what registration does with a near-duplicate: "block" it, "warn" and let the
+# user decide, or "off" to skip the check
+DUPLICATE_CHECK = os.getenv("DUPLICATE_CHECK", "warn")
+
+# a voice this close to an enrolled one would pass that user's login check
+VOICE_DUPLICATE_SIMILARITY = 1.0 - voiceDetection.VOICE_THRESHOLD
+# mean squared pixel difference below which two faces are the same: by default
+# the login threshold, so a flagged face would pass the other user's face check
+FACE_DUPLICATE_MSE = float(os.getenv("FACE_DUPLICATE_MSE", str(faceTemplate.MATCH_THRESHOLD)))
+
+TOP_K = 5
+ANN_MIN_GALLERY = 20000  # smaller galleries are searched exactly
+ANN_NPROBE = 16
+
+Duplicate = namedtuple("Duplicate", "kind user_id username score")
+
+_indexes = {}  # gallery path -> (IVFIndex, rows indexed)
+_indexes_lock = threading.Lock()
+_synced = set()  # gallery paths fully synced by this process
+_memory_galleries = weakref.WeakKeyDictionary()  # store without files -> {kind: [gallery, newest id synced]}
+
+
+def _candidates(store, vector, k):
+    # exact search for small galleries, otherwise the IVF index (kept up to date with appended rows)
+    if store.count < ANN_MIN_GALLERY:
+        return store.search(vector, k)
+    with _indexes_lock:
+        # keyed by model too: a rebuilt gallery (another model) starts a new index
+        index, indexed = _indexes.get((store.path, store.model), (None, 0))
+        if index is None:
+            index = annIndex.IVFIndex.from_store(store, nprobe=ANN_NPROBE)
+        elif store.count > indexed:
+            new = np.arange(indexed, store.count)
+            new = new[store.live()[new]]
+            index.add(np.asarray(store.ids[new]), np.asarray(store.matrix[new]))
+        _indexes[(store.path, store.model)] = (index, store.count)
+    return index.search(vector, k)
+
+
+def _gallery(partition, kind):
+    # the first check of a process runs a full sync; later ones only append users
+    # registered since (deleted users are dropped by the get_users lookup)
+    if partition.path is None:
+        return _memory_gallery(partition, kind)
+    path = embeddingStore.default_path(partition.path, kind)
+    with _indexes_lock:
+        full = path not in _synced
+        _synced.add(path)
+    embeddingStore.sync(partition.path, kind, path, full=full)
+    return embeddingStore.EmbeddingStore(path) if os.path.exists(path + ".emb") else None
+
+
+def _memory_gallery(partition, kind):
+    # the in-memory counterpart of embeddingStore.sync: appends users with ids
+    # above the newest one seen (the store hands ids out in increasing order)
+    model = embeddingStore.gallery_model(kind)
+    with _indexes_lock:
+        entry = _memory_galleries.setdefault(partition, {}).setdefault(kind, [None, 0])
+        if entry[0] is not None and entry[0].model != model:
+            entry[:] = [None, 0]  # made by another model: rebuilt from every user
+        newest = partition.last_id
+        if newest > entry[1]:
+            columns = embeddingStore.COLUMNS[kind]
+            users = [user for user in partition.get_users(range(entry[1] + 1, newest + 1), ("id",) + columns)
+                     if user[kind] is not None]
+            for start in range(0, len(users), 64):
+                chunk = users[start:start + 64]
+                vectors = embeddingStore.VECTORIZERS[kind]([[user[column] for column in columns] for user in chunk])
+                if entry[0] is None:
+                    entry[0] = embeddingStore.MemoryEmbeddingStore(f"memory:{id(partition)}.{kind}",
+                                                                   vectors.shape[1], model)
+                entry[0].append([user["id"] for user in chunk], vectors)
+            entry[1] = newest
+        return entry[0]
+
+
+def _search(store, kind, vector, k):
+    # top-k of every partition's gallery (one per database file): (partition, global ids, scores)
+    for partition in store.partitions():
+        gallery = _gallery(partition, kind)
+        if gallery is not None:
+            local_ids, scores = _candidates(gallery, vector, k)
+            yield partition, [partition.global_id(int(user_id)) for user_id in local_ids if user_id >= 0], scores
+
+
+def find_duplicates(store, voice=None, face=None, k=TOP_K, voice_embedding=None):
+    """Searches the galleries for enrolled users matching a new voice BLOB and/or face template.
+
+    voice_embedding is the new user's voice template centroid, which is what
+    the voice galleries hold for users with a template; without one the BLOB
+    is embedded, as the galleries do for users enrolled before templates.
+
+    Returns (duplicates, timings in ms, vectors); pass the vectors to
+    record_enrollment once the user is inserted so the galleries stay current.
+    """
+    duplicates, timings, vectors = [], {}, {}
+
+    if voice is not None or voice_embedding is not None:
+        start = time.perf_counter()
+        with metrics.span("enroll.duplicate_voice"):
+            # embed_cached: without a template the same BLOB is embedded again at this user's first login
+            embedding = voice_embedding if voice_embedding is not None else voiceDetection.embed_cached(voice)
+            vectors["voice"] = embedding
+            for partition, user_ids, scores in _search(store, "voice", embedding, k):
+                close = {user_id: float(score) for user_id, score in zip(user_ids, scores)
+                         if score >= VOICE_DUPLICATE_SIMILARITY}
+                for user in partition.get_users(list(close)):
+                    duplicates.append(Duplicate("voice", user["id"], user["username"], close[user["id"]]))
+        timings["voice_ms"] = (time.perf_counter() - start) * 1000
+
+    if face is not None:
+        start = time.perf_counter()
+        with metrics.span("enroll.duplicate_face"):
+            vectors["face"] = feature = faceTemplate.feature_vector(face)
+            # the gallery ranks by cosine; the decision is the login check, the new face as a
+            # capture against each candidate's stored one (estimated from the vectors when
+            # the new face is kept only as a projection)
+            image = None if faceTemplate.read_header(face)["kind"] == "projection" else faceTemplate.decode(face)
+            pixels = faceTemplate.FEATURE_SHAPE[0] * faceTemplate.FEATURE_SHAPE[1]
+            for partition, user_ids, _ in _search(store, "face", feature, k):
+                for user in partition.get_users(user_ids, ("id", "username", "face")):
+                    if image is not None:
+                        mse = faceTemplate.distance(user["face"], image)
+                    else:
+                        mse = float(np.sum((faceTemplate.feature_vector(user["face"]) - feature) ** 2)) / pixels
+                    if mse <= FACE_DUPLICATE_MSE:
+                        duplicates.append(Duplicate("face", user["id"], user["username"], mse))
+        timings["face_ms"] = (time.perf_counter() - start) * 1000
+
+    return duplicates, timings, vectors
+
+
+def record_enrollment(store, user_id, vectors, replace=False):
+    """Appends a newly inserted user's vectors to the galleries of their database file.
+
+    With replace (after store.update_biometrics) the user's previous rows are
+    removed first. A user inserted by another process without going through
+    here, with an id below this one, is missed by the incremental syncs until
+    the next full one.
+    """
+    partition = store.locate(user_id)
+    local_id = partition.local_id(user_id)
+    for kind, vector in vectors.items():
+        if partition.path is None:
+            # syncing the memory gallery picks a new user up; an update replaces their row
+            gallery = _memory_gallery(partition, kind)
+            if replace and gallery is not None:
+                gallery.remove([local_id])
+                gallery.append([local_id], [vector])
+            continue
+        path = embeddingStore.default_path(partition.path, kind)
+        model = embeddingStore.gallery_model(kind)
+        if os.path.exists(path + ".emb") and embeddingStore.EmbeddingStore(path).model != model:
+            continue  # another model's gallery; the next sync rebuilds it, this user included
+        gallery = embeddingStore.EmbeddingStore(path, dimension=len(vector), model=model)
+        if replace:
+            gallery.remove([local_id])
+        gallery.append([local_id], [vector])
+
+
+def describe(duplicates):
+    """One line per match, for the CLI and GUI messages."""
+    lines = []
+    for duplicate in duplicates:
+        if duplicate.kind == "voice":
+            lines.append(f"voice matches '{duplicate.username}' (similarity {duplicate.score:.2f})")
+        else:
+            lines.append(f"face matches '{duplicate.username}' (difference {duplicate.score:.0f})")
+    return lines
@@ -0,0 +1,165 @@
+# File: embeddingCache.py
+# Description: Content-addressed cache of speaker embeddings.
+# Enrollment recordings are embedded on every login of their user; the cache
+# keys an embedding by a hash of the PCM samples plus the model version, so
+# identical audio is only run through the network once.
+#
+# Tier 1 is an in-memory LRU with a byte budget (VOICE_CACHE_MB, default 16).
+# Tier 2 is an optional SQLite file (VOICE_CACHE_DB, unset = disabled) that
+# survives restarts.
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+import wave
+from collections import OrderedDict
+
+import numpy as np
+
+import voiceCodec
+
+DEFAULT_MEMORY_BUDGET = int(float(os.getenv("VOICE_CACHE_MB", "16")) * 1024 * 1024)
+DEFAULT_DISK_PATH = os.getenv("VOICE_CACHE_DB") or None
+
+# rough per-entry cost of the key string and OrderedDict bookkeeping
+ENTRY_OVERHEAD = 200
+
+
+def pcm_payload(audio):
+    """Bytes that identify a recording: the PCM frames of a wav (header ignored) or an array's buffer.
+
+    A voiceCodec blob gives the same bytes as the wav it was encoded from, so
+    migrated rows keep their cached embeddings.
+    """
+    if isinstance(audio, np.ndarray):
+        return np.ascontiguousarray(audio).tobytes()
+    if isinstance(audio, (bytes, bytearray, memoryview)) and voiceCodec.is_encoded(audio):
+        samples, rate = voiceCodec.decode(audio)
+        return f"1:2:{rate}:".encode() + samples.astype("<i2", copy=False).tobytes()
+    source = io.BytesIO(audio) if isinstance(audio, (bytes, bytearray, memoryview)) else audio
+    with wave.open(source, 'rb') as waveFile:
+        header = f"{waveFile.getnchannels()}:{waveFile.getsampwidth()}:{waveFile.getframerate()}:".encode()
+        return header + waveFile.readframes(waveFile.getnframes())
+
+
+def content_key(audio, model_version):
+    """sha256 of the model version and the recording's PCM samples."""
+    digest = hashlib.sha256(model_version.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(pcm_payload(audio))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier (memory LRU + optional SQLite) embedding cache with hit-rate statistics."""
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, disk_path=DEFAULT_DISK_PATH):
+        self.memory_budget = memory_budget
+        self.disk_path = disk_path
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> embedding, least recently used first
+        self.memory_bytes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        if disk_path:
+            conn = self._connect()
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                         "key TEXT PRIMARY KEY, dtype TEXT, vector BLOB, created REAL)")
+            conn.commit()
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.disk_path, timeout=5)
+
+    def _remember(self, key, embedding):
+        # caller holds the lock
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        size = embedding.nbytes + ENTRY_OVERHEAD
+        if size > self.memory_budget:
+            return
+        self.entries[key] = embedding
+        self.memory_bytes += size
+        while self.memory_bytes > self.memory_budget:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes + ENTRY_OVERHEAD
+            self.counters["evictions"] += 1
+
+    def get(self, key):
+        """Returns the cached embedding or None."""
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is not None:
+                self.entries.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return embedding
+
+        if self.disk_path:
+            conn = self._connect()
+            row = conn.execute("SELECT dtype, vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            conn.close()
+            if row is not None:
+                embedding = np.frombuffer(row[1], dtype=row[0])
+                with self.lock:
+                    self.counters["disk_hits"] += 1
+                    self._remember(key, embedding)
+                return embedding
+
+        with self.lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key, embedding):
+        embedding = np.array(embedding, copy=True).reshape(-1)
+        embedding.setflags(write=False)  # shared between callers, so nobody may modify it
+        with self.lock:
+            self._remember(key, embedding)
+        if self.disk_path:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO embeddings (key, dtype, vector, created) VALUES (?, ?, ?, ?)",
+                         (key, embedding.dtype.str, embedding.tobytes(), time.time()))
+            conn.commit()
+            conn.close()
+        return embedding
+
+    def get_or_compute(self, key, compute):
+        """Cached embedding for key, calling compute() on a miss."""
+        embedding = self.get(key)
+        if embedding is None:
+            embedding = self.put(key, compute())
+        return embedding
+
+    def clear(self, disk=False):
+        with self.lock:
+            self.entries.clear()
+            self.memory_bytes = 0
+        if disk and self.disk_path:
+            conn = self._connect()
+            conn.execute("DELETE FROM embeddings")
+            conn.commit()
+            conn.close()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, entries=len(self.entries), memory_bytes=self.memory_bytes,
+                         memory_budget=self.memory_budget)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide cache, configured from the environment."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
@@ -0,0 +1,381 @@
+# File: embeddingStore.py
+# Description: Append-only, memory-mapped matrix of L2-normalised embeddings for
+# 1:N searches, kept in sync with the users table. Two files per gallery:
+#
+#   <name>.emb  64-byte header (magic, version, dimension, row count, the model
+#               that made the rows) followed by float32 rows, appended in place
+#   <name>.ids  one int64 users.id per row; -1 marks a removed row (tombstone)
+#
+# Every row of a gallery comes from one vectorizer: a voice is the user's
+# template centroid when they have one (as enrollment searches and records it),
+# else the embedding of their recording. A gallery made by another speaker
+# model or backend is rebuilt by the next sync rather than mixed with it.
+#
+# Opening a store maps both files instead of reading them, so it costs the same
+# for ten users as for a million, and processes on one machine share the pages.
+#
+#   python embeddingStore.py sync --db user_auth.db --kind voice
+#   python embeddingStore.py stats --db user_auth.db
+
+import argparse
+import contextlib
+import hashlib
+import os
+import sqlite3
+import struct
+import threading
+
+import numpy as np
+
+import userStore
+
+try:
+    import fcntl  # serialises writers across processes (POSIX only)
+except ImportError:
+    fcntl = None
+
+MAGIC = b"EMBSTOR1"
+VERSION = 2  # version 1 left the model out (zero padding), so its galleries are rebuilt
+HEADER = struct.Struct("<8sIIQ40s")  # magic, version, dimension, rows, model; 64 bytes
+DTYPE = np.dtype("<f4")
+TOMBSTONE = -1
+
+KINDS = ("voice", "face")
+
+
+def default_path(db_path, kind):
+    """Where the gallery of one users column lives, next to the database."""
+    return f"{os.path.splitext(db_path)[0]}.{kind}"
+
+
+def model_tag(model):
+    # the model name as is when it fits the header, else its digest
+    encoded = model.encode("utf-8")
+    return encoded if len(encoded) <= 40 else hashlib.sha1(encoded).hexdigest().encode("ascii")
+
+
+def gallery_model(kind):
+    """What made a gallery's vectors, recorded in its header."""
+    if kind == "voice":
+        import voiceDetection
+        return voiceDetection.model_version()
+    import faceTemplate
+    return f"projection-{faceTemplate.PROJECTION_DIMS}-{faceTemplate.PROJECTION_SEED}"
+
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingStore:
+    """Memory-mapped gallery of normalised embeddings keyed by users.id."""
+
+    def __init__(self, path, dimension=None, model=""):
+        self.path = path
+        self.data_path = path + ".emb"
+        self.ids_path = path + ".ids"
+        self.lock = threading.Lock()
+        if not os.path.exists(self.data_path):
+            if dimension is None:
+                raise FileNotFoundError(f"No embedding store at {self.data_path} (give a dimension to create one)")
+            with open(self.data_path, "wb") as file:
+                file.write(HEADER.pack(MAGIC, VERSION, dimension, 0, model_tag(model)))
+            open(self.ids_path, "wb").close()
+
+        with open(self.data_path, "rb") as file:
+            magic, version, self.dimension, _, tag = HEADER.unpack(file.read(HEADER.size))
+        self.model = tag.rstrip(b"\0").decode("utf-8", "replace")  # as model_tag() wrote it
+        if magic != MAGIC:
+            raise ValueError(f"{self.data_path} is not an embedding store")
+        if version > VERSION:
+            raise ValueError(f"Embedding store version {version} is newer than this reader ({VERSION})")
+        if dimension is not None and dimension != self.dimension:
+            raise ValueError(f"{self.data_path} holds {self.dimension}-d embeddings, not {dimension}-d")
+        self.count = -1
+        self.refresh()
+
+    def _read_count(self):
+        with open(self.data_path, "rb") as file:
+            return HEADER.unpack(file.read(HEADER.size))[3]
+
+    def refresh(self):
+        """Maps rows appended since the last refresh (by this or another process)."""
+        count = self._read_count()
+        if count == self.count:
+            return
+        self.count = count
+        if count == 0:
+            self.matrix = np.empty((0, self.dimension), dtype=DTYPE)
+            self.ids = np.empty(0, dtype=np.int64)
+        else:
+            self.matrix = np.memmap(self.data_path, dtype=DTYPE, mode="r", offset=HEADER.size,
+                                    shape=(count, self.dimension))
+            self.ids = np.memmap(self.ids_path, dtype="<i8", mode="r", shape=(count,))
+
+    @contextlib.contextmanager
+    def _writing(self):
+        # one writer at a time, across threads and (where flock exists) processes
+        with self.lock, open(self.data_path, "r+b") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield file
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def append(self, user_ids, embeddings):
+        """Appends rows (normalised here). Readers see them once the header count is updated."""
+        user_ids = np.atleast_1d(np.asarray(user_ids, dtype="<i8"))
+        rows = normalize(embeddings).astype(DTYPE, copy=False)
+        if rows.shape != (len(user_ids), self.dimension):
+            raise ValueError(f"Expected {len(user_ids)} x {self.dimension} embeddings, got {rows.shape}")
+        with self._writing() as file:
+            count = HEADER.unpack(file.read(HEADER.size))[3]
+            file.seek(HEADER.size + count * self.dimension * DTYPE.itemsize)
+            file.write(rows.tobytes())
+            with open(self.ids_path, "r+b") as ids:
+                ids.seek(count * 8)
+                ids.write(user_ids.tobytes())
+                ids.flush()
+            file.flush()
+            # the rows are complete; publishing the new count is the commit point
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, VERSION, self.dimension, count + len(user_ids), model_tag(self.model)))
+        self.refresh()
+
+    def remove(self, user_ids):
+        """Tombstones every row of the given users. Returns the number of rows removed."""
+        self.refresh()
+        targets = np.flatnonzero(np.isin(self.ids, np.atleast_1d(user_ids)))
+        if len(targets) == 0:
+            return 0
+        with self._writing():
+            ids = np.memmap(self.ids_path, dtype="<i8", mode="r+", shape=(self.count,))
+            ids[targets] = TOMBSTONE
+            ids.flush()
+            del ids
+        return len(targets)
+
+    def live(self):
+        """Boolean mask of the rows that haven't been removed."""
+        return self.ids != TOMBSTONE
+
+    def live_ids(self):
+        return np.asarray(self.ids[self.live()])
+
+    def get(self, user_id):
+        """The newest live embedding of a user, or None."""
+        rows = np.flatnonzero(np.asarray(self.ids) == user_id)
+        return None if len(rows) == 0 else np.asarray(self.matrix[rows[-1]])
+
+    def search(self, query, k=5):
+        """Exact top-k by cosine similarity over the live rows: (user ids, similarities)."""
+        self.refresh()
+        if self.count == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = np.asarray(self.matrix @ normalize(query)[0])
+        scores[~self.live()] = -np.inf
+        k = min(k, int(self.live().sum()))
+        top = np.argpartition(-scores, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+        top = top[np.argsort(-scores[top])]
+        return np.asarray(self.ids[top]), scores[top]
+
+    def compact(self):
+        """Rewrites the files without tombstoned rows. Open readers keep their old
+        mapping; run it while no other process is appending."""
+        with self._writing():
+            self.refresh()
+            keep = self.live()
+            rows, ids = np.asarray(self.matrix[keep]), np.asarray(self.ids[keep], dtype="<i8")
+            with open(self.data_path + ".tmp", "wb") as file:
+                file.write(HEADER.pack(MAGIC, VERSION, self.dimension, len(ids), model_tag(self.model)))
+                file.write(rows.astype(DTYPE, copy=False).tobytes())
+            with open(self.ids_path + ".tmp", "wb") as file:
+                file.write(ids.tobytes())
+            os.replace(self.ids_path + ".tmp", self.ids_path)
+            os.replace(self.data_path + ".tmp", self.data_path)
+            self.count = -1
+        self.refresh()
+
+    def stats(self):
+        self.refresh()
+        live = int(self.live().sum()) if self.count else 0
+        return {"rows": self.count, "live": live, "tombstones": self.count - live, "dimension": self.dimension,
+                "model": self.model, "bytes": os.path.getsize(self.data_path) + os.path.getsize(self.ids_path)}
+
+
+class MemoryEmbeddingStore(EmbeddingStore):
+    """An EmbeddingStore held in this process's memory, for user stores without
+    files (userStore.MemoryUserStore). Same search, append and remove."""
+
+    def __init__(self, path, dimension, model=""):
+        self.path = path  # only a name; nothing is written
+        self.dimension = dimension
+        self.model = model
+        self.lock = threading.Lock()
+        self._matrix = np.empty((64, dimension), dtype=DTYPE)
+        self._ids = np.empty(64, dtype=np.int64)
+        self.count = 0
+        self.refresh()
+
+    def refresh(self):
+        self.matrix = self._matrix[:self.count]
+        self.ids = self._ids[:self.count]
+
+    def append(self, user_ids, embeddings):
+        user_ids = np.atleast_1d(np.asarray(user_ids, dtype=np.int64))
+        rows = normalize(embeddings).astype(DTYPE, copy=False)
+        if rows.shape != (len(user_ids), self.dimension):
+            raise ValueError(f"Expected {len(user_ids)} x {self.dimension} embeddings, got {rows.shape}")
+        with self.lock:
+            count = self.count + len(user_ids)
+            if count > len(self._ids):
+                # doubling keeps appending one user at a time amortised O(1)
+                capacity = max(count, 2 * len(self._ids))
+                self._matrix = np.concatenate([self._matrix[:self.count],
+                                               np.empty((capacity - self.count, self.dimension), dtype=DTYPE)])
+                self._ids = np.concatenate([self._ids[:self.count], np.empty(capacity - self.count, np.int64)])
+            self._matrix[self.count:count] = rows
+            self._ids[self.count:count] = user_ids
+            self.count = count
+            self.refresh()
+
+    def remove(self, user_ids):
+        with self.lock:
+            targets = np.flatnonzero(np.isin(self.ids, np.atleast_1d(user_ids)))
+            self._ids[targets] = TOMBSTONE
+        return len(targets)
+
+    def compact(self):
+        with self.lock:
+            keep = self.live()
+            rows, ids = self.matrix[keep].copy(), self.ids[keep].copy()
+            self.count = len(ids)
+            self._matrix[:self.count], self._ids[:self.count] = rows, ids
+            self.refresh()
+
+    def stats(self):
+        live = int(self.live().sum())
+        return {"rows": self.count, "live": live, "tombstones": self.count - live, "dimension": self.dimension,
+                "model": self.model, "bytes": self._matrix.nbytes + self._ids.nbytes}
+
+
+def voice_vectors(rows):
+    """Speaker vectors of (voice, voice_template, voice_stats) rows: the template's
+    centroid where there is one of this model, else the recording's embedding
+    (from the embedding cache, else computed in batches)."""
+    import embeddingCache
+    import voiceDetection
+    cache = embeddingCache.get_cache()
+    blobs = [row[0] for row in rows]
+    embeddings = [voiceDetection.template_vector(template, stats) for _, template, stats in rows]
+    keys = [embeddingCache.content_key(blob, voiceDetection.model_version()) for blob in blobs]
+    missing = {}  # key -> positions, so a recording stored twice is embedded once
+    for position, (key, embedding) in enumerate(zip(keys, embeddings)):
+        if embedding is None:
+            embeddings[position] = embedding = cache.get(key)
+        if embedding is None:
+            missing.setdefault(key, []).append(position)
+    pending = list(missing.values())
+    for index, embedding in voiceDetection.embed_many(blobs[positions[0]] for positions in pending):
+        embedding = cache.put(keys[pending[index][0]], embedding)
+        for position in pending[index]:
+            embeddings[position] = embedding
+    return np.array(embeddings, dtype=np.float32).reshape(len(blobs), -1)
+
+
+def face_vectors(rows):
+    """Random-projection feature vectors of (face,) rows."""
+    import faceTemplate
+    return np.array([faceTemplate.feature_vector(blob) for blob, in rows], dtype=np.float32)
+
+
+VECTORIZERS = {"voice": voice_vectors, "face": face_vectors}
+COLUMNS = {"voice": ("voice", "voice_template", "voice_stats"), "face": ("face",)}  # what each vectorizer reads
+
+
+def remove_gallery(path):
+    """Deletes a gallery's files (readers keep their mapping until they reopen)."""
+    for suffix in (".emb", ".ids"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path + suffix)
+
+
+def sync(db_path, kind, path=None, batch=64, full=True):
+    """Brings the gallery of one users column up to date with the table.
+
+    Users missing from the gallery are embedded and appended (in batches), and
+    rows of deleted users are tombstoned. Returns (added, removed).
+
+    With full=False only users newer than the newest row are appended (ids are
+    AUTOINCREMENT, so these are the users registered since), which costs an
+    index range scan instead of reading every id.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown gallery kind {kind!r}")
+    path = path or default_path(db_path, kind)
+    vectorize = VECTORIZERS[kind]
+    model = gallery_model(kind)
+    conn = sqlite3.connect(db_path)
+    store = EmbeddingStore(path) if os.path.exists(path + ".emb") else None
+    if store is not None and store.model != model:
+        # vectors of another model (or backend) aren't comparable with this one's: start over
+        remove_gallery(path)
+        store = None
+
+    if full or store is None or store.count == 0:
+        table_ids = np.array([row[0] for row in conn.execute(f"SELECT id FROM users WHERE {kind} IS NOT NULL")],
+                             dtype=np.int64)
+        known = store.live_ids() if store is not None else np.empty(0, dtype=np.int64)
+        removed = store.remove(np.setdiff1d(known, table_ids)) if store is not None else 0
+        missing = np.setdiff1d(table_ids, known)
+    else:
+        newest = int(np.max(store.ids))
+        missing = np.array([row[0] for row in conn.execute(
+            f"SELECT id FROM users WHERE id > ? AND {kind} IS NOT NULL", (newest,))], dtype=np.int64)
+        removed = 0
+
+    added = 0
+    for start in range(0, len(missing), batch):
+        chunk = [int(user_id) for user_id in missing[start:start + batch]]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT id, {', '.join(COLUMNS[kind])} FROM users WHERE id IN ({placeholders})",
+                            chunk).fetchall()
+        vectors = vectorize([row[1:] for row in rows])
+        if store is None:
+            store = EmbeddingStore(path, dimension=vectors.shape[1], model=model)
+        store.append([row[0] for row in rows], vectors)
+        added += len(rows)
+    conn.close()
+    return added, removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped embedding galleries of the users table.")
+    parser.add_argument("command", choices=["sync", "stats", "compact"])
+    parser.add_argument("--db", default="user_auth.db")
+    parser.add_argument("--shards", type=int, default=userStore.SHARDS, help="user store shard count")
+    parser.add_argument("--kind", choices=KINDS + ("all",), default="all")
+    args = parser.parse_args()
+
+    # one gallery per database file of the store (each shard when it is sharded)
+    for db_path in [partition.path for partition in userStore.open_store(args.db, args.shards, "sqlite").partitions()]:
+        for kind in KINDS if args.kind == "all" else (args.kind,):
+            path = default_path(db_path, kind)
+            if args.command == "sync":
+                added, removed = sync(db_path, kind, path)
+                print(f"{path}: {added} added, {removed} removed")
+            elif not os.path.exists(path + ".emb"):
+                print(f"{path}: no gallery at {path}.emb (run sync first)")
+            elif args.command == "compact":
+                EmbeddingStore(path).compact()
+                print(f"{path}: compacted, {EmbeddingStore(path).stats()}")
+            else:
+                print(f"{path}: {EmbeddingStore(path).stats()}")
+
+
+if __name__ == "__main__":
+    main()
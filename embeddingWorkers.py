@@ -0,0 +1,367 @@
+# File: embeddingWorkers.py
+# Description: Pool of speaker-embedding worker processes behind a local socket.
+# Each worker holds a warm copy of the model and its own torch thread pool, so
+# inference no longer competes with the GUI and OpenCV for the GIL. Requests
+# from all clients go through one queue; every worker takes up to max_batch
+# requests that arrive within batch_window_ms of each other and embeds them
+# together.
+#
+#   python embeddingWorkers.py --workers 2 --threads 1 --port 8765
+# then set VOICE_EMBEDDING_SERVER=127.0.0.1:8765 (and VOICE_EMBEDDING_AUTHKEY to the
+# key it prints) and voiceDetection.embed() sends its audio to the pool instead of
+# running the model in-process.
+#
+# Connections unpickle what they receive, so the pool and its clients share a
+# secret key: VOICE_EMBEDDING_AUTHKEY, or a random one the server prints at
+# start. Without a configured key the server only listens on loopback.
+#
+# A worker that dies, or takes longer than WORKER_TIMEOUT over a batch, is
+# restarted; the requests of that batch get an error reply. Clients give up on
+# a reply after CLIENT_TIMEOUT and reconnect on their next call.
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import queue
+import secrets
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+AUTHKEY_ENV = "VOICE_EMBEDDING_AUTHKEY"
+DEFAULT_PORT = 8765
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+WORKER_TIMEOUT = float(os.getenv("VOICE_EMBEDDING_WORKER_TIMEOUT", "60"))  # seconds per batch
+CLIENT_TIMEOUT = float(os.getenv("VOICE_EMBEDDING_TIMEOUT", "120"))  # seconds per request
+
+
+def configured_authkey():
+    """The key from VOICE_EMBEDDING_AUTHKEY, or None."""
+    key = os.getenv(AUTHKEY_ENV)
+    return key.encode("utf-8") if key else None
+
+
+def _worker_main(conn, model_mode, intra_threads):
+    """Worker process: load the model once, then embed batches until told to stop."""
+    import torch
+    torch.set_num_threads(intra_threads)
+    import voiceDetection
+    voiceDetection.EMBEDDING_SERVER = None  # this process is the server
+
+    if model_mode == "untrained":
+        voiceDetection.install_untrained_model()
+    else:
+        voiceDetection.get_model()
+    try:
+        conn.send(("ready", os.getpid()))
+    except OSError:
+        return  # the server went away while the model loaded
+
+    while True:
+        try:
+            batch = conn.recv()
+        except (EOFError, OSError):
+            break  # the server is gone (or restarted this worker)
+        if batch is None:
+            break
+        results = []
+        try:
+            embeddings = embed_batch(voiceDetection, [payload for _, payload in batch])
+            for (request_id, _), embedding in zip(batch, embeddings):
+                results.append(("ok", request_id, embedding))
+        except Exception as e:
+            results = [("error", request_id, str(e)) for request_id, _ in batch]
+        try:
+            conn.send(results)
+        except OSError:
+            break  # timed out and replaced while embedding
+    conn.close()
+
+
+def embed_batch(voiceDetection, payloads):
+    """Embeds several recordings in padded, length-bucketed batches, in request order."""
+    embeddings = [None] * len(payloads)
+    for index, embedding in voiceDetection.embed_many(payloads, batch_size=len(payloads), lookahead=1):
+        embeddings[index] = embedding
+    return embeddings
+
+
+class EmbeddingServer:
+    """Owns the worker processes and serves embedding requests over a local socket."""
+
+    def __init__(self, host="127.0.0.1", port=0, workers=2, intra_threads=1, max_batch=8,
+                 batch_window_ms=5.0, model="pretrained", authkey=None):
+        self.workers = workers
+        self.intra_threads = intra_threads
+        self.max_batch = max_batch
+        self.batch_window = batch_window_ms / 1000.0
+        self.model = model
+        authkey = authkey or configured_authkey()
+        if authkey is None:
+            if host not in LOOPBACK_HOSTS:
+                raise ValueError(f"Listening on {host} needs a key: set {AUTHKEY_ENV}")
+            authkey = secrets.token_hex(32).encode("utf-8")  # handed to clients as self.authkey
+        self.authkey = authkey
+        self.requests = queue.Queue()
+        self.listener = Listener((host, port), authkey=authkey)
+        self.processes = []
+        self.running = False
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "errors": 0, "restarts": 0}
+        self.context = multiprocessing.get_context("spawn")  # torch and fork don't mix
+
+    @property
+    def address(self):
+        return self.listener.address
+
+    def start(self):
+        for _ in range(self.workers):
+            self.processes.append(self._spawn_worker())
+
+        self.running = True
+        for slot in range(len(self.processes)):
+            threading.Thread(target=self._feed_worker, args=(slot,), daemon=True).start()
+        threading.Thread(target=self._accept_clients, daemon=True).start()
+        return self
+
+    def _spawn_worker(self):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=_worker_main, args=(child_conn, self.model, self.intra_threads),
+                                       daemon=True)
+        process.start()
+        child_conn.close()
+        # wait until the model is loaded (as long as that takes, unless the process dies)
+        if not _wait_for_reply(process, parent_conn, timeout=None):
+            process.join(timeout=5)
+            raise RuntimeError(f"Embedding worker exited while loading the model (exit code {process.exitcode})")
+        parent_conn.recv()
+        return process, parent_conn
+
+    def _restart_worker(self, slot):
+        process, conn = self.processes[slot]
+        if process.is_alive():
+            process.terminate()
+        process.join(timeout=5)
+        conn.close()
+        with self.stats_lock:
+            self.stats["restarts"] += 1
+        while self.running:
+            try:
+                self.processes[slot] = self._spawn_worker()
+                return
+            except (RuntimeError, OSError, EOFError) as e:
+                print(f"Embedding pool: could not restart worker {slot}: {e}")
+                time.sleep(1.0)
+
+    def _accept_clients(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                if not self.running:
+                    break
+                continue  # failed handshake (wrong authkey)
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def _serve_client(self, conn):
+        send_lock = threading.Lock()
+
+        def reply(message):
+            with send_lock:
+                try:
+                    conn.send(message)
+                except OSError:
+                    pass  # client went away
+
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == "embed":
+                    _, request_id, payload = message
+                    self.requests.put((reply, request_id, payload))
+                elif message[0] == "stats":
+                    with self.stats_lock:
+                        reply(("stats", message[1], dict(self.stats, workers=self.workers,
+                                                         intra_threads=self.intra_threads)))
+        except (EOFError, OSError):
+            conn.close()
+
+    def _next_batch(self):
+        first = self.requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.requests.put(None)  # let the other feeders see the stop signal
+                break
+            batch.append(item)
+        return batch
+
+    def _feed_worker(self, slot):
+        while self.running:
+            batch = self._next_batch()
+            if batch is None:
+                self.requests.put(None)
+                break
+            process, conn = self.processes[slot]
+            results, error = None, None
+            try:
+                conn.send([(index, payload) for index, (_, _, payload) in enumerate(batch)])
+                if _wait_for_reply(process, conn, WORKER_TIMEOUT):
+                    results = conn.recv()
+                else:
+                    error = (f"worker timed out after {WORKER_TIMEOUT:g} s" if process.is_alive()
+                             else "worker died")
+            except (OSError, EOFError):
+                error = "worker died"
+            if error is not None:
+                # fail this batch, not every later one
+                results = [("error", index, error) for index in range(len(batch))]
+                self._restart_worker(slot)
+            with self.stats_lock:
+                self.stats["requests"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["errors"] += sum(1 for result in results if result[0] == "error")
+            for (reply, request_id, _), (status, _, value) in zip(batch, results):
+                reply((status, request_id, value))
+
+    def stop(self):
+        self.running = False
+        self.requests.put(None)
+        for process, conn in self.processes:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process, _ in self.processes:
+            process.join(timeout=5)
+        self.listener.close()
+
+
+def _wait_for_reply(process, conn, timeout):
+    """True once conn has something to read; False if the process died or timeout (seconds) passed."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        if conn.poll(0.5 if deadline is None else max(0.0, min(0.5, deadline - time.monotonic()))):
+            return True
+        if not process.is_alive():
+            return conn.poll(0)
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+
+
+class EmbeddingClient:
+    """Connection to an EmbeddingServer; embed() can be called from several threads."""
+
+    def __init__(self, address, authkey=None, timeout=CLIENT_TIMEOUT):
+        authkey = authkey or configured_authkey()
+        if authkey is None:
+            raise ValueError(f"Set {AUTHKEY_ENV} to the embedding pool's key")
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self.conn = Client(address, authkey=authkey)
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+
+    def _call(self, message):
+        # one request in flight per connection; open several clients for parallelism
+        with self.lock:
+            if self.conn is None:
+                self.conn = Client(self.address, authkey=self.authkey)
+            try:
+                self.conn.send(message)
+                if not self.conn.poll(self.timeout):
+                    raise TimeoutError(f"No reply from the embedding pool within {self.timeout:g} s")
+                return self.conn.recv()
+            except (OSError, EOFError) as e:
+                # a late reply would answer the next request: that one starts on a new connection
+                self.conn.close()
+                self.conn = None
+                if isinstance(e, EOFError):
+                    raise ConnectionError("The embedding pool closed the connection") from e
+                raise
+
+    def embed(self, audio):
+        """Embedding of a recording (wav bytes or a 16 kHz sample array)."""
+        if isinstance(audio, (bytearray, memoryview)):
+            audio = bytes(audio)
+        elif isinstance(audio, str):
+            with open(audio, "rb") as file:
+                audio = file.read()
+        status, _, value = self._call(("embed", next(self.ids), audio))
+        if status != "ok":
+            raise RuntimeError(f"Embedding worker failed: {value}")
+        return value
+
+    def stats(self):
+        return self._call(("stats", next(self.ids)))[2]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(address):
+    """Shared client for voiceDetection (one connection per process)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = EmbeddingClient(parse_address(address))
+    return _client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speaker embedding worker pool.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=2, help="worker processes, each with a warm model")
+    parser.add_argument("--threads", type=int, default=1, help="torch intra-op threads per worker")
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--batch-window-ms", type=float, default=5.0)
+    parser.add_argument("--model", choices=["pretrained", "untrained"], default="pretrained")
+    args = parser.parse_args()
+
+    try:
+        server = EmbeddingServer(args.host, args.port, args.workers, args.threads, args.max_batch,
+                                 args.batch_window_ms, args.model)
+    except ValueError as e:
+        parser.error(str(e))
+    server.start()
+    print(f"Embedding pool listening on {args.host}:{server.address[1]} "
+          f"({args.workers} workers x {args.threads} threads)")
+    print(f"Set VOICE_EMBEDDING_SERVER={args.host}:{server.address[1]}", end="")
+    if configured_authkey() is None:
+        print(f" and {AUTHKEY_ENV}={server.authkey.decode()}", end="")
+    print(". Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
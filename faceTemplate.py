@@ -0,0 +1,270 @@
+# File: faceTemplate.py
+# Description: Storage format for the face templates in users.face.
+# Old rows hold the bare tobytes() of a 100x100 uint8 crop, so shape and dtype
+# are implied. Templates written here start with a small header instead:
+#
+#   magic "FTPL", version, kind (image / projection), dtype, compression
+#   (none / zlib / png), projection seed, then the shape
+#
+# decode() returns uncompressed templates as read-only np.frombuffer views of
+# the BLOB (no copy) and still reads the legacy headerless crops.
+# `python faceTemplate.py --db user_auth.db` migrates existing rows.
+
+import argparse
+import functools
+import os
+import sqlite3
+import struct
+import zlib
+
+import numpy as np
+
+import userStore
+
+MAGIC = b"FTPL"
+VERSION = 1
+# magic, version, kind, dtype, compression, ndim, projection seed; the shape follows
+HEADER = struct.Struct("<4sBBBBBxxxI")
+
+KIND_IMAGE = 0
+KIND_PROJECTION = 1
+
+DTYPES = {0: np.dtype(np.uint8), 1: np.dtype("<f4"), 2: np.dtype("<f2")}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+COMPRESSIONS = ("none", "zlib", "png")
+
+# how newly captured faces are stored: an image with one of COMPRESSIONS, or
+# "projection" to keep only the feature vector
+MODES = COMPRESSIONS + ("projection",)
+DEFAULT_MODE = os.getenv("FACE_TEMPLATE_STORAGE", "zlib")
+
+# size of legacy templates, which have no header
+LEGACY_SHAPE = (100, 100)
+
+# random projection: pixels -> PROJECTION_DIMS floats; squared distances are
+# kept in expectation (Johnson-Lindenstrauss), +/- about sqrt(2 / dims)
+PROJECTION_DIMS = 128
+PROJECTION_SEED = 1234
+FEATURE_SHAPE = (100, 100)  # images are resized to this before feature_vector projects them
+
+# mean squared pixel difference (as floats) under which a capture matches a stored
+# face, for image and projection templates alike; 1250 is the equal error rate on
+# the bench fixtures (about 9% false rejects and accepts). Used by the login
+# (authentication.FACE_THRESHOLD), the duplicate check and the audit
+MATCH_THRESHOLD = float(os.getenv("FACE_THRESHOLD", "1250"))
+
+
+def is_template(blob):
+    return bytes(blob[:4]) == MAGIC
+
+
+def _header(kind, dtype, shape, compression, seed=0):
+    header = HEADER.pack(MAGIC, VERSION, kind, DTYPE_CODES[np.dtype(dtype)], COMPRESSIONS.index(compression),
+                         len(shape), seed)
+    header += struct.pack(f"<{len(shape)}I", *shape)
+    # pad so the payload of an uncompressed float template is 8-byte aligned
+    return header + b"\0" * (-len(header) % 8)
+
+
+def encode(face, compression="zlib"):
+    """Encodes a grayscale face crop (2-D uint8 array) for storage."""
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown face template compression {compression!r} "
+                         f"(choose from {', '.join(COMPRESSIONS)})")
+    face = np.ascontiguousarray(face, dtype=np.uint8)
+    if face.ndim != 2:
+        raise ValueError(f"A face template is a 2-D grayscale image (got shape {face.shape})")
+    if compression == "zlib":
+        payload = zlib.compress(face.tobytes(), 6)
+    elif compression == "png":
+        import cv2
+        ok, png = cv2.imencode(".png", face)
+        if not ok:
+            raise ValueError("PNG encoding of the face template failed")
+        payload = png.tobytes()
+    else:
+        payload = face.tobytes()
+    return _header(KIND_IMAGE, face.dtype, face.shape, compression) + payload
+
+
+@functools.lru_cache(maxsize=4)
+def _projection_matrix(pixels, dims, seed):
+    generator = np.random.default_rng(seed)
+    matrix = generator.standard_normal((dims, pixels), dtype=np.float32) / np.float32(np.sqrt(dims))
+    matrix.setflags(write=False)
+    return matrix
+
+
+def project_face(face, dims=PROJECTION_DIMS, seed=PROJECTION_SEED):
+    """Random projection of a face crop's pixels to a dims-long float32 vector.
+
+    ||project_face(a) - project_face(b)||^2 estimates the summed squared pixel
+    difference of a and b (which must have the same size).
+    """
+    pixels = np.asarray(face, dtype=np.float32).reshape(-1)
+    return _projection_matrix(pixels.size, dims, seed) @ pixels
+
+
+def feature_vector(blob, dims=PROJECTION_DIMS, seed=PROJECTION_SEED):
+    """Projected feature vector of any stored face, for similarity search.
+
+    Image templates are resized to FEATURE_SHAPE and projected; projection
+    templates already are the vector.
+    """
+    header = read_header(blob)
+    stored = decode(blob)
+    if header["kind"] == "projection":
+        return stored
+    if stored.shape != FEATURE_SHAPE:
+        import cv2
+        stored = cv2.resize(stored, FEATURE_SHAPE[::-1])
+    return project_face(stored, dims, seed)
+
+
+def encode_projection(face, dims=PROJECTION_DIMS, seed=PROJECTION_SEED):
+    """Stores only the projected feature vector (dims * 4 bytes), not the image.
+
+    The header keeps the image shape, which a capture must be resized to before
+    it is projected with the same seed.
+    """
+    vector = project_face(face, dims, seed).astype("<f4")
+    return _header(KIND_PROJECTION, vector.dtype, np.shape(face), "none", seed) + vector.tobytes()
+
+
+def store(face, mode=DEFAULT_MODE):
+    """Encodes a captured face the way new rows are stored (see DEFAULT_MODE)."""
+    if mode == "projection":
+        return encode_projection(face)
+    return encode(face, mode)
+
+
+def stored_mode(blob):
+    """The mode a blob was written with ("legacy" for headerless crops)."""
+    header = read_header(blob)
+    return header["compression"] if header["kind"] == "image" else header["kind"]
+
+
+def read_header(blob):
+    """Header fields as a dict; legacy blobs report kind "legacy"."""
+    if not is_template(blob):
+        return {"kind": "legacy", "version": 0, "dtype": "uint8", "compression": "none", "shape": LEGACY_SHAPE,
+                "offset": 0, "bytes": len(blob)}
+    _, version, kind, dtype, compression, ndim, seed = HEADER.unpack_from(blob)
+    if version > VERSION:
+        raise ValueError(f"Face template version {version} is newer than this reader ({VERSION})")
+    shape = struct.unpack_from(f"<{ndim}I", blob, HEADER.size)
+    offset = HEADER.size + 4 * ndim
+    offset += -offset % 8
+    return {"kind": "projection" if kind == KIND_PROJECTION else "image", "version": version,
+            "dtype": DTYPES[dtype].name, "compression": COMPRESSIONS[compression], "seed": seed,
+            "shape": shape, "offset": offset, "bytes": len(blob)}
+
+
+def decode(blob):
+    """The stored array: an image, or for projections the feature vector (the
+    header's shape is then that of the projected image).
+
+    Uncompressed templates (and legacy rows) come back as read-only views of
+    `blob`, without copying.
+    """
+    header = read_header(blob)
+    if header["kind"] == "legacy":
+        if len(blob) != LEGACY_SHAPE[0] * LEGACY_SHAPE[1]:
+            raise ValueError(f"Stored face has {len(blob)} bytes, expected a {LEGACY_SHAPE} image")
+        return np.frombuffer(blob, dtype=np.uint8).reshape(LEGACY_SHAPE)
+
+    dtype = np.dtype(header["dtype"])
+    if header["kind"] == "projection":
+        return np.frombuffer(blob, dtype=dtype, offset=header["offset"])
+
+    shape = header["shape"]
+    if header["compression"] == "none":
+        return np.frombuffer(blob, dtype=dtype, count=int(np.prod(shape)), offset=header["offset"]).reshape(shape)
+    payload = memoryview(blob)[header["offset"]:]
+    if header["compression"] == "zlib":
+        return np.frombuffer(zlib.decompress(payload), dtype=dtype).reshape(shape)
+    import cv2
+    return cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_GRAYSCALE).reshape(shape)
+
+
+def distance(blob, face, size=LEGACY_SHAPE):
+    """Mean squared pixel difference between a stored face and a captured crop.
+
+    Images are compared at `size`; for projection templates the difference is
+    estimated from the feature vectors, on the same scale.
+    """
+    import cv2
+    header = read_header(blob)
+    stored = decode(blob)
+    if header["kind"] == "projection":
+        height, width = header["shape"]
+        projected = project_face(cv2.resize(face, (width, height)), stored.size, header["seed"])
+        return float(np.sum((stored - projected) ** 2)) / (height * width)
+
+    # float32 before subtracting: uint8 differences wrap around and never exceed 255
+    face = cv2.resize(face, size).astype(np.float32)
+    stored = cv2.resize(stored, size).astype(np.float32)
+    return float(np.mean((stored - face) ** 2))
+
+
+def migrate(db_path, mode=DEFAULT_MODE, batch=500, vacuum=True):
+    """Re-encodes every users.face blob not yet stored in `mode`. Returns size statistics.
+
+    Projection templates are left alone (the image they came from is gone).
+    """
+    conn = sqlite3.connect(db_path)
+    stats = {"rows": 0, "converted": 0, "face_bytes_before": 0, "face_bytes_after": 0,
+             "file_bytes_before": os.path.getsize(db_path)}
+    last = 0
+    while True:
+        # a page at a time by rowid, so only `batch` templates are in memory
+        rows = conn.execute("SELECT rowid, face FROM users WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                            (last, batch)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for rowid, face in rows:
+            last = rowid
+            if face is None:
+                continue
+            stats["rows"] += 1
+            stats["face_bytes_before"] += len(face)
+            if stored_mode(face) in (mode, "projection"):
+                stats["face_bytes_after"] += len(face)
+                continue
+            encoded = store(decode(face), mode)
+            stats["face_bytes_after"] += len(encoded)
+            updates.append((encoded, rowid))
+        conn.executemany("UPDATE users SET face = ? WHERE rowid = ?", updates)
+        conn.commit()
+        stats["converted"] += len(updates)
+    if vacuum:
+        conn.execute("VACUUM")  # give the freed pages back to the file system
+    conn.close()
+    stats["file_bytes_after"] = os.path.getsize(db_path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encode the stored face templates.")
+    parser.add_argument("--db", default="user_auth.db")
+    parser.add_argument("--shards", type=int, default=userStore.SHARDS, help="user store shard count")
+    parser.add_argument("--mode", choices=MODES, default=DEFAULT_MODE,
+                        help="image compression, or projection (keeps only the feature vector; not reversible)")
+    parser.add_argument("--no-vacuum", action="store_true", help="don't compact the database file afterwards")
+    args = parser.parse_args()
+
+    # every database file of the store (each shard when it is sharded)
+    stats = {}
+    for partition in userStore.open_store(args.db, args.shards, "sqlite").partitions():
+        for key, value in migrate(partition.path, args.mode, vacuum=not args.no_vacuum).items():
+            stats[key] = stats.get(key, 0) + value
+    before, after = stats["face_bytes_before"], stats["face_bytes_after"]
+    print(f"{stats['converted']} of {stats['rows']} face templates re-encoded ({args.mode})")
+    if before:
+        print(f"face column: {before / 1024:.1f} KB -> {after / 1024:.1f} KB ({100 * (after / before - 1):+.1f}%)")
+    print(f"database file: {stats['file_bytes_before'] / 1024:.1f} KB -> {stats['file_bytes_after'] / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
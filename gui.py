@@ -1,20 +1,36 @@
 import sys
+import startupProfile
+
+# --profile-startup reports per-import and per-phase timings once the window is painted
+if "--profile-startup" in sys.argv:
+    startupProfile.enable()
+
 import os
 import io
 import threading
 import time
 import wave
-import pyaudio
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QLabel,
                              QVBoxLayout, QHBoxLayout, QWidget, QLineEdit,
                              QStackedWidget, QMessageBox, QDialog, QProgressBar,
-                             QInputDialog, QFrame, QSpacerItem, QSizePolicy, QStyle)
+                             QInputDialog, QFrame, QSpacerItem, QSizePolicy, QStyle, QCheckBox)
 from PyQt5.QtGui import QPixmap, QImage, QFont, QIcon, QColor, QPalette, QBrush, QLinearGradient, QPainter, QPen, QPainterPath
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QThread, QSize, QRectF, QPointF
-import cv2
 import numpy as np
 import authentication
 import voiceDetection
+import faceTemplate
+import duplicateCheck
+import twoFactor
+import metrics
+import auditLog
+import rateLimiter
+import sessionStore
+
+# OpenCV (cv2) and pyaudio are imported where the camera or microphone is used,
+# and voiceDetection loads torch/pyannote only when a voice is compared
+
+startupProfile.mark("imports")
 
 
 # Redirect stderr to suppress OpenCV warnings
@@ -249,6 +265,25 @@ class VoiceRecordingThread(QThread):
         self.finished.emit(audio_data)
 
 
+class BackgroundTask(QThread):
+    """Runs a blocking call (e.g. a Twilio request) off the UI thread."""
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+    def __init__(self, func, *args):
+        super().__init__()
+        self.func = func
+        self.args = args
+
+    def run(self):
+        try:
+            result = self.func(*self.args)
+        except Exception as e:
+            self.failed.emit(e)
+        else:
+            self.succeeded.emit(result)
+
+
 class WebcamCaptureThread(QThread):
     update_frame = pyqtSignal(np.ndarray)
     face_captured = pyqtSignal(np.ndarray)
@@ -256,24 +291,29 @@ class WebcamCaptureThread(QThread):
     def __init__(self):
         super().__init__()
         self.running = True
-        self.face_cascade = cv2.CascadeClassifier(authentication.CASCADE_PATH)
+        self.face_cascade = authentication.load_face_cascade()
         # Store original stderr
         self.original_stderr = None
         self.null_device = None
 
     def run(self):
+        import cv2
+
         # Suppress OpenCV warnings before camera initialization
         self.original_stderr = sys.stderr
         self.null_device = open(os.devnull, 'w')
         sys.stderr = self.null_device
 
         # Initialize camera
-        cap = cv2.VideoCapture(0)
+        with metrics.span("face.camera_open"):
+            cap = cv2.VideoCapture(0)
         while self.running:
             ret, frame = cap.read()
             if ret:
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(50, 50))
+                with metrics.span("face.detection"):
+                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5,
+                                                               minSize=(50, 50))
 
                 # Draw rectangle around detected faces
                 for (x, y, w, h) in faces:
@@ -294,7 +334,8 @@ class WebcamCaptureThread(QThread):
 
     def capture_face(self):
         if hasattr(self, 'last_face'):
-            resized_face = cv2.resize(self.last_face, (100, 100))
+            import cv2
+            resized_face = cv2.resize(self.last_face, authentication.FACE_SIZE)
             self.face_captured.emit(resized_face)
             return True
         return False
@@ -488,6 +529,7 @@ class VoiceRecordingDialog(QDialog):
         self.stop_button.clicked.connect(self.stop_recording)
 
         # Audio recording setup
+        import pyaudio
         self.chunk = 1024
         self.format = pyaudio.paInt16
         self.channels = 1
@@ -585,7 +627,7 @@ class VoiceRecordingDialog(QDialog):
 
 
 class VerifyCodeDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, prompt="Enter 2FA code sent to your phone:"):
         super().__init__(parent)
         self.setWindowTitle("2FA Verification")
         self.setFixedSize(400, 220)  # Increased width to prevent text cutoff
@@ -601,7 +643,7 @@ class VerifyCodeDialog(QDialog):
         layout.addWidget(title_label)
 
         # Instructions with proper width
-        self.instruction_label = QLabel("Enter 2FA code sent to your phone:")
+        self.instruction_label = QLabel(prompt)
         self.instruction_label.setAlignment(Qt.AlignCenter)
         self.instruction_label.setFont(QFont("Arial", 12))
         self.instruction_label.setWordWrap(True)  # Enable word wrapping
@@ -682,6 +724,9 @@ class AuthenticationApp(QMainWindow):
         # Show the welcome screen initially
         self.stacked_widget.setCurrentIndex(0)
 
+        # Background calls still running (kept referenced until they finish)
+        self.background_tasks = set()
+
         # Initialize database
         authentication.initialize_database()
 
@@ -911,6 +956,11 @@ class AuthenticationApp(QMainWindow):
         phone_layout.addWidget(self.phone_input)
         form_layout.addLayout(phone_layout)
 
+        # Second factor choice (SMS through Twilio by default)
+        self.totp_checkbox = QCheckBox("Use an authenticator app instead of SMS codes")
+        self.totp_checkbox.setStyleSheet("color: #475569;")
+        form_layout.addWidget(self.totp_checkbox)
+
         content_layout.addLayout(form_layout)
 
         # Biometric data section
@@ -1002,7 +1052,7 @@ class AuthenticationApp(QMainWindow):
 
         # Initialize storage for biometric data
         self.face_data = None
-        self.voice_data = None
+        self.voice_samples = []  # VOICE_ENROLL_SAMPLES recordings make up the voice template
 
     def create_login_screen(self):
         login_widget = QWidget()
@@ -1204,15 +1254,9 @@ class AuthenticationApp(QMainWindow):
         login_widget.setLayout(main_layout)
         self.stacked_widget.addWidget(login_widget)
 
-        # Authentication state
-        self.auth_state = {
-            "password": False,
-            "voice": False,
-            "face": False,
-            "2fa": False,
-            "username": "",
-            "phone": ""
-        }
+        # Authentication state: the session of the login in progress, started at the password step
+        self.sessions = sessionStore.get_store()
+        self.session_id = None
 
     def capture_face(self):
         dialog = FaceDialog(self)
@@ -1235,7 +1279,10 @@ class AuthenticationApp(QMainWindow):
 
     def set_voice_data(self, voice_data):
         """Stores and updates UI after voice recording."""
-        self.voice_data = voice_data
+        if len(self.voice_samples) >= voiceDetection.VOICE_ENROLL_SAMPLES:
+            # recording again after all samples were taken starts over
+            self.voice_samples = []
+        self.voice_samples.append(voice_data)
         self.update_voice_status(True)
 
     def register_user(self):
@@ -1266,46 +1313,87 @@ class AuthenticationApp(QMainWindow):
             self.show_error_message("Missing Data", "Please capture your face image.")
             return
 
-        if self.voice_data is None:
-            self.show_error_message("Missing Data", "Please record your voice.")
+        missing = voiceDetection.VOICE_ENROLL_SAMPLES - len(self.voice_samples)
+        if missing > 0:
+            self.show_error_message("Missing Data", "Please record your voice." if not self.voice_samples else
+                                    f"Please record your voice {missing} more time{'s' if missing > 1 else ''}.")
             return
 
         # Check if username already exists
-        conn = authentication.sqlite3.connect(authentication.DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-        if cursor.fetchone() is not None:
+        store = authentication.get_store()
+        with metrics.span("db.user_lookup"):
+            existing = store.exists(username)
+        if existing:
             self.show_error_message("Registration Error", f"Username '{username}' already exists.")
-            conn.close()
             return
 
         # Process registration
         try:
             # Hash password
-            salt = authentication.bcrypt.gensalt()
-            hashed_pass = authentication.bcrypt.hashpw(password.encode('utf-8'), salt)
+            with metrics.span("password.bcrypt_hash"):
+                salt = authentication.bcrypt.gensalt()
+                hashed_pass = authentication.bcrypt.hashpw(password.encode('utf-8'), salt)
 
             # Prepare face data
-            face_data_bytes = np.array(self.face_data).tobytes()
+            face_data_bytes = faceTemplate.store(self.face_data)
 
             # Format phone number
             phone_number = "+1" + phone
 
-            # Insert into database
-            cursor.execute("INSERT INTO users (username, password, voice, face, phone) VALUES (?, ?, ?, ?, ?)",
-                           (username, hashed_pass, self.voice_data, face_data_bytes, phone_number))
-            conn.commit()
+            # Second factor provider and its secret (only TOTP needs one)
+            if self.totp_checkbox.isChecked():
+                otp_provider = twoFactor.PROVIDER_TOTP
+            else:
+                otp_provider = twoFactor.PROVIDER_TWILIO
+            totp_secret = twoFactor.get_provider(otp_provider).enroll(username)
+
+            # Average the recordings into the voice template, embedded in one batch; the most
+            # typical recording is kept too
+            voice_template, voice_stats, typical = voiceDetection.build_template(self.voice_samples)
+            voice_data = self.voice_samples[typical]
+
+            # Look for this voice or face among the enrolled users
+            vectors = {}
+            if duplicateCheck.DUPLICATE_CHECK != "off":
+                duplicates, _, vectors = duplicateCheck.find_duplicates(
+                    store, voice_data, face_data_bytes,
+                    voice_embedding=voiceDetection.template_vector(voice_template, voice_stats))
+                if duplicates:
+                    details = "\n".join(duplicateCheck.describe(duplicates))
+                    if duplicateCheck.DUPLICATE_CHECK == "block":
+                        self.show_error_message("Registration Error",
+                                                f"This voice or face is already enrolled:\n{details}")
+                        return
+                    answer = QMessageBox.question(self, "Possible Duplicate",
+                                                  f"This voice or face looks already enrolled:\n{details}"
+                                                  "\n\nRegister anyway?",
+                                                  QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+                    if answer != QMessageBox.Yes:
+                        return
 
-            self.show_success_message("Registration Successful",
-                                      f"User '{username}' has been registered successfully.")
+            # Insert into database
+            with metrics.span("db.insert"):
+                user_id = store.create_user({"username": username, "password": hashed_pass,
+                                             "voice": voice_data, "face": face_data_bytes,
+                                             "phone": phone_number, "otp_provider": otp_provider,
+                                             "totp_secret": totp_secret, "voice_template": voice_template,
+                                             "voice_stats": voice_stats})
+            duplicateCheck.record_enrollment(store, user_id, vectors)
+
+            message = f"User '{username}' has been registered successfully."
+            if totp_secret:
+                message += (f"\n\nAdd this secret to your authenticator app:\n{totp_secret}"
+                            f"\n\n{twoFactor.provisioning_uri(totp_secret, username)}")
+            self.show_success_message("Registration Successful", message)
 
             # Reset form
             self.username_input.clear()
             self.password_input.clear()
             self.confirm_input.clear()
             self.phone_input.clear()
+            self.totp_checkbox.setChecked(False)
             self.face_data = None
-            self.voice_data = None
+            self.voice_samples = []
             self.update_face_status(False)
             self.update_voice_status(False)
 
@@ -1314,8 +1402,6 @@ class AuthenticationApp(QMainWindow):
 
         except Exception as e:
             self.show_error_message("Registration Error", f"An error occurred: {str(e)}")
-        finally:
-            conn.close()
 
     def authenticate_password(self):
         """First authentication step: password verification."""
@@ -1325,20 +1411,31 @@ class AuthenticationApp(QMainWindow):
             self.show_error_message("Authentication Error", "Please enter a username.")
             return
 
+        # Refuse repeated attempts before any expensive factor runs
+        allowed, retry_after = rateLimiter.check(username)
+        if not allowed:
+            auditLog.record("login", username, ok=False, attempt=auditLog.attempt(), detail="rate limited")
+            self.update_auth_status("Too many attempts", False)
+            self.show_error_message("Authentication Error", rateLimiter.describe(retry_after))
+            return
+
         # Check if user exists
-        conn = authentication.sqlite3.connect(authentication.DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT password, phone FROM users WHERE username = ?", (username,))
-        user_data = cursor.fetchone()
-        conn.close()
+        with metrics.span("db.user_lookup"):
+            user_data = authentication.get_store().get_user(username, ("password", "phone", "otp_provider",
+                                                                       "totp_secret"))
 
         if user_data is None:
+            auditLog.record("login", username, ok=False, attempt=auditLog.attempt(), detail="unknown user")
             self.show_error_message("Authentication Error", "User not found.")
             return
 
-        # Store username and phone for later steps
-        self.auth_state["username"] = username
-        self.auth_state["phone"] = user_data[1]
+        # Start a session holding username and phone for later steps (replacing any earlier one);
+        # the attempt id groups this login's audit entries
+        self.sessions.discard(self.session_id)
+        session = self.sessions.create(attempt=auditLog.attempt(), username=username, phone=user_data["phone"],
+                                       otp_provider=user_data["otp_provider"],
+                                       totp_secret=user_data["totp_secret"])
+        self.session_id = session.id
 
         # Password dialog
         password, ok = QInputDialog.getText(self, "Password Authentication",
@@ -1347,9 +1444,15 @@ class AuthenticationApp(QMainWindow):
             return
 
         # Verify password
-        stored_password = user_data[0]
-        if authentication.bcrypt.checkpw(password.encode('utf-8'), stored_password):
-            self.auth_state["password"] = True
+        stored_password = user_data["password"]
+        start = time.perf_counter()
+        with metrics.span("password.bcrypt_check"):
+            password_matched = authentication.bcrypt.checkpw(password.encode('utf-8'), stored_password)
+        auditLog.record("password", username, ok=password_matched, ms=(time.perf_counter() - start) * 1000,
+                        attempt=session.attempt)
+        if password_matched:
+            session.password = True
+            self.sessions.touch(session.id)  # each factor passed restarts the TTL for the next one
             self.auth_progress.setValue(1)
             self.update_auth_status("Password authentication successful", True)
             self.voice_auth_btn.setEnabled(True)
@@ -1372,66 +1475,53 @@ class AuthenticationApp(QMainWindow):
             self.update_auth_status("Incorrect password", False)
             self.show_error_message("Authentication Error", "Incorrect password.")
 
+    def login_session(self):
+        """The session of the login in progress; if it has expired, says so and starts over."""
+        session = self.sessions.get(self.session_id)
+        if session is None:
+            self.show_error_message("Authentication Error", "Your login session has expired. Please start again.")
+            self.reset_login()
+        return session
+
     def authenticate_voice(self):
         """Second authentication step: voice verification."""
-        # Get stored voice data
-        conn = authentication.sqlite3.connect(authentication.DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT voice FROM users WHERE username = ?", (self.auth_state["username"],))
-        stored_voice = cursor.fetchone()[0]
-        conn.close()
-
-        # Save the stored voice to a temporary file for comparison
-        with open("temp_stored_voice.wav", "wb") as file:
-            file.write(stored_voice)
+        if self.login_session() is None:
+            return
 
         # Update status
         self.update_auth_status("Voice authentication in progress...", warning=True)
 
         # Open voice recording dialog
         dialog = VoiceRecordingDialog(self)
-        dialog.recording_finished.connect(lambda x: self.process_voice_auth(x, stored_voice))
+        dialog.recording_finished.connect(self.process_voice_auth)
         result = dialog.exec_()
 
-    def process_voice_auth(self, recorded_voice, stored_voice):
+    def process_voice_auth(self, recorded_voice):
         """Process the voice authentication result."""
-        # Save the new recording for authentication
-        with open("authenticateVoice.wav", "wb") as file:
-            file.write(recorded_voice)
+        session = self.login_session()
+        if session is None:
+            return
 
         # Manually perform voice comparison using the pyannote model
         try:
-            model = authentication.voiceDetection.Model.from_pretrained(
-                "pyannote/wespeaker-voxceleb-resnet34-LM",
-                use_auth_token=""
-            )
-            inference = authentication.voiceDetection.Inference(model, window="whole")
-
-            # Get embeddings
-            embedding1 = inference("authenticateVoice.wav")
-
-            # Save stored voice to a temporary file
-            with open("temp_stored_voice.wav", "wb") as file:
-                file.write(stored_voice)
-
-            embedding2 = inference("temp_stored_voice.wav")
-
-            # Reshape for distance calculation
-            embedding1 = np.array(embedding1).reshape(1, -1)
-            embedding2 = np.array(embedding2).reshape(1, -1)
-
-            # Calculate distance
-            distance = authentication.voiceDetection.cdist(embedding1, embedding2, metric="cosine")[0, 0]
-
-            # Clean up temporary files
-            if os.path.exists("authenticateVoice.wav"):
-                os.remove("authenticateVoice.wav")
-            if os.path.exists("temp_stored_voice.wav"):
-                os.remove("temp_stored_voice.wav")
+            # Get stored voice data only now, so it isn't held while recording
+            with metrics.span("db.user_lookup"):
+                stored = authentication.get_store().get_user(session.username,
+                                                             ("voice", "voice_template", "voice_stats"))
+
+            # Embed the recording and compare it with the voice template, or with the stored
+            # recording for users enrolled without one (the model is loaded on the first voice
+            # check and reused afterwards)
+            start = time.perf_counter()
+            distance = voiceDetection.voice_distance(recorded_voice, stored["voice"], stored["voice_template"],
+                                                     stored["voice_stats"])
+            auditLog.record("voice", session.username, ok=distance <= voiceDetection.VOICE_THRESHOLD,
+                            score=distance, ms=(time.perf_counter() - start) * 1000, attempt=session.attempt)
 
             # Check threshold
-            if distance <= 0.40:
-                self.auth_state["voice"] = True
+            if distance <= voiceDetection.VOICE_THRESHOLD:
+                session.voice = True
+                self.sessions.touch(session.id)
                 self.auth_progress.setValue(2)
                 self.update_auth_status("Voice authentication successful", True)
                 self.face_auth_btn.setEnabled(True)
@@ -1456,21 +1546,19 @@ class AuthenticationApp(QMainWindow):
                                         f"Voice authentication failed. Distance: {distance:.2f}")
 
         except Exception as e:
+            auditLog.record("voice", session.username, ok=False, attempt=session.attempt, detail=f"error: {e}")
             self.update_auth_status("Voice authentication error", False)
             self.show_error_message("Authentication Error", f"Error during voice authentication: {str(e)}")
-            # Clean up any temporary files
-            for file in ["authenticateVoice.wav", "temp_stored_voice.wav"]:
-                if os.path.exists(file):
-                    os.remove(file)
 
     def authenticate_face(self):
         """Third authentication step: face verification."""
+        session = self.login_session()
+        if session is None:
+            return
+
         # Get stored face data
-        conn = authentication.sqlite3.connect(authentication.DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT face FROM users WHERE username = ?", (self.auth_state["username"],))
-        stored_face = cursor.fetchone()[0]
-        conn.close()
+        with metrics.span("db.user_lookup"):
+            stored_face = authentication.get_store().get_user(session.username, ("face",))["face"]
 
         # Update status
         self.update_auth_status("Face authentication in progress...", warning=True)
@@ -1480,17 +1568,20 @@ class AuthenticationApp(QMainWindow):
         result = dialog.exec_()
 
         if result == QDialog.Accepted and hasattr(dialog.webcam_thread, 'last_face'):
-            face_img = cv2.resize(dialog.webcam_thread.last_face, (100, 100))
+            # The capture can take a while; the session may have expired meanwhile
+            if self.login_session() is None:
+                return
 
             # Compare faces
-            stored_face_array = np.frombuffer(stored_face, dtype=np.uint8)
-
             try:
-                stored_face_resized = stored_face_array.reshape(100, 100)
-                distance = np.mean((stored_face_resized - face_img) ** 2)
-
-                if distance < 1000:  # Same threshold as in authentication.py
-                    self.auth_state["face"] = True
+                start = time.perf_counter()
+                distance = authentication.face_distance(stored_face, dialog.webcam_thread.last_face)
+                auditLog.record("face", session.username, ok=distance < authentication.FACE_THRESHOLD,
+                                score=distance, ms=(time.perf_counter() - start) * 1000, attempt=session.attempt)
+
+                if distance < authentication.FACE_THRESHOLD:  # Same threshold as in authentication.py
+                    session.face = True
+                    self.sessions.touch(session.id)
                     self.auth_progress.setValue(3)
                     self.update_auth_status("Face authentication successful", True)
                     self.tfa_auth_btn.setEnabled(True)
@@ -1513,76 +1604,116 @@ class AuthenticationApp(QMainWindow):
                     self.update_auth_status("Face authentication failed", False)
                     self.show_error_message("Authentication Error", "Face authentication failed.")
             except ValueError:
+                auditLog.record("face", session.username, ok=False, attempt=session.attempt,
+                                detail="face data size mismatch")
                 self.update_auth_status("Face data error", False)
                 self.show_error_message("Authentication Error", "Face data size mismatch.")
         else:
             self.update_auth_status("Face authentication cancelled", warning=True)
 
+    def run_in_background(self, func, args, on_success, on_error):
+        """Runs func(*args) on a worker thread and reports back on the UI thread."""
+        task = BackgroundTask(func, *args)
+        task.succeeded.connect(on_success)
+        task.failed.connect(on_error)
+        task.finished.connect(lambda: self.background_tasks.discard(task))
+        self.background_tasks.add(task)
+        task.start()
+
     def authenticate_2fa(self):
         """Fourth authentication step: 2FA verification."""
+        session = self.login_session()
+        if session is None:
+            return
+        provider = twoFactor.get_provider(session.otp_provider)
+
         # Update status
         self.update_auth_status("Sending verification code...", warning=True)
+        self.tfa_auth_btn.setEnabled(False)
 
-        # Send verification code
-        try:
-            authentication.send_2fa_code(self.auth_state["phone"])
-        except Exception as e:
-            self.update_auth_status("Failed to send verification code", False)
-            self.show_error_message("2FA Error", f"Failed to send verification code: {str(e)}")
-            return
+        # Send verification code without blocking the UI (nothing is sent for authenticator app codes)
+        self.run_in_background(provider.send_code, (session,),
+                               lambda _: self.prompt_2fa_code(provider),
+                               self.on_2fa_send_failed)
 
-        # Open 2FA dialog
-        dialog = VerifyCodeDialog(self)
+    def on_2fa_send_failed(self, error):
+        self.tfa_auth_btn.setEnabled(True)
+        self.update_auth_status("Failed to send verification code", False)
+        self.show_error_message("2FA Error", f"Failed to send verification code: {str(error)}")
+
+    def prompt_2fa_code(self, provider):
+        """Asks for the code once it has been sent, then checks it in the background."""
+        dialog = VerifyCodeDialog(self, provider.prompt)
         result = dialog.exec_()
 
         if result == QDialog.Accepted:
+            session = self.login_session()
+            if session is None:
+                return
             code = dialog.get_code()
-            if authentication.verify_2fa_code(self.auth_state["phone"], code):
-                self.auth_state["2fa"] = True
-                self.auth_progress.setValue(4)
-                self.update_auth_status("Authentication successful!", True)
+            self.update_auth_status("Checking verification code...", warning=True)
+            self.tfa_started = time.perf_counter()
+            self.run_in_background(provider.verify_code, (session, code),
+                                   self.on_2fa_checked, self.on_2fa_check_failed)
+        else:
+            self.tfa_auth_btn.setEnabled(True)
+            self.update_auth_status("2FA verification cancelled", warning=True)
 
-                # Update button styles to indicate completion
-                self.tfa_auth_btn.setStyleSheet("""
-                    QPushButton {
-                        background-color: #10b981;
-                        color: white;
-                        border-radius: 4px;
-                        padding: 10px;
-                        text-align: left;
-                        font-weight: bold;
-                    }
-                    QPushButton:hover {
-                        background-color: #059669;
-                    }
-                """)
+    def on_2fa_check_failed(self, error):
+        session = self.sessions.get(self.session_id)
+        if session is not None:
+            auditLog.record("2fa", session.username, ok=False, attempt=session.attempt, detail=f"error: {error}")
+        self.tfa_auth_btn.setEnabled(True)
+        self.update_auth_status("2FA verification error", False)
+        self.show_error_message("2FA Error", f"Failed to check verification code: {str(error)}")
+
+    def on_2fa_checked(self, approved):
+        """Handles the result of the 2FA code check."""
+        self.tfa_auth_btn.setEnabled(True)
+        session = self.login_session()
+        if session is None:
+            return
+        auditLog.record("2fa", session.username, ok=approved, ms=(time.perf_counter() - self.tfa_started) * 1000,
+                        attempt=session.attempt, detail=session.otp_provider)
+        if approved:
+            session.tfa = True
+            self.auth_progress.setValue(4)
+            self.update_auth_status("Authentication successful!", True)
 
-                # Check if all authentication methods passed
-                if all([self.auth_state["password"], self.auth_state["voice"],
-                        self.auth_state["face"], self.auth_state["2fa"]]):
-                    # Show success message
-                    self.show_success_message("Authentication Successful",
-                                              f"User '{self.auth_state['username']}' authenticated successfully.")
+            # Update button styles to indicate completion
+            self.tfa_auth_btn.setStyleSheet("""
+                QPushButton {
+                    background-color: #10b981;
+                    color: white;
+                    border-radius: 4px;
+                    padding: 10px;
+                    text-align: left;
+                    font-weight: bold;
+                }
+                QPushButton:hover {
+                    background-color: #059669;
+                }
+            """)
 
-                    # Navigate to success screen (index 3) - ADD THIS LINE
-                    self.stacked_widget.setCurrentIndex(3)
-            else:
-                self.update_auth_status("Incorrect verification code", False)
-                self.show_error_message("Authentication Error", "Incorrect verification code.")
+            # Check if all authentication methods passed
+            if session.complete:
+                auditLog.record("login", session.username, ok=True, attempt=session.attempt)
+                rateLimiter.succeeded(session.username)
+                # Show success message
+                self.show_success_message("Authentication Successful",
+                                          f"User '{session.username}' authenticated successfully.")
+
+                # Navigate to success screen (index 3) - ADD THIS LINE
+                self.stacked_widget.setCurrentIndex(3)
         else:
-            self.update_auth_status("2FA verification cancelled", warning=True)
+            self.update_auth_status("Incorrect verification code", False)
+            self.show_error_message("Authentication Error", "Incorrect verification code.")
 
     def reset_login(self):
         """Reset the authentication state and UI."""
         # Reset authentication state
-        self.auth_state = {
-            "password": False,
-            "voice": False,
-            "face": False,
-            "2fa": False,
-            "username": "",
-            "phone": ""
-        }
+        self.sessions.discard(self.session_id)
+        self.session_id = None
 
         # Reset UI elements
         self.login_username.clear()
@@ -1629,7 +1760,11 @@ class AuthenticationApp(QMainWindow):
 
     def update_voice_status(self, success=True):
         """Updates the voice recording status indicator with success or failure styling."""
-        if success:
+        if success and len(self.voice_samples) < voiceDetection.VOICE_ENROLL_SAMPLES:
+            self.voice_status.setText(f"Voice: {len(self.voice_samples)} of {voiceDetection.VOICE_ENROLL_SAMPLES} "
+                                      "recorded, record again")
+            self.voice_status.setStyleSheet("color: #f59e0b; font-weight: bold;")
+        elif success:
             self.voice_status.setText("Voice: Recorded ✓")
             self.voice_status.setStyleSheet("color: #10b981; font-weight: bold;")
         else:
@@ -1792,8 +1927,9 @@ class AuthenticationApp(QMainWindow):
         content_layout.addWidget(detail_message)
 
         # Add username info
-        if hasattr(self, 'auth_state') and self.auth_state.get("username"):
-            username_message = QLabel(f"Logged in as: {self.auth_state['username']}")
+        session = self.sessions.get(self.session_id) if hasattr(self, 'session_id') else None
+        if session is not None:
+            username_message = QLabel(f"Logged in as: {session.username}")
             username_message.setStyleSheet("font-size: 14px; color: #1e293b; font-weight: bold;")
             username_message.setAlignment(Qt.AlignCenter)
             content_layout.addWidget(username_message)
@@ -1827,14 +1963,16 @@ class AuthenticationApp(QMainWindow):
 
 if __name__ == "__main__":
     # Create application
-    app = QApplication(sys.argv)
+    with startupProfile.phase("QApplication"):
+        app = QApplication(sys.argv)
 
-    # Set application-wide font
-    font = QFont("Arial", 10)
-    app.setFont(font)
+        # Set application-wide font
+        font = QFont("Arial", 10)
+        app.setFont(font)
 
     # Create the main window
-    window = AuthenticationApp()
+    with startupProfile.phase("AuthenticationApp"):
+        window = AuthenticationApp()
 
     # Center the window on screen
     screen_geometry = app.desktop().screenGeometry()
@@ -1843,5 +1981,16 @@ if __name__ == "__main__":
     window.move(x, y)
 
     # Show and execute the application
-    window.show()
+    with startupProfile.phase("show"):
+        window.show()
+
+    if startupProfile.enabled:
+        # let Qt paint the welcome screen before taking the final measurement
+        app.processEvents()
+        startupProfile.mark("first paint (since start)")
+        startupProfile.report()
+        startupProfile.disable()
+
+    # write out the queued audit entries before the process exits
+    app.aboutToQuit.connect(auditLog.shutdown)
     sys.exit(app.exec_())
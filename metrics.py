@@ -0,0 +1,184 @@
+# File: metrics.py
+# Description: Lightweight latency tracing for the authentication factors.
+# Stages are timed with `with metrics.span("stage"):` and collected into
+# histograms that are written to a JSON or Prometheus text file.
+#
+# Enable it by setting AUTH_METRICS=1 (and optionally AUTH_METRICS_FILE, a
+# path ending in .json or .prom). When disabled, span() hands back a shared
+# no-op object, so instrumented code pays for one function call per stage.
+
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from functools import wraps
+
+# Histogram bucket upper bounds in seconds (Prometheus style, cumulative)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+DEFAULT_PATH = "auth_metrics.json"
+
+enabled = os.getenv("AUTH_METRICS", "").lower() in ("1", "true", "yes")
+export_path = os.getenv("AUTH_METRICS_FILE") or DEFAULT_PATH
+
+_histograms = {}
+_lock = threading.Lock()
+
+
+class Histogram:
+    """Latency distribution of one stage."""
+    __slots__ = ("count", "total", "minimum", "maximum", "bucket_counts")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+        self.bucket_counts = [0] * len(BUCKETS)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.minimum = min(self.minimum, seconds)
+        self.maximum = max(self.maximum, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def to_dict(self):
+        cumulative = []
+        running = 0
+        for bound, count in zip(BUCKETS, self.bucket_counts):
+            running += count
+            cumulative.append(["+Inf" if bound == math.inf else bound, running])
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.minimum if self.count else None,
+            "max": self.maximum if self.count else None,
+            "mean": self.total / self.count if self.count else None,
+            "buckets": cumulative,
+        }
+
+
+def observe(name, seconds):
+    """Adds one measurement (in seconds) to the histogram of a stage."""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name):
+    """Context manager timing one stage."""
+    if not enabled:
+        return _NOOP_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    """Decorator timing every call of a function as the given stage."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def enable(path=None):
+    """Turns collection on at runtime (e.g. from a benchmark)."""
+    global enabled, export_path
+    enabled = True
+    if path:
+        export_path = path
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def snapshot():
+    """Returns {stage: histogram dict} for everything recorded so far."""
+    with _lock:
+        return {name: histogram.to_dict() for name, histogram in sorted(_histograms.items())}
+
+
+def _prometheus_text(stages):
+    lines = ["# HELP auth_stage_seconds Latency of authentication stages.",
+             "# TYPE auth_stage_seconds histogram"]
+    for name, data in stages.items():
+        for bound, count in data["buckets"]:
+            lines.append(f'auth_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+        lines.append(f'auth_stage_seconds_sum{{stage="{name}"}} {data["sum"]}')
+        lines.append(f'auth_stage_seconds_count{{stage="{name}"}} {data["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def export(path=None):
+    """Writes the histograms to `path` (Prometheus text if it ends in .prom, JSON otherwise)."""
+    path = path or export_path
+    stages = snapshot()
+    if path.endswith(".prom"):
+        content = _prometheus_text(stages)
+    else:
+        content = json.dumps({"generated_at": time.time(), "stages": stages}, indent=2)
+
+    # write then rename so a scraper never reads a half written file
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        file.write(content)
+    os.replace(temp_path, path)
+    return path
+
+
+def _export_at_exit():
+    if enabled and _histograms:
+        export()
+
+
+atexit.register(_export_at_exit)
@@ -0,0 +1,241 @@
+# File: rateLimiter.py
+# Description: In-memory token buckets that reject repeated login attempts
+# before any expensive factor runs (bcrypt, the speaker model, the camera, a
+# paid SMS). Every attempt takes one token from the bucket of its username and
+# one from the bucket of its terminal; with either empty it is refused, and the
+# check costs a dict lookup instead of seconds of CPU.
+#
+#   username  USER_BURST attempts at once, then one more every
+#             60 / USER_PER_MINUTE seconds
+#   terminal  TERMINAL_BURST attempts, refilled at TERMINAL_PER_MINUTE
+#
+# Buckets that have refilled completely are dropped, so memory only holds
+# recently active keys. The rest are saved to RATE_LIMIT_FILE every
+# PERSIST_INTERVAL seconds and at exit, and loaded again on start, so
+# restarting the app doesn't hand out a fresh burst.
+#
+# RATE_LIMIT=off disables the checks; AUTH_TERMINAL_ID names this terminal
+# (default: the host name).
+#
+#   python rateLimiter.py show
+#   python rateLimiter.py reset --username alice
+
+import argparse
+import atexit
+import json
+import math
+import os
+import socket
+import threading
+import time
+
+enabled = os.getenv("RATE_LIMIT", "on").lower() not in ("0", "off", "false", "no")
+TERMINAL_ID = os.getenv("AUTH_TERMINAL_ID") or socket.gethostname()
+RATE_LIMIT_FILE = os.getenv("RATE_LIMIT_FILE", "rate_limits.json")
+
+USER_BURST = 5
+USER_PER_MINUTE = 1.0
+TERMINAL_BURST = 20
+TERMINAL_PER_MINUTE = 10.0
+PERSIST_INTERVAL = 30.0  # seconds
+MAX_KEYS = 100000  # beyond this the fullest buckets are evicted first
+
+
+def _valid_bucket(limits, kind, name, tokens, updated):
+    numbers = all(isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+                  for value in (tokens, updated))
+    return isinstance(kind, str) and kind in limits and isinstance(name, str) and numbers
+
+
+class TokenBucketLimiter:
+    """Token buckets per key, each kind ("user", "terminal") with its own burst and rate.
+
+    Thread-safe. Times are wall-clock seconds, so saved buckets stay valid
+    across restarts.
+    """
+
+    def __init__(self, limits, path=None, clock=time.time):
+        self.limits = limits  # kind -> (burst, tokens per second)
+        self.path = path
+        self.clock = clock
+        self.buckets = {}  # (kind, name) -> [tokens, updated]
+        self.lock = threading.Lock()
+        self.dirty = False
+        self._saver = None
+        self._stop = threading.Event()
+        if path:
+            self.load()
+
+    def _tokens(self, key, now):
+        burst, rate = self.limits[key[0]]
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return burst
+        return min(burst, bucket[0] + (now - bucket[1]) * rate)
+
+    def acquire(self, keys, cost=1.0):
+        """Takes cost tokens from every bucket, or from none.
+
+        Returns (allowed, seconds until an attempt would be allowed).
+        """
+        now = self.clock()
+        with self.lock:
+            tokens = [self._tokens(key, now) for key in keys]
+            if all(available >= cost for available in tokens):
+                for key, available in zip(keys, tokens):
+                    self.buckets[key] = [available - cost, now]
+                self.dirty = True
+                if len(self.buckets) > MAX_KEYS:
+                    self._prune(now)
+                return True, 0.0
+            wait = max((cost - available) / self.limits[key[0]][1]
+                       for key, available in zip(keys, tokens) if available < cost)
+            return False, wait
+
+    def reset(self, key):
+        with self.lock:
+            if self.buckets.pop(key, None) is not None:
+                self.dirty = True
+
+    def _prune(self, now):
+        # full buckets are the same as absent ones; past MAX_KEYS the fullest go next
+        for key in [key for key in self.buckets if self._tokens(key, now) >= self.limits[key[0]][0]]:
+            del self.buckets[key]
+        if len(self.buckets) > MAX_KEYS:
+            ranked = sorted(self.buckets, key=lambda key: self._tokens(key, now) / self.limits[key[0]][0])
+            for key in ranked[MAX_KEYS:]:
+                del self.buckets[key]
+
+    def snapshot(self):
+        """{kind: {name: tokens available now}} for the buckets that aren't full."""
+        now = self.clock()
+        with self.lock:
+            self._prune(now)
+            result = {}
+            for key in self.buckets:
+                result.setdefault(key[0], {})[key[1]] = round(self._tokens(key, now), 3)
+            return result
+
+    # persistence
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return  # a damaged file only costs the saved state
+        buckets = saved.get("buckets") if isinstance(saved, dict) else None
+        if not isinstance(buckets, list):
+            return
+        with self.lock:
+            for entry in buckets:
+                # entries of the wrong shape are skipped, so check() never trips over them
+                if isinstance(entry, list) and len(entry) == 4 and _valid_bucket(self.limits, *entry):
+                    kind, name, tokens, updated = entry
+                    self.buckets[(kind, name)] = [float(tokens), float(updated)]
+
+    def save(self):
+        """Writes the buckets that aren't full (write then rename, never half a file)."""
+        with self.lock:
+            if not self.dirty:
+                return
+            self._prune(self.clock())
+            buckets = [[kind, name, tokens, updated] for (kind, name), (tokens, updated) in self.buckets.items()]
+            self.dirty = False
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"saved_at": self.clock(), "buckets": buckets}, file)
+        os.replace(temp_path, self.path)
+
+    def start(self, interval=PERSIST_INTERVAL):
+        """Saves every interval seconds on a daemon thread until stop()."""
+        if self._saver is None and self.path:
+            self._saver = threading.Thread(target=self._save_periodically, args=(interval,), name="rateLimiter",
+                                           daemon=True)
+            self._saver.start()
+
+    def _save_periodically(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.save()
+            except OSError as e:
+                print(f"Rate limiter: could not save {self.path}: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self.path:
+            try:
+                self.save()
+            except OSError as e:
+                print(f"Rate limiter: could not save {self.path}: {e}")
+
+
+def default_limits():
+    return {"user": (USER_BURST, USER_PER_MINUTE / 60.0), "terminal": (TERMINAL_BURST, TERMINAL_PER_MINUTE / 60.0)}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """The process-wide limiter (loaded from RATE_LIMIT_FILE on first use)."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            # absolute, so a later change of working directory doesn't move the file
+            _limiter = TokenBucketLimiter(default_limits(), os.path.abspath(RATE_LIMIT_FILE))
+            _limiter.start()
+            atexit.register(_limiter.stop)
+        return _limiter
+
+
+def check(username, terminal=None):
+    """Takes a login attempt from the username's and the terminal's budget.
+
+    Returns (allowed, retry_after seconds). Costs microseconds, so call it
+    before any other factor.
+    """
+    if not enabled:
+        return True, 0.0
+    return get_limiter().acquire([("user", username), ("terminal", terminal or TERMINAL_ID)])
+
+
+def succeeded(username):
+    """Refills the username's bucket after a complete, successful login."""
+    if enabled:
+        get_limiter().reset(("user", username))
+
+
+def describe(retry_after):
+    """The message shown to a refused user."""
+    return f"Too many login attempts. Try again in {math.ceil(retry_after)} seconds."
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or reset the login rate limits.")
+    parser.add_argument("command", choices=["show", "reset"])
+    parser.add_argument("--file", default=RATE_LIMIT_FILE)
+    parser.add_argument("--username", help="reset: the user whose bucket is refilled")
+    parser.add_argument("--terminal", help="reset: the terminal whose bucket is refilled")
+    args = parser.parse_args()
+
+    limiter = TokenBucketLimiter(default_limits(), args.file)
+    if args.command == "show":
+        for kind, names in sorted(limiter.snapshot().items()):
+            for name, tokens in sorted(names.items()):
+                print(f"{kind:9} {name:30} {tokens:6.2f} attempts left")
+        return
+    if not args.username and not args.terminal:
+        parser.error("reset needs --username and/or --terminal")
+    if args.username:
+        limiter.reset(("user", args.username))
+    if args.terminal:
+        limiter.reset(("terminal", args.terminal))
+    limiter.save()
+
+
+if __name__ == "__main__":
+    main()
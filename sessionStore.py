@@ -0,0 +1,187 @@
+# File: sessionStore.py
+# Description: In-progress logins, keyed by a random session id. A session holds
+# the user's details read at the password step and which factors have passed so
+# far; it expires SESSION_TTL seconds after it was created or after its last
+# factor passed (the GUI touches it then), so a login left half-finished
+# doesn't stay valid until the app is closed.
+#
+# Lookups are a dict access. Expiry is checked on every lookup, and a
+# background thread sweeps expired sessions every SWEEP_INTERVAL seconds
+# using a heap ordered by expiry time, so a sweep only visits the sessions it
+# removes. Sessions are __slots__ objects of 128 bytes (a dict with the same
+# keys is 272); at MAX_SESSIONS the one closest to expiring is evicted to make
+# room, which caps memory at MAX_SESSIONS sessions and the strings they hold.
+#
+# AUTH_SESSION_TTL and AUTH_MAX_SESSIONS override the defaults.
+
+import heapq
+import os
+import secrets
+import threading
+import time
+
+SESSION_TTL = float(os.getenv("AUTH_SESSION_TTL", "300"))  # seconds
+MAX_SESSIONS = int(os.getenv("AUTH_MAX_SESSIONS", "10000"))
+SWEEP_INTERVAL = 30.0  # seconds
+
+
+class Session:
+    """One login in progress: who is logging in and which factors have passed."""
+
+    __slots__ = ("id", "expires", "ttl", "attempt", "username", "phone", "otp_provider", "totp_secret",
+                 "password", "voice", "face", "tfa")
+
+    def __init__(self, session_id, expires, ttl, attempt=None, username="", phone="", otp_provider=None,
+                 totp_secret=None):
+        self.id = session_id
+        self.expires = expires
+        self.ttl = ttl
+        self.attempt = attempt
+        self.username = username
+        self.phone = phone
+        self.otp_provider = otp_provider
+        self.totp_secret = totp_secret
+        self.password = self.voice = self.face = self.tfa = False
+
+    @property
+    def complete(self):
+        return self.password and self.voice and self.face and self.tfa
+
+    # the 2FA providers read the user's details as a dict
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+class SessionStore:
+    """Sessions by id with a per-session TTL and a ceiling on how many are kept.
+
+    Thread-safe. Times come from a monotonic clock; sessions aren't persisted.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.sessions = {}  # id -> Session
+        self.expiry = []  # heap of (expires, id); stale entries are skipped when popped
+        self.lock = threading.Lock()
+        self.created = self.expired = self.evicted = 0
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self, ttl=None, **fields):
+        """Starts a session (fields as in Session) and returns it."""
+        ttl = self.ttl if ttl is None else ttl
+        now = self.clock()
+        session = Session(secrets.token_urlsafe(16), now + ttl, ttl, **fields)
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                self._sweep(now)
+            while len(self.sessions) >= self.max_sessions:
+                # still full: the session closest to expiring makes room
+                self._pop_next()
+                self.evicted += 1
+            self.sessions[session.id] = session
+            heapq.heappush(self.expiry, (session.expires, session.id))
+            self.created += 1
+        return session
+
+    def get(self, session_id):
+        """The live session with this id, or None if there is none or it has expired."""
+        if session_id is None:
+            return None
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None and session.expires <= self.clock():
+                del self.sessions[session_id]
+                self.expired += 1
+                return None
+            return session
+
+    def touch(self, session_id):
+        """Restarts the session's TTL; False if it has already expired."""
+        now = self.clock()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or session.expires <= now:
+                return False
+            session.expires = now + session.ttl
+            heapq.heappush(self.expiry, (session.expires, session_id))
+            if len(self.expiry) > 2 * len(self.sessions) + 64:
+                # touched sessions leave stale heap entries behind; rebuild before they pile up
+                self.expiry = [(session.expires, session.id) for session in self.sessions.values()]
+                heapq.heapify(self.expiry)
+            return True
+
+    def discard(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def _pop_next(self):
+        # removes the session that expires first (its heap entry is the current one)
+        while self.expiry:
+            expires, session_id = heapq.heappop(self.expiry)
+            session = self.sessions.get(session_id)
+            if session is not None and session.expires == expires:
+                del self.sessions[session_id]
+                return session
+        return None
+
+    def _sweep(self, now):
+        removed = 0
+        while self.expiry and self.expiry[0][0] <= now:
+            expires, session_id = heapq.heappop(self.expiry)
+            session = self.sessions.get(session_id)
+            if session is not None and session.expires == expires:
+                del self.sessions[session_id]
+                removed += 1
+        self.expired += removed
+        return removed
+
+    def sweep(self):
+        """Removes the expired sessions; returns how many."""
+        with self.lock:
+            return self._sweep(self.clock())
+
+    def start(self, interval=SWEEP_INTERVAL):
+        """Sweeps every interval seconds on a daemon thread until stop()."""
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_periodically, args=(interval,), name="sessionStore",
+                                             daemon=True)
+            self._sweeper.start()
+
+    def _sweep_periodically(self, interval):
+        while not self._stop.wait(interval):
+            self.sweep()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self.lock:
+            return {"active": len(self.sessions), "created": self.created, "expired": self.expired,
+                    "evicted": self.evicted, "heap": len(self.expiry)}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The process-wide session store, with its sweeper running."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+            _store.start()
+        return _store
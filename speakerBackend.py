@@ -0,0 +1,94 @@
+# File: speakerBackend.py
+# Description: CPU inference backends for the WeSpeaker ResNet34 speaker model.
+# Each backend wraps the fp32 model in a module with the same call signature,
+# model(waveforms, weights=None) -> (batch, 256) embeddings, so voiceDetection
+# doesn't care which one is in use:
+#
+#   eager        the model as loaded (fp32), the reference
+#   bf16         fbank features in fp32, the ResNet under bfloat16 autocast
+#   quantized    dynamic int8 quantization of the Linear layers
+#   torchscript  the ResNet traced, frozen and optimized for inference
+#
+# Pick one with VOICE_BACKEND and compare them with python -m bench.bench_backends.
+
+import warnings
+
+import torch
+
+BACKENDS = ("eager", "bf16", "quantized", "torchscript")
+
+# length of the example input the ResNet is traced with (any length works afterwards)
+TRACE_SECONDS = 3
+TRACE_SAMPLE_RATE = 16000
+
+
+class AutocastModel(torch.nn.Module):
+    """Runs the ResNet in bfloat16; fbank and the returned embedding stay fp32."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, waveforms, weights=None):
+        features = self.model.compute_fbank(waveforms)
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            embeddings = self.model.resnet(features, weights=weights)[1]
+        return embeddings.float()
+
+
+class _ResNetWithWeights(torch.nn.Module):
+    # tracing needs a fixed set of tensor inputs, so weights are always passed
+    def __init__(self, resnet):
+        super().__init__()
+        self.resnet = resnet
+
+    def forward(self, features, weights):
+        return self.resnet(features, weights=weights)[1]
+
+
+class TracedModel(torch.nn.Module):
+    """fbank in eager mode, then the traced ResNet."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        example = torch.randn(1, 1, TRACE_SECONDS * TRACE_SAMPLE_RATE) * 0.1
+        with torch.no_grad(), warnings.catch_warnings():
+            # TracerWarnings about the shape checks in pooling, deprecation notices from freeze
+            warnings.simplefilter("ignore")
+            features = model.compute_fbank(example)
+            traced = torch.jit.trace(_ResNetWithWeights(model.resnet).eval(),
+                                     (features, torch.ones(1, features.shape[1])), check_trace=False)
+            self.resnet = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    def forward(self, waveforms, weights=None):
+        features = self.model.compute_fbank(waveforms)
+        if weights is None:
+            # all-ones weights pool exactly like no weights (stretched to the frame count)
+            weights = torch.ones(waveforms.shape[0], 1)
+        return self.resnet(features, weights)
+
+
+def prepare(model, backend="eager", threads=0):
+    """Wraps an fp32 model (in eval mode) for the given backend.
+
+    threads > 0 also sets the number of torch intra-op threads for this process.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown speaker backend {backend!r} (choose from {', '.join(BACKENDS)})")
+    if threads > 0:
+        torch.set_num_threads(threads)
+
+    if backend == "eager":
+        return model
+    if backend == "quantized":
+        # only Linear layers have dynamic int8 kernels; the convolutions stay fp32
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # torch.ao deprecation notice
+            return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8).eval()
+
+    if not (hasattr(model, "compute_fbank") and hasattr(model, "resnet")):
+        raise ValueError(f"The {backend} backend needs a WeSpeaker ResNet model")
+    if backend == "bf16":
+        return AutocastModel(model).eval()
+    return TracedModel(model).eval()
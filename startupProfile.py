@@ -0,0 +1,83 @@
+# File: startupProfile.py
+# Description: Optional start-up profiler for gui.py (--profile-startup).
+# Records how long each module import and each start-up phase takes and
+# prints a report once the first window has been painted.
+
+import builtins
+import sys
+import time
+from contextlib import contextmanager
+
+# Reference point for every timing, taken when this module is first imported
+START_TIME = time.perf_counter()
+
+enabled = False
+import_times = []  # (module name, inclusive seconds, nesting depth) in import order
+phases = []  # (phase name, seconds)
+
+_original_import = builtins.__import__
+_depth = 0
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    global _depth
+    # only the first import of a module costs anything worth reporting
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    _depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        import_times.append((name, time.perf_counter() - start, _depth))
+
+
+def enable():
+    """Starts timing imports. Call before the imports that should be measured."""
+    global enabled
+    if not enabled:
+        enabled = True
+        builtins.__import__ = _timed_import
+
+
+def disable():
+    global enabled
+    enabled = False
+    builtins.__import__ = _original_import
+
+
+@contextmanager
+def phase(name):
+    """Times a start-up phase (no-op when profiling is disabled)."""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases.append((name, time.perf_counter() - start))
+
+
+def mark(name):
+    """Records a phase that ends now and started when the profiler was loaded."""
+    if enabled:
+        phases.append((name, time.perf_counter() - START_TIME))
+
+
+def report(out=None, top=25):
+    """Prints the slowest top-level imports and all recorded phases."""
+    out = out or sys.stdout
+    print("\n=== Start-up profile ===", file=out)
+    print("Phases:", file=out)
+    for name, seconds in phases:
+        print(f"  {seconds * 1000:9.1f} ms  {name}", file=out)
+
+    # imports done directly by our code (depth 0) include the time of their own imports
+    direct = sorted((entry for entry in import_times if entry[2] == 0), key=lambda entry: -entry[1])
+    print(f"Slowest imports (inclusive, {len(import_times)} modules loaded):", file=out)
+    for name, seconds, _ in direct[:top]:
+        print(f"  {seconds * 1000:9.1f} ms  {name}", file=out)
+    out.flush()
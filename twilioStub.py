@@ -0,0 +1,203 @@
+# File: twilioStub.py
+# Description: Local stand-in for the two Twilio Verify endpoints used by
+# twoFactor.send_2fa_code / verify_2fa_code, for offline load and latency tests.
+#
+# Run it with:
+#   python twilioStub.py --port 8089 --latency-ms 250 --jitter-ms 100 --error-rate 0.02
+# and point the client at it by setting in IDs.env:
+#   TWILIO_VERIFY_BASE_URL=http://127.0.0.1:8089
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Every verification sent by the stub uses this code unless told otherwise
+DEFAULT_CODE = "123456"
+
+# Twilio Verify behaviour being imitated
+CODE_TTL = 600  # seconds a verification stays pending
+MAX_CHECK_ATTEMPTS = 5
+
+VERIFICATIONS_PATH = re.compile(r"^/v2/Services/(?P<service>[^/]+)/Verifications/?$")
+CHECK_PATH = re.compile(r"^/v2/Services/(?P<service>[^/]+)/VerificationCheck/?$")
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class VerifyStubState:
+    """Pending verifications and request counters shared by all handler threads."""
+
+    def __init__(self, code=DEFAULT_CODE, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None):
+        self.code = code
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.pending = {}  # (service sid, phone number) -> verification dict
+        self.stats = {"verifications": 0, "checks": 0, "approved": 0, "rejected": 0, "injected_errors": 0}
+
+    def delay(self):
+        """Seconds to wait before answering, drawn from latency +/- jitter."""
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000.0
+
+    def inject_error(self):
+        with self.lock:
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+            if failed:
+                self.stats["injected_errors"] += 1
+        return failed
+
+    def create_verification(self, service_sid, to, channel):
+        verification = {
+            "sid": "VE" + uuid.uuid4().hex,
+            "service_sid": service_sid,
+            "account_sid": "AC" + "0" * 32,
+            "to": to,
+            "channel": channel,
+            "status": "pending",
+            "valid": False,
+            "date_created": _now(),
+            "date_updated": _now(),
+            "send_code_attempts": [{"time": _now(), "channel": channel}],
+        }
+        with self.lock:
+            self.stats["verifications"] += 1
+            self.pending[(service_sid, to)] = (verification, time.monotonic(), [0])
+        return verification
+
+    def check_verification(self, service_sid, to, code):
+        """Returns (http status, body) for a verification check."""
+        with self.lock:
+            self.stats["checks"] += 1
+            entry = self.pending.get((service_sid, to))
+            if entry is None or time.monotonic() - entry[1] > CODE_TTL:
+                self.pending.pop((service_sid, to), None)
+                return 404, _error(20404, "The requested resource was not found", 404)
+
+            verification, _, attempts = entry
+            attempts[0] += 1
+            if attempts[0] > MAX_CHECK_ATTEMPTS:
+                return 429, _error(60202, "Max check attempts reached", 429)
+
+            result = dict(verification, date_updated=_now())
+            if code == self.code:
+                # an approved verification cannot be checked again, like the real service
+                self.pending.pop((service_sid, to), None)
+                self.stats["approved"] += 1
+                result.update(status="approved", valid=True)
+            else:
+                self.stats["rejected"] += 1
+        return 200, result
+
+
+def _error(code, message, status):
+    return {"code": code, "message": message, "more_info": f"https://www.twilio.com/docs/errors/{code}",
+            "status": status}
+
+
+class VerifyStubHandler(BaseHTTPRequestHandler):
+    server_version = "VerifyStub/1.0"
+    protocol_version = "HTTP/1.1"  # keep-alive, so the pooled client session is exercised
+    disable_nagle_algorithm = True  # headers and body are separate writes, don't wait for delayed ACKs
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with self.server.state.lock:
+                stats = dict(self.server.state.stats, pending=len(self.server.state.pending))
+            self.send_json(200, stats)
+        else:
+            self.send_json(404, _error(20404, "The requested resource was not found", 404))
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length") or 0)
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+
+        time.sleep(state.delay())
+        if state.inject_error():
+            self.send_json(503, _error(20503, "Service unavailable (injected by stub)", 503))
+            return
+
+        match = VERIFICATIONS_PATH.match(self.path)
+        if match:
+            if not form.get("To"):
+                self.send_json(400, _error(60200, "Invalid parameter: To", 400))
+                return
+            verification = state.create_verification(match.group("service"), form["To"],
+                                                     form.get("Channel", "sms"))
+            self.send_json(201, verification)
+            return
+
+        match = CHECK_PATH.match(self.path)
+        if match:
+            status, body = state.check_verification(match.group("service"), form.get("To"), form.get("Code"))
+            self.send_json(status, body)
+            return
+
+        self.send_json(404, _error(20404, "The requested resource was not found", 404))
+
+
+def start_stub_server(host="127.0.0.1", port=0, code=DEFAULT_CODE, latency_ms=0.0, jitter_ms=0.0,
+                      error_rate=0.0, seed=None, verbose=False):
+    """Starts the stub on a daemon thread and returns the server (port 0 picks a free port).
+
+    The base URL to configure is f"http://{host}:{server.server_address[1]}".
+    Call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), VerifyStubHandler)
+    server.daemon_threads = True
+    server.state = VerifyStubState(code, latency_ms, jitter_ms, error_rate, seed)
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, name="twilioStub", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Twilio Verify stand-in for load and latency testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--code", default=DEFAULT_CODE, help="code accepted by every verification check")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="mean added latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- jitter around the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.host, args.port, args.code, args.latency_ms, args.jitter_ms,
+                               args.error_rate, args.seed, args.verbose)
+    print(f"Twilio Verify stub listening on http://{args.host}:{server.server_address[1]} (code {args.code})")
+    print("Set TWILIO_VERIFY_BASE_URL to that address. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
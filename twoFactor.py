@@ -0,0 +1,266 @@
+# File: twoFactor.py
+# Description: Second-factor (one-time code) providers. The Twilio Verify
+# provider sends a code by SMS, the TOTP provider checks RFC 6238 codes from an
+# authenticator app entirely offline.
+#
+# A TOTP code is accepted once: the time step it belongs to is recorded per
+# user and later codes must come from a newer step (RFC 6238 section 5.2), so
+# a code seen over someone's shoulder can't be replayed within the drift
+# window. The steps are kept in the user store (set_step_store, done by
+# authentication.get_store) or, without one, in this process.
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import struct
+import threading
+import time
+from urllib.parse import quote
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv("IDs.env")  # Load environment variables from .env file
+
+# Load Twilio credentials from environment variables
+account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+verify_sid = os.getenv("TWILIO_VERIFY_SID")
+
+# Optional override of the Verify API address, e.g. the local twilioStub.py server
+verify_base_url = os.getenv("TWILIO_VERIFY_BASE_URL")
+
+# HTTP settings for Twilio calls (seconds / attempts)
+TWILIO_CONNECT_TIMEOUT = float(os.getenv("TWILIO_CONNECT_TIMEOUT", "3.05"))
+TWILIO_READ_TIMEOUT = float(os.getenv("TWILIO_READ_TIMEOUT", "10"))
+TWILIO_MAX_RETRIES = int(os.getenv("TWILIO_MAX_RETRIES", "2"))
+
+# The Twilio client is created on first use, so importing this module (GUI start-up,
+# tests, benchmarks, TOTP-only users) needs neither credentials nor the twilio package
+_client = None
+_client_lock = threading.Lock()
+
+# TOTP parameters (RFC 6238 defaults, understood by every authenticator app)
+TOTP_DIGITS = 6
+TOTP_STEP = 30
+TOTP_DRIFT_WINDOW = 1  # number of 30 second steps accepted on either side of "now"
+TOTP_ISSUER = "SecureAuth"
+
+# Provider names stored in users.otp_provider
+PROVIDER_TWILIO = "twilio"
+PROVIDER_TOTP = "totp"
+DEFAULT_PROVIDER = PROVIDER_TWILIO
+
+
+def create_http_client():
+    """Pooled HTTP session for Twilio with explicit timeouts and bounded retries."""
+    from twilio.http.http_client import TwilioHttpClient
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # Only connection failures are retried: a POST that reached Twilio may already
+    # have sent an SMS, so read errors and 5xx responses are not replayed.
+    retries = Retry(total=TWILIO_MAX_RETRIES, connect=TWILIO_MAX_RETRIES, read=0, status=0,
+                    backoff_factor=0.3, allowed_methods=None)
+
+    http_client = TwilioHttpClient(pool_connections=True, timeout=TWILIO_READ_TIMEOUT)
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=4, pool_maxsize=8)
+    http_client.session.mount("https://", adapter)
+    http_client.session.mount("http://", adapter)
+
+    # TwilioHttpClient only validates a single number, requests also takes (connect, read)
+    http_client.timeout = (TWILIO_CONNECT_TIMEOUT, TWILIO_READ_TIMEOUT)
+    return http_client
+
+
+def get_client():
+    """Returns the shared Twilio client, creating it on first use."""
+    global _client, verify_sid
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                sid, token = account_sid, auth_token
+                if verify_base_url:
+                    # the stub accepts anything, placeholders keep the twilio client happy
+                    sid = sid or "AC" + "0" * 32
+                    token = token or "stub"
+                    verify_sid = verify_sid or "VA" + "0" * 32
+
+                # Ensure TWILIO_VERIFY_SID is set before proceeding
+                if not verify_sid:
+                    raise ValueError("ERROR: TWILIO_VERIFY_SID is not set. Please check your environment variables.")
+
+                from twilio.rest import Client
+                client = Client(sid, token, http_client=create_http_client())
+                if verify_base_url:
+                    client.verify.base_url = verify_base_url
+                _client = client
+    return _client
+
+
+def send_2fa_code(phone_number):
+    """Send a verification code via Twilio SMS."""
+    client = get_client()
+    with metrics.span("twofactor.twilio_send"):
+        verification = client.verify.v2.services(verify_sid).verifications.create(to=phone_number, channel="sms")
+    return verification.sid
+
+
+def verify_2fa_code(phone_number, code):
+    """Verify the user's entered 2FA code."""
+    client = get_client()
+    with metrics.span("twofactor.twilio_check"):
+        verification_check = client.verify.v2.services(verify_sid).verification_checks.create(to=phone_number,
+                                                                                               code=code)
+    return verification_check.status == "approved"
+
+
+def generate_totp_secret():
+    """Create a new random base32 TOTP secret (160 bits, as recommended by RFC 4226)."""
+    return base64.b32encode(secrets.token_bytes(20)).decode("ascii").rstrip("=")
+
+
+def _decode_secret(secret):
+    secret = secret.strip().replace(" ", "").upper()
+    padding = "=" * (-len(secret) % 8)
+    return base64.b32decode(secret + padding)
+
+
+def hotp(key, counter, digits=TOTP_DIGITS):
+    """RFC 4226 HOTP value for a raw key and counter."""
+    digest = hmac.new(key, struct.pack(">Q", counter), hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    value = struct.unpack(">I", digest[offset:offset + 4])[0] & 0x7FFFFFFF
+    return str(value % (10 ** digits)).zfill(digits)
+
+
+def totp(secret, for_time=None, step=TOTP_STEP, digits=TOTP_DIGITS):
+    """RFC 6238 TOTP code for a base32 secret at the given unix time (defaults to now)."""
+    if for_time is None:
+        for_time = time.time()
+    return hotp(_decode_secret(secret), int(for_time) // step, digits)
+
+
+def match_totp(secret, code, for_time=None, window=TOTP_DRIFT_WINDOW, step=TOTP_STEP, digits=TOTP_DIGITS,
+               last_step=None):
+    """The time step a TOTP code belongs to, accepting up to `window` steps of
+    clock drift either way, or None. Steps up to last_step (already used) don't count."""
+    code = str(code).strip()
+    if not secret or len(code) != digits or not code.isdigit():
+        return None
+
+    if for_time is None:
+        for_time = time.time()
+    key = _decode_secret(secret)
+    counter = int(for_time) // step
+
+    # compare every candidate so the check takes the same time wherever the match is
+    matched = None
+    for offset in range(-window, window + 1):
+        if hmac.compare_digest(hotp(key, counter + offset, digits), code):
+            if last_step is None or counter + offset > last_step:
+                matched = counter + offset
+    return matched
+
+
+def verify_totp(secret, code, for_time=None, window=TOTP_DRIFT_WINDOW, step=TOTP_STEP, digits=TOTP_DIGITS,
+                last_step=None):
+    """Check a TOTP code, accepting up to `window` steps of clock drift either way
+    but none at or before last_step."""
+    return match_totp(secret, code, for_time, window, step, digits, last_step) is not None
+
+
+class UsedSteps:
+    """Last accepted TOTP step per username, in this process (when there's no user store)."""
+
+    def __init__(self):
+        self.steps = {}
+        self.lock = threading.Lock()
+
+    def claim_totp_step(self, username, step):
+        with self.lock:
+            if self.steps.get(username, -1) >= step:
+                return False
+            self.steps[username] = step
+        return True
+
+
+def provisioning_uri(secret, username, issuer=TOTP_ISSUER):
+    """otpauth:// URI that authenticator apps can import (usually shown as a QR code)."""
+    label = quote(f"{issuer}:{username}")
+    return (f"otpauth://totp/{label}?secret={secret}&issuer={quote(issuer)}"
+            f"&digits={TOTP_DIGITS}&period={TOTP_STEP}")
+
+
+class OTPProvider:
+    """Interface for a second-factor provider.
+
+    `user` is a dict with at least "username", "phone" and "totp_secret" keys.
+    """
+    name = None
+    # text shown to the user when they are asked for the code
+    prompt = "Enter the verification code: "
+
+    def enroll(self, username):
+        """Returns the secret to store for a new user (None if the provider needs none)."""
+        return None
+
+    def send_code(self, user):
+        """Delivers a code to the user, if the provider has to send one."""
+        pass
+
+    def verify_code(self, user, code):
+        """Returns True if `code` is valid for the user."""
+        raise NotImplementedError
+
+
+class TwilioVerifyProvider(OTPProvider):
+    """Codes sent by SMS and checked through the Twilio Verify API."""
+    name = PROVIDER_TWILIO
+    prompt = "Enter the 2FA verification code sent to your phone: "
+
+    def send_code(self, user):
+        return send_2fa_code(user["phone"])
+
+    def verify_code(self, user, code):
+        return verify_2fa_code(user["phone"], code)
+
+
+class TOTPProvider(OTPProvider):
+    """Offline RFC 6238 codes generated by an authenticator app."""
+    name = PROVIDER_TOTP
+    prompt = "Enter the 6-digit code from your authenticator app: "
+
+    def __init__(self, window=TOTP_DRIFT_WINDOW, steps=None):
+        self.window = window
+        self.steps = steps or UsedSteps()  # anything with claim_totp_step(username, step), e.g. a user store
+
+    def enroll(self, username):
+        return generate_totp_secret()
+
+    def verify_code(self, user, code):
+        with metrics.span("twofactor.totp_check"):
+            step = match_totp(user.get("totp_secret"), code, window=self.window)
+            return step is not None and self.steps.claim_totp_step(user["username"], step)
+
+
+PROVIDERS = {
+    PROVIDER_TWILIO: TwilioVerifyProvider(),
+    PROVIDER_TOTP: TOTPProvider(),
+}
+
+
+def set_step_store(store):
+    """Remembers used TOTP steps in store (a userStore) instead of this process."""
+    PROVIDERS[PROVIDER_TOTP].steps = store
+
+
+def get_provider(name=None):
+    """Look up a provider by the name stored for the user (defaults to Twilio SMS)."""
+    provider = PROVIDERS.get(name or DEFAULT_PROVIDER)
+    if provider is None:
+        raise ValueError(f"Unknown 2FA provider: {name}")
+    return provider
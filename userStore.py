@@ -0,0 +1,692 @@
+# File: userStore.py
+# Description: Repository for the users table. The registration and login
+# flows go through a store (the UserStore interface) instead of opening SQLite
+# themselves, so where the users live is decided here:
+#
+#   SQLiteUserStore   one database file (user_auth.db), as before
+#   ShardedUserStore  N database files (user_auth.shard0.db ...), users routed
+#                     by a hash of their username
+#   MemoryUserStore   dicts in this process, for tests and benchmarks that
+#                     should measure compute without disk I/O
+#
+# USER_STORE picks the backend ("sqlite", the default, or "memory"); benchmarks
+# and the load test take --store.
+#
+# Sharding spreads the biometric BLOBs, and the write lock, over several files.
+# Users keep one global id: local id * shard count + shard index (identical to
+# users.id with a single file). Bulk scans (iterate_users, count, fan_out) run
+# on every shard at once. USER_STORE_SHARDS picks the layout; a different shard
+# count needs a reshard, which copies every user into the new layout:
+#
+#   python userStore.py reshard --db user_auth.db --to-shards 4
+#   python userStore.py stats --db user_auth.db --shards 4
+
+import argparse
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+USER_STORE = os.getenv("USER_STORE", "sqlite")
+SHARDS = int(os.getenv("USER_STORE_SHARDS", "0"))  # 0 or 1: a single database file
+
+# every column of users except id, in insert order
+FIELDS = ("username", "password", "voice", "face", "phone", "otp_provider", "totp_secret", "voice_template",
+          "voice_stats")
+COLUMNS = ("id",) + FIELDS
+ITERATE_BATCH = 64
+
+
+class UserExistsError(ValueError):
+    """The username is already registered."""
+
+
+def shard_paths(db_path, shards):
+    base, extension = os.path.splitext(db_path)
+    return [f"{base}.shard{index}{extension or '.db'}" for index in range(shards)]
+
+
+def open_store(db_path, shards=None, backend=None, timeout=30.0):
+    """The store for a database path: one file, `shards` files derived from it,
+    or (backend "memory") an empty in-process store that ignores the path."""
+    backend = backend or USER_STORE
+    shards = SHARDS if shards is None else shards
+    if backend == "memory":
+        return MemoryUserStore()
+    if backend != "sqlite":
+        raise ValueError(f"Unknown user store backend: {backend}")
+    if shards > 1:
+        return ShardedUserStore(shard_paths(db_path, shards), timeout)
+    return SQLiteUserStore(db_path, timeout=timeout)
+
+
+class UserStore:
+    """Interface for where users are kept.
+
+    Users are dicts of FIELDS; "id" is a store-wide id. A store is made of one
+    or more partitions (the database files of a sharded store), which is what
+    the per-file embedding galleries and migrations work on.
+    """
+    BACKENDS = ("sqlite", "memory")
+    path = None  # the backing database file of a single partition, None in memory
+
+    def initialize(self):
+        """Creates or upgrades the storage; safe to call again."""
+
+    def get_user(self, username, columns=FIELDS):
+        """The user's columns as a dict, or None."""
+        raise NotImplementedError
+
+    def exists(self, username):
+        return self.get_user(username, ("id",)) is not None
+
+    def get_users(self, user_ids, columns=("id", "username")):
+        """Users with the given ids (missing ones are left out)."""
+        raise NotImplementedError
+
+    def create_user(self, user):
+        """Inserts a user (a dict of FIELDS); returns their id. Raises UserExistsError."""
+        with self.writer() as writer:
+            (result,) = writer.insert_many([user])
+        if result["id"] is None:
+            raise UserExistsError(f"Username '{user['username']}' already exists")
+        return result["id"]
+
+    def update_biometrics(self, username, voice=None, face=None, voice_template=None, voice_stats=None):
+        """Replaces the stored voice and/or face; returns False for an unknown user.
+
+        A new voice replaces the voice template too (cleared if none is given).
+        """
+        raise NotImplementedError
+
+    def claim_totp_step(self, username, step):
+        """Records step as the last TOTP time step the user logged in with; False
+        if it isn't newer than the recorded one (a replayed code) or the user is unknown."""
+        raise NotImplementedError
+
+    def delete_user(self, username):
+        raise NotImplementedError
+
+    def writer(self):
+        """Context manager for bulk inserts: writer.insert_many(users), writer.commit()."""
+        raise NotImplementedError
+
+    def iterate_users(self, columns=FIELDS, batch_size=ITERATE_BATCH):
+        """Streams every user as a dict."""
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    # partitions; a single-partition store is its own
+
+    def global_id(self, local_id):
+        return local_id
+
+    def local_id(self, user_id):
+        return user_id
+
+    def partitions(self):
+        """The single-partition stores behind this one (per-file galleries, migrations)."""
+        return [self]
+
+    def locate(self, user_id):
+        return self
+
+    def fan_out(self, func):
+        """func(partition) for every partition, in parallel; results in partition order."""
+        return [func(self)]
+
+
+def _biometric_updates(voice, face, voice_template=None, voice_stats=None):
+    updates = {name: value for name, value in (("voice", voice), ("face", face)) if value is not None}
+    if not updates:
+        raise ValueError("update_biometrics needs a voice or a face")
+    if voice is not None:
+        # a template of the previous recordings must not outlive them
+        updates.update(voice_template=voice_template, voice_stats=voice_stats)
+    return updates
+
+
+class SQLiteUserStore(UserStore):
+    """Users in one SQLite file. Every call uses its own connection, so a store
+    can be shared between threads."""
+
+    def __init__(self, path, shard_index=0, shard_count=1, timeout=30.0):
+        self.path = path
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"SQLiteUserStore({self.path!r})"
+
+    def connect(self, **kwargs):
+        return sqlite3.connect(self.path, timeout=self.timeout, **kwargs)
+
+    def initialize(self):
+        """Creates the users table if needed and brings older databases up to date."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE,
+                password TEXT,
+                voice BLOB,
+                face BLOB,
+                phone TEXT,
+                otp_provider TEXT DEFAULT 'twilio',
+                totp_secret TEXT,
+                voice_template BLOB,
+                voice_stats TEXT,
+                totp_step INTEGER
+            )
+        ''')
+
+        # Databases created before 2FA providers were pluggable lack the new columns
+        cursor.execute("PRAGMA table_info(users)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if "otp_provider" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN otp_provider TEXT DEFAULT 'twilio'")
+        if "totp_secret" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN totp_secret TEXT")
+        # and before voice templates; their users are compared against the stored recording
+        if "voice_template" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN voice_template BLOB")
+        if "voice_stats" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN voice_stats TEXT")
+        # and before used TOTP codes were remembered
+        if "totp_step" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN totp_step INTEGER")
+
+        # a shard remembers its place, so opening it with another shard count fails loudly
+        cursor.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT)")
+        cursor.execute("INSERT OR IGNORE INTO store_meta VALUES ('shard', ?)",
+                       (f"{self.shard_index}/{self.shard_count}",))
+        stored = cursor.execute("SELECT value FROM store_meta WHERE key = 'shard'").fetchone()[0]
+        conn.commit()
+        conn.close()
+        if stored != f"{self.shard_index}/{self.shard_count}":
+            raise ValueError(f"{self.path} is shard {stored}, not {self.shard_index}/{self.shard_count}; "
+                             "reshard (python userStore.py reshard) to change the layout")
+
+    # ids
+
+    def global_id(self, local_id):
+        return local_id * self.shard_count + self.shard_index
+
+    def local_id(self, user_id):
+        return (user_id - self.shard_index) // self.shard_count
+
+    # single users
+
+    def get_user(self, username, columns=FIELDS):
+        """The user's columns as a dict, or None. "id" is the global id."""
+        conn = self.connect()
+        try:
+            row = conn.execute(f"SELECT {', '.join(columns)} FROM users WHERE username = ?", (username,)).fetchone()
+        finally:
+            conn.close()
+        return None if row is None else self._user(columns, row)
+
+    def _user(self, columns, row):
+        user = dict(zip(columns, row))
+        if "id" in user:
+            user["id"] = self.global_id(user["id"])
+        return user
+
+    def get_users(self, user_ids, columns=("id", "username")):
+        local_ids = [self.local_id(int(user_id)) for user_id in user_ids if int(user_id) >= 0]
+        if not local_ids:
+            return []
+        columns = ("id",) + tuple(column for column in columns if column != "id")
+        conn = self.connect()
+        try:
+            rows = conn.execute(f"SELECT {', '.join(columns)} FROM users "
+                                f"WHERE id IN ({','.join('?' * len(local_ids))})", local_ids).fetchall()
+        finally:
+            conn.close()
+        return [self._user(columns, row) for row in rows]
+
+    def update_biometrics(self, username, voice=None, face=None, voice_template=None, voice_stats=None):
+        updates = _biometric_updates(voice, face, voice_template, voice_stats)
+        conn = self.connect()
+        try:
+            updated = conn.execute(f"UPDATE users SET {', '.join(name + ' = ?' for name in updates)} "
+                                   "WHERE username = ?", (*updates.values(), username)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return updated > 0
+
+    def claim_totp_step(self, username, step):
+        conn = self.connect()
+        try:
+            # compare and set in one statement, so two processes can't both accept the same code
+            claimed = conn.execute("UPDATE users SET totp_step = ? WHERE username = ? "
+                                   "AND (totp_step IS NULL OR totp_step < ?)", (step, username, step)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return claimed > 0
+
+    def delete_user(self, username):
+        conn = self.connect()
+        try:
+            deleted = conn.execute("DELETE FROM users WHERE username = ?", (username,)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return deleted > 0
+
+    # bulk
+
+    @contextlib.contextmanager
+    def writer(self):
+        """A transaction for many inserts: commits on exit (or writer.commit()),
+        rolls back on an exception."""
+        writer = _SQLiteWriter(self)
+        try:
+            yield writer
+            writer.commit()
+        finally:
+            writer.close()
+
+    def iterate_users(self, columns=FIELDS, batch_size=ITERATE_BATCH):
+        """Streams users as dicts, batch_size rows in memory at a time."""
+        conn = self.connect()
+        try:
+            cursor = conn.execute(f"SELECT {', '.join(columns)} FROM users ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._user(columns, row)
+        finally:
+            conn.close()
+
+    def count(self):
+        conn = self.connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        finally:
+            conn.close()
+
+
+class _SQLiteWriter:
+    def __init__(self, store):
+        self.store = store
+        # a sharded writer hands the connection to pool threads, one at a time
+        self.conn = store.connect(check_same_thread=False)
+        self.conn.isolation_level = None
+
+    def insert_many(self, users):
+        """Inserts users with one executemany; returns [{"username", "id"}] in order,
+        id None for usernames already taken (in the table or earlier in users)."""
+        if not self.conn.in_transaction:
+            # IMMEDIATE takes the write lock now, so the ids computed below can't be raced
+            self.conn.execute("BEGIN IMMEDIATE")
+        usernames = [user["username"] for user in users]
+        taken = set()
+        for start in range(0, len(usernames), 500):  # SQLite's bound-parameter limit
+            chunk = usernames[start:start + 500]
+            taken.update(row[0] for row in self.conn.execute(
+                f"SELECT username FROM users WHERE username IN ({','.join('?' * len(chunk))})", chunk))
+        rows, results = [], []
+        for user in users:
+            if user["username"] in taken:
+                results.append({"username": user["username"], "id": None})
+            else:
+                taken.add(user["username"])
+                rows.append(tuple(user.get(field) for field in FIELDS))
+                results.append({"username": user["username"], "id": 0})
+        if rows:
+            first = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+            first = max(first, self._sequence()) + 1
+            self.conn.executemany(f"INSERT INTO users ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                                  rows)
+            # AUTOINCREMENT hands out consecutive ids within the transaction
+            inserted = iter(range(first, first + len(rows)))
+            for result in results:
+                if result["id"] is not None:
+                    result["id"] = self.store.global_id(next(inserted))
+        return results
+
+    def _sequence(self):
+        row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'users'").fetchone()
+        return row[0] if row else 0
+
+    def commit(self):
+        if self.conn.in_transaction:
+            self.conn.execute("COMMIT")
+
+    def close(self):
+        if self.conn.in_transaction:
+            self.conn.execute("ROLLBACK")
+        self.conn.close()
+
+
+class ShardedUserStore(UserStore):
+    """Users spread over several SQLiteUserStores by a hash of the username."""
+
+    def __init__(self, paths, timeout=30.0):
+        self.shards = [SQLiteUserStore(path, index, len(paths), timeout) for index, path in enumerate(paths)]
+        self.pool = ThreadPoolExecutor(len(paths), thread_name_prefix="userStore")
+
+    def __repr__(self):
+        return f"ShardedUserStore({[shard.path for shard in self.shards]!r})"
+
+    def shard_for(self, username):
+        # crc32 is stable across processes and platforms, unlike hash()
+        return self.shards[zlib.crc32(username.encode("utf-8")) % len(self.shards)]
+
+    def locate(self, user_id):
+        return self.shards[user_id % len(self.shards)]
+
+    def partitions(self):
+        return list(self.shards)
+
+    def fan_out(self, func):
+        return list(self.pool.map(func, self.shards))
+
+    def initialize(self):
+        self.fan_out(SQLiteUserStore.initialize)
+
+    def get_user(self, username, columns=FIELDS):
+        return self.shard_for(username).get_user(username, columns)
+
+    def exists(self, username):
+        return self.shard_for(username).exists(username)
+
+    def get_users(self, user_ids, columns=("id", "username")):
+        by_shard = {}
+        for user_id in user_ids:
+            if int(user_id) >= 0:
+                by_shard.setdefault(self.locate(int(user_id)), []).append(user_id)
+        return [user for shard, ids in by_shard.items() for user in shard.get_users(ids, columns)]
+
+    def create_user(self, user):
+        return self.shard_for(user["username"]).create_user(user)
+
+    def update_biometrics(self, username, voice=None, face=None, voice_template=None, voice_stats=None):
+        return self.shard_for(username).update_biometrics(username, voice, face, voice_template, voice_stats)
+
+    def claim_totp_step(self, username, step):
+        return self.shard_for(username).claim_totp_step(username, step)
+
+    def delete_user(self, username):
+        return self.shard_for(username).delete_user(username)
+
+    @contextlib.contextmanager
+    def writer(self):
+        """One transaction per shard, committed together (not atomically across shards)."""
+        writer = _ShardedWriter(self)
+        try:
+            yield writer
+            writer.commit()
+        finally:
+            writer.close()
+
+    def iterate_users(self, columns=FIELDS, batch_size=ITERATE_BATCH):
+        """Streams users from every shard at once (in no particular order), about
+        batch_size rows in memory in total."""
+        batch_size = max(1, batch_size // len(self.shards))
+        batches = queue.Queue(maxsize=len(self.shards))
+        done = object()
+        stop = threading.Event()
+
+        def read(shard):
+            try:
+                batch = []
+                for user in shard.iterate_users(columns, batch_size):
+                    batch.append(user)
+                    if len(batch) == batch_size:
+                        if stop.is_set():
+                            return
+                        batches.put(batch)
+                        batch = []
+                if batch:
+                    batches.put(batch)
+            except Exception as e:
+                batches.put(e)
+            finally:
+                batches.put(done)
+
+        readers = [threading.Thread(target=read, args=(shard,), daemon=True) for shard in self.shards]
+        for reader in readers:
+            reader.start()
+        remaining = len(readers)
+        try:
+            while remaining:
+                item = batches.get()
+                if item is done:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            # a consumer that stops early unblocks the readers
+            stop.set()
+            while any(reader.is_alive() for reader in readers):
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def count(self):
+        return sum(self.fan_out(SQLiteUserStore.count))
+
+
+class _ShardedWriter:
+    def __init__(self, store):
+        self.store = store
+        self.writers = {}
+
+    def _writer(self, shard):
+        if shard not in self.writers:
+            self.writers[shard] = _SQLiteWriter(shard)
+        return self.writers[shard]
+
+    def insert_many(self, users):
+        by_shard = {}
+        for position, user in enumerate(users):
+            by_shard.setdefault(self.store.shard_for(user["username"]), []).append(position)
+        for shard in by_shard:
+            self._writer(shard)
+        # each shard inserts its part in parallel (SQLite releases the GIL)
+        parts = list(by_shard.items())
+        inserted = self.store.pool.map(
+            lambda part: self.writers[part[0]].insert_many([users[position] for position in part[1]]), parts)
+        results = [None] * len(users)
+        for (_, positions), part_results in zip(parts, inserted):
+            for position, result in zip(positions, part_results):
+                results[position] = result
+        return results
+
+    def commit(self):
+        for writer in self.writers.values():
+            writer.commit()
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+class MemoryUserStore(UserStore):
+    """Users in dicts of this process: no files, no persistence. Thread-safe;
+    ids are handed out like AUTOINCREMENT (never reused)."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = {}  # username -> user dict with "id"
+        self.by_id = {}  # id -> the same dict
+        self.last_id = 0
+
+    def __repr__(self):
+        return f"MemoryUserStore({len(self.users)} users)"
+
+    def _user(self, user, columns):
+        return {column: user.get(column) for column in columns}
+
+    def get_user(self, username, columns=FIELDS):
+        with self.lock:
+            user = self.users.get(username)
+            return None if user is None else self._user(user, columns)
+
+    def get_users(self, user_ids, columns=("id", "username")):
+        columns = ("id",) + tuple(column for column in columns if column != "id")
+        with self.lock:
+            return [self._user(self.by_id[user_id], columns) for user_id in map(int, user_ids)
+                    if user_id in self.by_id]
+
+    def update_biometrics(self, username, voice=None, face=None, voice_template=None, voice_stats=None):
+        updates = _biometric_updates(voice, face, voice_template, voice_stats)
+        with self.lock:
+            if username not in self.users:
+                return False
+            self.users[username].update(updates)
+        return True
+
+    def claim_totp_step(self, username, step):
+        with self.lock:
+            user = self.users.get(username)
+            if user is None or (user.get("totp_step") is not None and user["totp_step"] >= step):
+                return False
+            user["totp_step"] = step
+        return True
+
+    def delete_user(self, username):
+        with self.lock:
+            user = self.users.pop(username, None)
+            if user is not None:
+                del self.by_id[user["id"]]
+        return user is not None
+
+    @contextlib.contextmanager
+    def writer(self):
+        """Inserts are visible at once; an exception removes those not yet committed."""
+        writer = _MemoryWriter(self)
+        try:
+            yield writer
+            writer.commit()
+        finally:
+            writer.close()
+
+    def iterate_users(self, columns=FIELDS, batch_size=ITERATE_BATCH):
+        with self.lock:
+            ids = sorted(self.by_id)
+        for start in range(0, len(ids), batch_size):
+            with self.lock:
+                # users deleted since the scan started are skipped
+                batch = [self._user(self.by_id[user_id], columns) for user_id in ids[start:start + batch_size]
+                         if user_id in self.by_id]
+            yield from batch
+
+    def count(self):
+        with self.lock:
+            return len(self.users)
+
+
+class _MemoryWriter:
+    def __init__(self, store):
+        self.store = store
+        self.uncommitted = []
+
+    def insert_many(self, users):
+        store = self.store
+        results = []
+        with store.lock:
+            for user in users:
+                if user["username"] in store.users:
+                    results.append({"username": user["username"], "id": None})
+                    continue
+                store.last_id += 1
+                stored = dict({field: user.get(field) for field in FIELDS}, id=store.last_id)
+                store.users[user["username"]] = store.by_id[store.last_id] = stored
+                self.uncommitted.append(stored)
+                results.append({"username": user["username"], "id": store.last_id})
+        return results
+
+    def commit(self):
+        self.uncommitted = []
+
+    def close(self):
+        with self.store.lock:
+            for user in self.uncommitted:
+                self.store.users.pop(user["username"], None)
+                self.store.by_id.pop(user["id"], None)
+        self.uncommitted = []
+
+
+def reshard(source, target, batch_size=500, transaction_size=5000):
+    """Copies every user from one store into another (e.g. 1 file -> 4 shards).
+
+    Ids change, so the embedding galleries of the target are rebuilt by their
+    next sync. Returns the number of users copied.
+    """
+    target.initialize()
+    copied = uncommitted = 0
+    with target.writer() as writer:
+        batch = []
+        for user in source.iterate_users(FIELDS, batch_size):
+            batch.append(user)
+            if len(batch) == batch_size:
+                copied += sum(result["id"] is not None for result in writer.insert_many(batch))
+                uncommitted += len(batch)
+                batch = []
+                if uncommitted >= transaction_size:
+                    writer.commit()
+                    uncommitted = 0
+        if batch:
+            copied += sum(result["id"] is not None for result in writer.insert_many(batch))
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="User store layout: stats and resharding.")
+    parser.add_argument("command", choices=["stats", "reshard"])
+    parser.add_argument("--db", default="user_auth.db")
+    parser.add_argument("--shards", type=int, default=SHARDS, help="current shard count (0/1 = single file)")
+    parser.add_argument("--to-shards", type=int, help="reshard: new shard count (0/1 = single file)")
+    args = parser.parse_args()
+
+    source = open_store(args.db, args.shards, "sqlite")
+    if args.command == "stats":
+        for partition in source.partitions():
+            size = os.path.getsize(partition.path) if os.path.exists(partition.path) else 0
+            print(f"{partition.path}: {partition.count()} users, {size / 1024:.0f} KB")
+        return
+
+    if args.to_shards is None:
+        parser.error("reshard needs --to-shards")
+    target = open_store(args.db, args.to_shards, "sqlite")
+    sources = {partition.path for partition in source.partitions()}
+    for partition in target.partitions():
+        if partition.path in sources or os.path.exists(partition.path):
+            parser.error(f"{partition.path} already exists; move it away first")
+        # galleries left behind by an earlier database at this path hold other ids
+        for kind in ("voice", "face"):
+            for suffix in (".emb", ".ids"):
+                stale = f"{os.path.splitext(partition.path)[0]}.{kind}{suffix}"
+                if os.path.exists(stale):
+                    os.remove(stale)
+    try:
+        copied = reshard(source, target)
+    except BaseException:
+        # don't leave a half-copied layout that the next attempt refuses to overwrite
+        for partition in target.partitions():
+            if os.path.exists(partition.path):
+                os.remove(partition.path)
+        raise
+    print(f"{copied} users copied to {', '.join(partition.path for partition in target.partitions())}")
+    print(f"Set USER_STORE_SHARDS={args.to_shards if args.to_shards > 1 else 0} to use the new layout.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# File: voiceCodec.py
+# Description: Storage format for the voice recordings in users.voice.
+# A plain 16-bit wav costs 32 KB per second of speech. Encoded blobs start with
+# a small versioned header followed by the samples, compressed losslessly the
+# way FLAC does it: a fixed linear predictor (order 0-3, picked per recording)
+# and Rice-coded residuals. Mode "trimmed" additionally
+# cuts leading/trailing silence first. decode() also reads the legacy wav
+# blobs, so old rows keep working; `python voiceCodec.py --db user_auth.db`
+# migrates them.
+
+import argparse
+import io
+import os
+import sqlite3
+import struct
+import wave
+import zlib
+
+import numpy as np
+
+import userStore
+
+MAGIC = b"VCOD"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBBIII")  # magic, version, codec, predictor order, flags, rate, samples, crc32
+
+CODEC_LOSSLESS = 1
+FLAG_TRIMMED = 1
+
+MODES = ("lossless", "trimmed", "wav")
+# how newly recorded voices are stored
+DEFAULT_MODE = os.getenv("VOICE_STORAGE", "lossless")
+
+# trimming: 20 ms frames quieter than this fraction of the loudest frame are
+# silence, and 200 ms of it is kept around the speech
+TRIM_FRAME = 320
+TRIM_LEVEL = 0.05
+TRIM_MARGIN = 3200
+
+MAX_ORDER = 3
+RICE_BLOCK = 4096  # samples sharing one Rice parameter
+
+
+def is_encoded(blob):
+    return bytes(blob[:4]) == MAGIC
+
+
+def _read_wav(blob):
+    with wave.open(io.BytesIO(blob), 'rb') as waveFile:
+        channels = waveFile.getnchannels()
+        rate = waveFile.getframerate()
+        sampleWidth = waveFile.getsampwidth()
+        frames = waveFile.readframes(waveFile.getnframes())
+    if sampleWidth != 2:
+        raise ValueError(f"Only 16-bit wav audio is supported (got {8 * sampleWidth}-bit)")
+    samples = np.frombuffer(frames, dtype="<i2")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples, rate
+
+
+def wav_bytes(samples, rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as waveFile:
+        waveFile.setnchannels(1)
+        waveFile.setsampwidth(2)
+        waveFile.setframerate(rate)
+        waveFile.writeframes(np.ascontiguousarray(samples, dtype="<i2").tobytes())
+    return buffer.getvalue()
+
+
+def trim_silence(samples):
+    """Cuts leading and trailing silence, keeping TRIM_MARGIN samples around the speech."""
+    frames = len(samples) // TRIM_FRAME
+    if frames == 0:
+        return samples
+    energy = np.sqrt(np.mean(samples[:frames * TRIM_FRAME].astype(np.float32).reshape(frames, TRIM_FRAME) ** 2,
+                             axis=1))
+    loud = np.flatnonzero(energy >= TRIM_LEVEL * energy.max()) if energy.max() > 0 else []
+    if len(loud) == 0:
+        return samples
+    start = max(0, loud[0] * TRIM_FRAME - TRIM_MARGIN)
+    end = min(len(samples), (loud[-1] + 1) * TRIM_FRAME + TRIM_MARGIN)
+    return samples[start:end]
+
+
+def _residual(samples, order):
+    # x[n] minus its order-k polynomial prediction; the first k values carry the warm-up samples
+    samples = samples.astype(np.int64)
+    if order == 0:
+        return samples
+    return np.diff(samples, n=order, prepend=np.zeros(order, dtype=np.int64))
+
+
+def _rice_parameter(values):
+    # Rice parameter close to optimal for a block: log2 of the mean value
+    mean = float(values.mean()) if len(values) else 0.0
+    return int(np.log2(mean + 1)) if mean >= 1 else 0
+
+
+def _compress(samples):
+    # the order with the smallest residual energy, like FLAC's fixed predictors
+    order = min(range(MAX_ORDER + 1), key=lambda k: np.abs(_residual(samples, k)).sum())
+    residual = _residual(samples, order)
+    values = ((residual << 1) ^ (residual >> 63)).astype(np.uint64)  # zigzag: small magnitudes -> small values
+
+    # Rice codes, with the unary quotients and the fixed-width remainders kept in two
+    # separate bit streams so both can be packed and unpacked without a per-sample loop
+    parameters = np.array([_rice_parameter(values[start:start + RICE_BLOCK])
+                           for start in range(0, len(values), RICE_BLOCK)], dtype=np.uint8)
+    shifts = np.repeat(parameters, RICE_BLOCK)[:len(values)].astype(np.uint64)
+    quotients = (values >> shifts).astype(np.int64)
+    unary = np.ones(int(quotients.sum()) + len(values), dtype=np.uint8)
+    unary[np.cumsum(quotients + 1) - 1] = 0
+
+    remainders = []
+    for block, parameter in enumerate(parameters):
+        chunk = values[block * RICE_BLOCK:(block + 1) * RICE_BLOCK]
+        bits = np.arange(int(parameter) - 1, -1, -1, dtype=np.uint64)
+        remainders.append(((chunk[:, None] >> bits) & 1).astype(np.uint8).reshape(-1))
+    unary_bytes = np.packbits(unary).tobytes()
+    remainder_bytes = np.packbits(np.concatenate(remainders) if remainders else np.zeros(0, np.uint8)).tobytes()
+    return order, struct.pack("<I", len(unary_bytes)) + parameters.tobytes() + unary_bytes + remainder_bytes
+
+
+def _decompress(payload, order, count):
+    blocks = -(-count // RICE_BLOCK)
+    unary_length = struct.unpack_from("<I", payload)[0]
+    parameters = np.frombuffer(payload, dtype=np.uint8, count=blocks, offset=4)
+    unary = np.unpackbits(np.frombuffer(payload, dtype=np.uint8, count=unary_length, offset=4 + blocks))
+    remainder_bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8, offset=4 + blocks + unary_length))
+
+    # every value's quotient is the run of ones before its terminating zero
+    terminators = np.flatnonzero(unary == 0)[:count]
+    quotients = np.diff(terminators, prepend=-1) - 1
+    values = np.empty(count, dtype=np.uint64)
+    position = 0
+    for block, parameter in enumerate(parameters):
+        parameter = int(parameter)
+        start, end = block * RICE_BLOCK, min(count, (block + 1) * RICE_BLOCK)
+        bits = remainder_bits[position:position + (end - start) * parameter].reshape(end - start, parameter)
+        position += bits.size
+        remainders = bits.astype(np.uint64) @ (np.uint64(1) << np.arange(parameter - 1, -1, -1, dtype=np.uint64)) \
+            if parameter else np.zeros(end - start, dtype=np.uint64)
+        values[start:end] = (quotients[start:end].astype(np.uint64) << np.uint64(parameter)) | remainders
+
+    samples = (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+    for _ in range(order):
+        samples = np.cumsum(samples)
+    return samples.astype(np.int16)
+
+
+def encode(audio, mode=DEFAULT_MODE, sample_rate=16000):
+    """Encodes a recording for storage.
+
+    `audio` is a wav blob (legacy format), an already encoded blob or an int16
+    array at `sample_rate`. mode "wav" returns a plain wav file instead.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown voice storage mode {mode!r} (choose from {', '.join(MODES)})")
+    if isinstance(audio, np.ndarray):
+        samples, rate = audio.astype(np.int16, copy=False), sample_rate
+    else:
+        samples, rate = decode(audio)
+
+    if mode == "wav":
+        return wav_bytes(samples, rate)
+    flags = 0
+    if mode == "trimmed":
+        samples = trim_silence(samples)
+        flags |= FLAG_TRIMMED
+    order, payload = _compress(samples)
+    crc = zlib.crc32(np.ascontiguousarray(samples, dtype="<i2"))
+    return HEADER.pack(MAGIC, VERSION, CODEC_LOSSLESS, order, flags, rate, len(samples), crc) + payload
+
+
+def stored_mode(blob):
+    """The mode a blob was written with ("wav" for legacy blobs)."""
+    if not is_encoded(blob):
+        return "wav"
+    return "trimmed" if HEADER.unpack_from(blob)[4] & FLAG_TRIMMED else "lossless"
+
+
+def info(blob):
+    """Header fields of a blob as a dict (legacy wav blobs report codec "wav")."""
+    if not is_encoded(blob):
+        with wave.open(io.BytesIO(blob), 'rb') as waveFile:
+            return {"codec": "wav", "version": 0, "rate": waveFile.getframerate(),
+                    "samples": waveFile.getnframes(), "trimmed": False, "bytes": len(blob)}
+    _, version, codec, order, flags, rate, count, _ = HEADER.unpack_from(blob)
+    return {"codec": "lossless", "version": version, "order": order, "rate": rate, "samples": count,
+            "trimmed": bool(flags & FLAG_TRIMMED), "bytes": len(blob)}
+
+
+def decode(blob):
+    """Returns (int16 samples, sample rate) of an encoded or legacy wav blob."""
+    if not is_encoded(blob):
+        return _read_wav(blob)
+
+    _, version, codec, order, _, rate, count, crc = HEADER.unpack_from(blob)
+    if version > VERSION:
+        raise ValueError(f"Voice blob version {version} is newer than this codec ({VERSION})")
+    if codec != CODEC_LOSSLESS:
+        raise ValueError(f"Unknown voice codec {codec}")
+    samples = _decompress(memoryview(blob)[HEADER.size:], order, count)
+    if zlib.crc32(samples) != crc:
+        raise ValueError("Voice blob is corrupted (checksum mismatch)")
+    return samples, rate
+
+
+def migrate(db_path, mode=DEFAULT_MODE, batch=200, vacuum=True):
+    """Re-encodes every users.voice blob not yet in `mode`. Returns size statistics."""
+    conn = sqlite3.connect(db_path)
+    stats = {"rows": 0, "converted": 0, "voice_bytes_before": 0, "voice_bytes_after": 0,
+             "file_bytes_before": os.path.getsize(db_path)}
+    last = 0
+    while True:
+        # a page at a time by rowid, so only `batch` recordings are in memory
+        rows = conn.execute("SELECT rowid, voice FROM users WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                            (last, batch)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for rowid, voice in rows:
+            last = rowid
+            if voice is None:
+                continue
+            stats["rows"] += 1
+            stats["voice_bytes_before"] += len(voice)
+            if stored_mode(voice) == mode:
+                stats["voice_bytes_after"] += len(voice)
+                continue
+            encoded = encode(voice, mode)
+            stats["voice_bytes_after"] += len(encoded)
+            updates.append((encoded, rowid))
+        conn.executemany("UPDATE users SET voice = ? WHERE rowid = ?", updates)
+        conn.commit()
+        stats["converted"] += len(updates)
+    if vacuum:
+        conn.execute("VACUUM")  # give the freed pages back to the file system
+    conn.close()
+    stats["file_bytes_after"] = os.path.getsize(db_path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encode the stored voice recordings.")
+    parser.add_argument("--db", default="user_auth.db")
+    parser.add_argument("--shards", type=int, default=userStore.SHARDS, help="user store shard count")
+    parser.add_argument("--mode", choices=MODES, default="lossless",
+                        help="lossless (exact samples), trimmed (silence cut) or wav (undo the migration)")
+    parser.add_argument("--no-vacuum", action="store_true", help="don't compact the database file afterwards")
+    args = parser.parse_args()
+
+    # every database file of the store (each shard when it is sharded)
+    stats = {}
+    for partition in userStore.open_store(args.db, args.shards, "sqlite").partitions():
+        for key, value in migrate(partition.path, args.mode, vacuum=not args.no_vacuum).items():
+            stats[key] = stats.get(key, 0) + value
+    before, after = stats["voice_bytes_before"], stats["voice_bytes_after"]
+    print(f"{stats['converted']} of {stats['rows']} voice recordings re-encoded as {args.mode}")
+    if before:
+        print(f"voice column: {before / 1024:.1f} KB -> {after / 1024:.1f} KB ({100 * (after / before - 1):+.1f}%)")
+    print(f"database file: {stats['file_bytes_before'] / 1024:.1f} KB -> {stats['file_bytes_after'] / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
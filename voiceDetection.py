@@ -10,14 +10,50 @@
 # pip install scipy 
 # pip install torch
 
+import io
+import json
 import wave
-import pyaudio
 import threading
-import torch
-from pyannote.audio import Model, Inference
-from scipy.spatial.distance import cdist
 import numpy as np
 import os
+import metrics
+import embeddingCache
+import voiceCodec
+
+# pyaudio, torch, pyannote.audio and scipy take seconds to import, so they are
+# only imported once a recording or a voice comparison actually happens
+
+# Hugging Face token for the gated pyannote model (details in the phase 2 report)
+HF_AUTH_TOKEN = ""
+SPEAKER_MODEL = "pyannote/wespeaker-voxceleb-resnet34-LM"
+
+# with a threshold of 60%, a cosine distance up to 0.40 is the same speaker
+VOICE_THRESHOLD = 0.40
+
+# the model (and our recordings) use 16 kHz mono audio
+SAMPLE_RATE = 16000
+
+# samples per feature frame (10 ms), the resolution of the padding mask in embed_batch
+FRAME_HOP = 160
+
+# "host:port" of an embeddingWorkers.py pool; when set, embeddings are computed there
+EMBEDDING_SERVER = os.getenv("VOICE_EMBEDDING_SERVER") or None
+
+# recordings taken at registration; their embeddings are averaged into one
+# L2-normalised centroid (the voice template) that logins are compared against
+VOICE_ENROLL_SAMPLES = max(1, int(os.getenv("VOICE_ENROLL_SAMPLES", "1")))
+TEMPLATE_DTYPE = np.dtype("<f4")
+
+# CPU inference backend: "eager" (fp32), "bf16", "quantized" or "torchscript",
+# see speakerBackend.py; VOICE_THREADS > 0 also fixes torch's intra-op threads
+VOICE_BACKEND = os.getenv("VOICE_BACKEND", "eager")
+VOICE_THREADS = int(os.getenv("VOICE_THREADS", "0"))
+
+_model = None  # the model as run by the backend
+_base_model = None  # the fp32 model the backend was built from
+_model_version = SPEAKER_MODEL  # part of the embedding cache key
+_backend = VOICE_BACKEND
+_model_lock = threading.Lock()
 
 def registerVoice():
     recordAudio("registerVoice.wav")
@@ -28,50 +64,283 @@ def registerVoice():
 
     removeAudioFile("registerVoice.wav")
 
-    return voiceBLOB;
+    # stored compressed (see voiceCodec.py), every reader decodes it transparently
+    return voiceCodec.encode(voiceBLOB);
+
+def registerVoiceSamples(samples=VOICE_ENROLL_SAMPLES):
+    # several enrollment recordings, each encoded for storage
+    recordings = []
+    for sample in range(samples):
+        if samples > 1:
+            print(f"Recording sample {sample + 1} of {samples}...")
+        recordings.append(registerVoice())
+    return recordings
 
 def removeAudioFile(filename):
     # deleting the created audio file
     os.remove(filename)
 
-# this method is used to authenticate a speaker through their voice in audio the two files
-def authenticateVoice(blob):
-    recordAudio("authenticateVoice.wav")
-
-    # loading the model from hugging face
-    model = Model.from_pretrained("pyannote/wespeaker-voxceleb-resnet34-LM", use_auth_token="")
-    inference = Inference(model, window="whole")
-
-    embedding1 = inference("authenticateVoice.wav")
-    removeAudioFile("authenticateVoice.wav")
-
-    # creating the audio clip from a BLOB 
-    with open("registerVoice.wav", "wb") as file:
-        file.write(blob)
+def get_model():
+    """Loads the speaker embedding model on first use and keeps it for later calls."""
+    global _model, _base_model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                with metrics.span("voice.model_load"):
+                    if _base_model is None:
+                        from pyannote.audio import Model
+
+                        # loading the model from hugging face
+                        model = Model.from_pretrained(SPEAKER_MODEL, use_auth_token=HF_AUTH_TOKEN)
+                        model.eval()
+                        _base_model = model
+                    import speakerBackend
+                    _model = speakerBackend.prepare(_base_model, _backend, VOICE_THREADS)
+    return _model
+
+def set_model(model, version="custom"):
+    # replaces the speaker model, e.g. with an untrained one for offline benchmarks
+    # (the version keeps its embeddings apart from the real model's in the cache)
+    global _model, _base_model, _model_version
+    model.eval()
+    with _model_lock:
+        _base_model = model
+        _model = None
+        _model_version = version
+    get_model()
+
+def install_untrained_model(seed=0):
+    # a randomly initialised WeSpeaker ResNet34, so benchmarks (and worker pools
+    # started for them) run without the gated Hugging Face weights; timings match
+    # the real model, scores do not
+    import torch
+    from pyannote.audio.models.embedding import WeSpeakerResNet34
+    torch.manual_seed(seed)
+    set_model(WeSpeakerResNet34(), version=f"untrained-resnet34-seed{seed}")
+
+def set_backend(backend):
+    # switches the inference backend; the model is rebuilt from the fp32 weights on next use
+    global _model, _backend
+    import speakerBackend
+    if backend not in speakerBackend.BACKENDS:
+        raise ValueError(f"Unknown speaker backend {backend!r}")
+    with _model_lock:
+        _backend = backend
+        _model = None
+
+def model_version():
+    # backends other than eager give (slightly) different embeddings, so they are cached apart
+    return _model_version if _backend == "eager" else f"{_model_version}+{_backend}"
+
+def load_waveform(audio):
+    """Returns a recording as a float32 mono array at SAMPLE_RATE.
+
+    `audio` can be a wav file path, a voice BLOB from the database (a voiceCodec
+    blob or, in older rows, a wav file) or an int16/float array that is already
+    at SAMPLE_RATE.
+    """
+    if isinstance(audio, np.ndarray):
+        if audio.dtype == np.int16:
+            return audio.astype(np.float32) / 32768.0
+        return audio.astype(np.float32, copy=False)
+
+    if isinstance(audio, (bytes, bytearray, memoryview)) and voiceCodec.is_encoded(audio):
+        samples, rate = voiceCodec.decode(audio)
+        waveform = samples.astype(np.float32) / 32768.0
+    else:
+        source = io.BytesIO(audio) if isinstance(audio, (bytes, bytearray, memoryview)) else audio
+        with wave.open(source, 'rb') as waveFile:
+            channels = waveFile.getnchannels()
+            rate = waveFile.getframerate()
+            sampleWidth = waveFile.getsampwidth()
+            frames = waveFile.readframes(waveFile.getnframes())
+
+        if sampleWidth != 2:
+            raise ValueError(f"Only 16-bit wav audio is supported (got {8 * sampleWidth}-bit)")
+
+        waveform = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+        if channels > 1:
+            waveform = waveform.reshape(-1, channels).mean(axis=1)
+    if rate != SAMPLE_RATE:
+        from math import gcd
+        from scipy.signal import resample_poly
+        divisor = gcd(rate, SAMPLE_RATE)
+        waveform = resample_poly(waveform, SAMPLE_RATE // divisor, rate // divisor).astype(np.float32)
+    return waveform
+
+def embed(audio):
+    # speaker embedding of a whole recording (see load_waveform for the accepted inputs)
+    if EMBEDDING_SERVER:
+        import embeddingWorkers
+        with metrics.span("voice.embedding"):
+            return embeddingWorkers.get_client(EMBEDDING_SERVER).embed(audio)
+
+    import torch
+    waveform = load_waveform(audio)
+    model = get_model()
+    with metrics.span("voice.embedding"), torch.inference_mode():
+        embedding = model(torch.from_numpy(waveform)[None, None])
+    return embedding[0].numpy()
+
+def _pad_batch(waveforms):
+    # pads the recordings to the longest one by repeating them (silence would
+    # drag down the feature mean the model normalizes by); the mask marks real
+    # samples at the 10 ms frame rate so statistics pooling ignores the padding
+    longest = max(waveform.shape[0] for waveform in waveforms)
+    batch = np.empty((len(waveforms), 1, longest), dtype=np.float32)
+    mask = np.zeros((len(waveforms), -(-longest // FRAME_HOP)), dtype=np.float32)
+    for row, waveform in enumerate(waveforms):
+        batch[row, 0] = np.resize(waveform, longest)
+        mask[row, :-(-waveform.shape[0] // FRAME_HOP)] = 1.0
+    return batch, mask
+
+def embed_batch(waveforms):
+    """Embeddings of several load_waveform() arrays in one forward pass, as a (len, dim) array."""
+    import inspect
+    import torch
+    model = get_model()
+    batch, mask = _pad_batch(waveforms)
+    with metrics.span("voice.embedding_batch"), torch.inference_mode():
+        if mask.all() or "weights" not in inspect.signature(model.forward).parameters:
+            output = model(torch.from_numpy(batch))
+        else:
+            output = model(torch.from_numpy(batch), weights=torch.from_numpy(mask))
+    return output.numpy()
+
+def _buckets(waveforms, batch_size, max_padding):
+    # sorts (index, waveform) pairs by length and cuts them into batches whose
+    # shortest recording is padded by at most max_padding of the longest one
+    waveforms = sorted(waveforms, key=lambda item: item[1].shape[0], reverse=True)
+    batch = []
+    for item in waveforms:
+        if batch and (len(batch) == batch_size
+                      or item[1].shape[0] < (1.0 - max_padding) * batch[0][1].shape[0]):
+            yield batch
+            batch = []
+        batch.append(item)
+    if batch:
+        yield batch
+
+def embed_many(utterances, batch_size=8, lookahead=4, max_padding=0.25):
+    """Embeds many recordings in length-bucketed batches, yielding (index, embedding).
+
+    `utterances` can be any iterable (a generator over database rows, file
+    paths, ...) of what load_waveform accepts; `index` is the position in it.
+    Only batch_size * lookahead decoded recordings are held at a time, and their
+    embeddings are yielded as soon as each batch finishes, so results are not
+    in input order.
+    """
+    if EMBEDDING_SERVER:
+        # the pool batches concurrent requests itself
+        for index, audio in enumerate(utterances):
+            yield index, embed(audio)
+        return
+
+    def flush(window):
+        for batch in _buckets(window, batch_size, max_padding):
+            embeddings = embed_batch([waveform for _, waveform in batch])
+            yield from zip([index for index, _ in batch], embeddings)
+
+    window = []
+    for index, audio in enumerate(utterances):
+        window.append((index, load_waveform(audio)))
+        if len(window) >= batch_size * lookahead:
+            yield from flush(window)
+            window = []
+    yield from flush(window)
+
+def embed_cached(audio):
+    # same as embed() but remembered by audio content, for recordings that are
+    # embedded again and again (the enrollment BLOB is compared at every login)
+    cache = embeddingCache.get_cache()
+    key = embeddingCache.content_key(audio, model_version())
+    return cache.get_or_compute(key, lambda: embed(audio))
+
+def build_template(recordings):
+    """Voice template of one or more enrollment recordings, embedded in one batch.
+
+    Returns (template BLOB, stats JSON, index of the recording closest to the
+    centroid). The template is the L2-normalised mean of the normalised
+    embeddings; the stats hold the model version it belongs to and how far the
+    samples lie from it (cosine distance), a measure of how consistent they were.
+    """
+    if EMBEDDING_SERVER:
+        embeddings = np.stack([embed(audio) for audio in recordings])
+    else:
+        embeddings = embed_batch([load_waveform(audio) for audio in recordings])
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    centroid = embeddings.mean(axis=0)
+    centroid /= np.linalg.norm(centroid)
+    distances = 1.0 - embeddings @ centroid
+    stats = {"model": model_version(), "samples": len(recordings),
+             "mean_distance": round(float(distances.mean()), 4), "max_distance": round(float(distances.max()), 4)}
+    return centroid.astype(TEMPLATE_DTYPE).tobytes(), json.dumps(stats), int(np.argmin(distances))
+
+def template_vector(template, stats):
+    # the stored centroid, or None when there is none or another model (or backend) made it
+    if template is None or not stats:
+        return None
+    if json.loads(stats).get("model") != model_version():
+        return None
+    return np.frombuffer(template, dtype=TEMPLATE_DTYPE)
+
+def template_distance(embedding, centroid):
+    # cosine distance to a template: one dot product, the centroid is unit length already
+    with metrics.span("voice.distance"):
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        # (clamped, rounding can take an identical voice a hair below zero)
+        return max(0.0, float(1.0 - embedding @ centroid / np.linalg.norm(embedding)))
+
+def voice_distance(audio, stored_voice, template=None, stats=None):
+    """Cosine distance of a new recording from the enrolled voice.
+
+    Compared against the voice template when the user has a current one;
+    users enrolled before templates (or under another model) are compared
+    against their stored recording, embedded once and then cached.
+    """
+    embedding = embed(audio)
+    centroid = template_vector(template, stats)
+    if centroid is not None:
+        return template_distance(embedding, centroid)
+    return cosine_distance(embedding, embed_cached(stored_voice))
+
+def cosine_distance(embedding1, embedding2):
+    # reshapping the 1D arrays to 2D arrays to measure the distance
+    from scipy.spatial.distance import cdist
+    with metrics.span("voice.distance"):
+        embedding1 = np.array(embedding1).reshape(1, -1)
+        embedding2 = np.array(embedding2).reshape(1, -1)
 
-    embedding2 = inference("registerVoice.wav")
-    removeAudioFile("registerVoice.wav")
+        # (float) how dissimilar the two speakers are
+        return cdist(embedding1, embedding2, metric="cosine")[0, 0]
 
-    # reshapping the 1D arrays to 2D arrays to measure the distance
-    embedding1 = np.array(embedding1).reshape(1, -1)
-    embedding2 = np.array(embedding2).reshape(1, -1)
+# this method is used to authenticate a speaker through their voice in audio the two files
+def authenticateVoice(blob, return_distance=False, template=None, stats=None):
+    recordAudio("authenticateVoice.wav")
 
-    # The method returns (float) how dissimilar the two speakers in the audio files are
-    distance = cdist(embedding1, embedding2, metric="cosine")[0,0]
+    # against the user's voice template if they have one; otherwise the stored BLOB
+    # (a complete wav file) is embedded straight from memory, once, and then cached.
+    # The distance is (float) how dissimilar the two speakers are
+    try:
+        distance = voice_distance("authenticateVoice.wav", blob, template, stats)
+    finally:
+        removeAudioFile("authenticateVoice.wav")
 
     # with a threshold of 60%, check if the user is the once registered to the user login
-    if(distance <= 0.40):
+    if(distance <= VOICE_THRESHOLD):
         print("User Authenticated. Voice matched")
-        return True
-    elif(distance > 0.40):
+        matched = True
+    else:
         print("User Authentication failed. Voice did not match.")
-        return False
+        matched = False
 
-    return distance
+    # (matched, distance) for callers that log the score
+    return (matched, distance) if return_distance else matched
 
 # This function is used to record audio
 def recordAudio(filename):
-    
+    import pyaudio
+
     CHUNK = 1024
     FORMAT = pyaudio.paInt16
     CHANNELS = 1